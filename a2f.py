@@ -2,16 +2,23 @@ import retico_core
 from retico_core.audio import AudioIU
 from retico_core.text import TextIU
 from console_colors import ConsoleColors
+from a2f_sender import A2FSender
 
-
-from audio2face_api.A2F import Audio2FaceStream
+DEFAULT_PLAYER = "/World/audio2face/PlayerStreaming"
 
 import logging
 
 
 class A2FStream(retico_core.AbstractConsumingModule):
     """A module to stream the agents speech for audio play and non-verbal generation to Audio2Face
-    Use gRPC to stream the audio
+    Use gRPC to stream the audio, from a background thread (see a2f_sender.py) so a slow
+    A2F does not stall the module : the audio is sent in blocks of chunck_size samples
+    on one stream per utterance, queue_policy sets what happens when A2F falls behind.
+    On a barge-in (interruption) the queued audio is dropped and the stream closed.
+    The Audio2FaceStream of audio2face_api is the control client : it loads the scene
+    and sets up Livelink and the emotions through the REST API, it sends no audio.
+    The audio goes to the streaming player of the loaded scene, `instance_name` if
+    set, else the one listed by the REST API
     """
 
     @staticmethod
@@ -40,9 +47,31 @@ class A2FStream(retico_core.AbstractConsumingModule):
         use_keyframes=True,
         use_global_emotion=True,
         global_emotion={"joy": 0.9, "sadness": 0.1},
+        tracer=None,
+        instance_name=None,
+        max_queue_blocks=32,
+        queue_policy="block",
+        retention=None,
+        interruption=None,
         **kwargs,
     ):
         super().__init__(**kwargs)
+        from audio2face_api.A2F import Audio2FaceStream  # Only needed with --use_a2f
+
+        self.tracer = tracer  # Latency tracing, see metrics.py
+        self.retention = retention  # IU retention, see retention.py
+        self.epoch = 0
+        if interruption is not None:
+            interruption.subscribe(self.interrupt)
+        self.api_url = api_url
+        self.instance_name = instance_name
+        self.sender = A2FSender(
+            grpc_url=grpc_url,
+            instance_name=instance_name or DEFAULT_PLAYER,
+            chunk_size=chunck_size,
+            max_blocks=max_queue_blocks,
+            policy=queue_policy,
+        )
         self.a2f = Audio2FaceStream(
             grpc_url=grpc_url,
             chunk_size=chunck_size,
@@ -64,21 +93,64 @@ class A2FStream(retico_core.AbstractConsumingModule):
         self.a2f.a2e.set_auto_emotion_detect(auto_detect=self.use_keyframes)
         if self.use_global_emotion:
             self.a2f.a2e.set_gloabl_emotion(joy=0.95, amazement=0.05)
+        if self.instance_name is None:
+            self.sender.instance_name = self.streaming_player()
+        if not self.sender.is_alive():  # main.py sets the module up before the network
+            self.sender.connect()
+            self.sender.start()
         logging.info(
             f"{ConsoleColors.BLUE}A2FStream:{ConsoleColors.RESET} Setup Completed"
         )
 
+    def streaming_player(self):
+        """Path of the streaming audio player of the scene loaded in A2F"""
+        import requests
+
+        try:
+            response = requests.get(f"{self.api_url}/A2F/Player/GetInstances", timeout=5)
+            players = response.json()["result"]["streaming"]
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            players = []
+            logging.warning(
+                f"{ConsoleColors.YELLOW}A2FStream:{ConsoleColors.RESET} Could not list the A2F players : {e}"
+            )
+        if not players:
+            logging.warning(
+                f"{ConsoleColors.YELLOW}A2FStream:{ConsoleColors.RESET} No streaming player found, using {DEFAULT_PLAYER}"
+            )
+            return DEFAULT_PLAYER
+        logging.info(
+            f"{ConsoleColors.BLUE}A2FStream:{ConsoleColors.RESET} Streaming to the player {players[0]}"
+        )
+        return players[0]
+
+    def interrupt(self, epoch):
+        self.epoch = epoch
+        self.sender.cancel()
+        logging.debug(
+            f"{ConsoleColors.MAGENTA}A2FStream:{ConsoleColors.RESET} Stream interrupted"
+        )
+
     def process_update(self, update_message):
         for iu, ut in update_message:
-            if ut == retico_core.UpdateType.ADD or ut == retico_core.UpdateType.COMMIT:
-                frames = self.a2f.stream_audio(iu.raw_audio, iu.rate)
+            if iu.meta_data.get("epoch", self.epoch) < self.epoch:
+                pass  # Audio of an interrupted reply
+            elif ut == retico_core.UpdateType.ADD or ut == retico_core.UpdateType.COMMIT:
+                if self.tracer is not None and iu.nframes > 0:
+                    self.tracer.mark(iu.meta_data.get("trace_id"), "first_output")
+                self.sender.push(
+                    iu.raw_audio, iu.rate, ut == retico_core.UpdateType.COMMIT
+                )
                 logging.debug(
-                    f"{ConsoleColors.BLUE}A2FStream:{ConsoleColors.RESET} Streamed an audio"
+                    f"{ConsoleColors.BLUE}A2FStream:{ConsoleColors.RESET} Queued an audio"
                 )
+            if self.retention is not None:  # The sender copied the audio
+                self.retention.release(iu)
         return None
 
     def shutdown(self):
         logging.info(
             f"{ConsoleColors.BLUE}A2FStream:{ConsoleColors.RESET} Shutting Down"
         )
+        self.sender.stop()
         self.a2f.end_a2f_connection()
@@ -0,0 +1,267 @@
+import threading
+import time
+import logging
+from collections import deque
+
+import grpc
+import numpy as np
+
+from console_colors import ConsoleColors
+
+# Audio2Face streaming RPC, from audio2face.proto :
+#   rpc PushAudioStream(stream PushAudioStreamRequest) returns (PushAudioStreamResponse)
+#   PushAudioStreamRequest { oneof { PushAudioRequestStart start_marker = 1; bytes audio_data = 2; } }
+#   PushAudioRequestStart { string instance_name = 1; int32 samplerate = 2;
+#                           bool block_until_playback_is_finished = 3; }
+#   PushAudioStreamResponse { bool success = 1; string message = 2; }
+# The messages are small enough to be encoded by hand, no generated code is needed.
+PUSH_AUDIO_STREAM = "/nvidia.audio2face.Audio2Face/PushAudioStream"
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_bytes_field(number, payload):
+    return encode_varint(number << 3 | 2) + encode_varint(len(payload)) + payload
+
+
+def encode_varint_field(number, value):
+    return encode_varint(number << 3) + encode_varint(value)
+
+
+def encode_start_marker(instance_name, samplerate, block_until_playback_is_finished=False):
+    start = (
+        encode_bytes_field(1, instance_name.encode())
+        + encode_varint_field(2, samplerate)
+        + encode_varint_field(3, int(block_until_playback_is_finished))
+    )
+    return encode_bytes_field(1, start)
+
+
+def encode_audio_data(samples):
+    """A2F takes float32 samples"""
+    return encode_bytes_field(2, samples.astype(np.float32, copy=False).tobytes())
+
+
+def decode_fields(data):
+    """{field number : value} of a protobuf message, varint and length delimited fields"""
+    fields = {}
+    i = 0
+    while i < len(data):
+        key, i = decode_varint(data, i)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            fields[number], i = decode_varint(data, i)
+        elif wire_type == 2:
+            length, i = decode_varint(data, i)
+            fields[number] = data[i : i + length]
+            i += length
+        else:
+            raise ValueError(f"Unsupported wire type : {wire_type}")
+    return fields
+
+
+def decode_varint(data, i):
+    value, shift = 0, 0
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, i
+        shift += 7
+
+
+class A2FSender(threading.Thread):
+    """Streams the agent speech to Audio2Face from a background thread.
+
+    `push` coalesces the incoming audio into blocks of `chunk_size` samples and queues
+    them, the thread sends the blocks of an utterance on one PushAudioStream call that
+    lasts until its final block. The queue holds `max_blocks` blocks, when A2F falls
+    behind :
+        - block : `push` waits for room, the upstream module is slowed down
+        - drop : the oldest queued blocks of audio are dropped (counted in the stats)
+    """
+
+    _END = None  # Queued after the last block of an utterance
+
+    def __init__(
+        self,
+        grpc_url="localhost:50051",
+        instance_name="/World/audio2face/PlayerStreaming",
+        chunk_size=4000,
+        max_blocks=32,
+        policy="block",
+    ):
+        super().__init__(daemon=True)
+        if policy not in ("block", "drop"):
+            raise ValueError(f"Unknown queue policy : {policy}")
+        self.grpc_url = grpc_url
+        self.instance_name = instance_name
+        self.chunk_size = chunk_size
+        self.max_blocks = max_blocks
+        self.policy = policy
+        self.channel = None
+        self.push_audio_stream = None
+        self.blocks = deque()  # (samples, samplerate, push time) or _END
+        self.nb_queued_blocks = 0
+        self.condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self.pending = np.zeros(chunk_size, dtype=np.float32)  # Block being filled
+        self.nb_pending = 0
+        self.nb_cancels = 0  # A push that waited for room through a cancel gives up
+        self.rate = None
+        self.reset_stats()
+
+    def connect(self):
+        self.channel = grpc.insecure_channel(self.grpc_url)
+        # Requests and response are already serialized, see encode_*
+        self.push_audio_stream = self.channel.stream_unary(PUSH_AUDIO_STREAM)
+
+    def push(self, audio, rate, is_final=False):
+        """Add float32 (or 16 bits PCM bytes) audio of the current utterance. The
+        pending block is shared with cancel(), it is filled under the lock"""
+        if isinstance(audio, (bytes, bytearray)):
+            audio = np.frombuffer(audio, dtype=np.int16) * (1.0 / 32768.0)
+        with self.condition:
+            self.rate = rate
+            cancels = self.nb_cancels
+            written = 0
+            while written < len(audio):
+                n = min(self.chunk_size - self.nb_pending, len(audio) - written)
+                self.pending[self.nb_pending : self.nb_pending + n] = audio[written : written + n]
+                self.nb_pending += n
+                written += n
+                if self.nb_pending == self.chunk_size:
+                    self.flush_pending()
+                    if self.nb_cancels != cancels:
+                        return  # Cancelled while waiting for room, the rest is dropped
+            if is_final:
+                if self.nb_pending > 0:
+                    self.flush_pending()
+                    if self.nb_cancels != cancels:
+                        return
+                self.enqueue(self._END)
+
+    def flush_pending(self):
+        self.enqueue((self.pending[: self.nb_pending].copy(), self.rate, time.perf_counter()))
+        self.nb_pending = 0
+
+    def enqueue(self, item):
+        with self.condition:
+            if item is not self._END:
+                if self.nb_queued_blocks >= self.max_blocks:
+                    if self.policy == "block":
+                        start = time.perf_counter()
+                        cancels = self.nb_cancels
+                        while self.nb_queued_blocks >= self.max_blocks and not self._stop_event.is_set():
+                            self.condition.wait(0.1)
+                        self.stats["blocked_time"] += time.perf_counter() - start
+                        if self.nb_cancels != cancels:  # Audio of the cancelled utterance
+                            self.stats["cancelled_samples"] += len(item[0])
+                            return
+                    else:
+                        self.drop_oldest()
+                self.nb_queued_blocks += 1
+            self.blocks.append(item)
+            self.condition.notify_all()
+
+    def cancel(self):
+        """Drop the queued and pending audio (barge-in), the open stream is closed"""
+        with self.condition:
+            self.stats["cancelled_samples"] += self.nb_pending + sum(
+                len(item[0]) for item in self.blocks if item is not self._END
+            )
+            self.blocks.clear()
+            self.nb_queued_blocks = 0
+            self.nb_pending = 0
+            self.nb_cancels += 1
+            self.blocks.append(self._END)
+            self.condition.notify_all()
+
+    def drop_oldest(self):
+        for i, item in enumerate(self.blocks):
+            if item is not self._END:
+                del self.blocks[i]
+                self.nb_queued_blocks -= 1
+                self.stats["dropped_samples"] += len(item[0])
+                return
+
+    def next_item(self, timeout=None):
+        with self.condition:
+            while not self.blocks:
+                if self._stop_event.is_set() or not self.condition.wait(timeout):
+                    return self._END
+            item = self.blocks.popleft()
+            if item is not self._END:
+                self.nb_queued_blocks -= 1
+            self.condition.notify_all()
+            return item
+
+    def requests(self, first):
+        """Requests of one utterance : the start marker, then its blocks until the end"""
+        yield encode_start_marker(self.instance_name, first[1])
+        item = first
+        while item is not self._END:
+            samples, _, push_time = item
+            self.stats["queue_times"].append(time.perf_counter() - push_time)
+            self.stats["sent_samples"] += len(samples)
+            yield encode_audio_data(samples)
+            item = self.next_item()
+
+    def run(self):
+        if self.push_audio_stream is None:
+            self.connect()
+        while not self._stop_event.is_set():
+            first = self.next_item(timeout=0.1)
+            if first is self._END:
+                continue
+            start_time = time.perf_counter()
+            try:
+                response = decode_fields(self.push_audio_stream(self.requests(first)))
+                if not response.get(1, 0):
+                    logging.warning(
+                        f"{ConsoleColors.RED}A2FSender:{ConsoleColors.RESET} Audio2Face refused the stream : {response.get(2, b'').decode()}"
+                    )
+            except grpc.RpcError as e:
+                if self._stop_event.is_set():  # Channel closed by stop()
+                    return
+                logging.warning(
+                    f"{ConsoleColors.RED}A2FSender:{ConsoleColors.RESET} Stream failed : {e}"
+                )
+            self.stats["streams"] += 1
+            self.stats["stream_times"].append(time.perf_counter() - start_time)
+            self.log_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "streams": 0,
+            "sent_samples": 0,
+            "dropped_samples": 0,
+            "cancelled_samples": 0,  # Dropped by a barge-in
+            "blocked_time": 0.0,  # Time push waited for room (block policy)
+            "queue_times": deque(maxlen=1000),  # Push to send of the last blocks
+            "stream_times": deque(maxlen=1000),
+        }
+
+    def log_stats(self):
+        queue_times = self.stats["queue_times"] or [0.0]
+        logging.info(
+            f"{ConsoleColors.BLUE}A2FSender:{ConsoleColors.RESET} Streams : {self.stats['streams']}, Queue time p50 : {np.percentile(queue_times, 50)}(s), max : {max(queue_times)}(s), Blocked : {self.stats['blocked_time']}(s), Dropped samples : {self.stats['dropped_samples']}, Cancelled samples : {self.stats['cancelled_samples']}"
+        )
+
+    def stop(self):
+        self._stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
+        if self.channel is not None:
+            self.channel.close()
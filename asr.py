@@ -1,17 +1,298 @@
+import threading
 import time
 import numpy as np
 import retico_core
 from retico_core.audio import AudioIU
-from retico_core.text import TextIU
-
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
-import torch
+from retico_core.text import TextIU, get_text_increment
 
 from queue import Queue, Empty, Full
 
 import logging
 from console_colors import ConsoleColors
-from collections import deque
+from startup import torch_device
+
+
+class IncrementalLogMel:
+    """Whisper log-mel spectrogram computed frame by frame as the audio arrives.
+
+    The audio is stored as float32 in a preallocated buffer that grows when needed,
+    the log10 mel frames are computed as soon as their STFT window is complete. At the
+    end of the turn only the last frames and the global Whisper normalization are left.
+    """
+
+    def __init__(self, feature_extractor, compute_features=True, capacity=10.0):
+        self.n_fft = feature_extractor.n_fft
+        self.hop_length = feature_extractor.hop_length
+        self.sample_rate = feature_extractor.sampling_rate
+        self.nb_max_frames = feature_extractor.nb_max_frames
+        self.mel_filters = np.asarray(feature_extractor.mel_filters, dtype=np.float32)
+        self.n_mels = self.mel_filters.shape[1]
+        self.window = np.hanning(self.n_fft + 1)[:-1].astype(np.float32)  # Periodic
+        self.pad = self.n_fft // 2  # Reflect padding of the centered STFT
+        self.compute_features = compute_features
+
+        nb_samples = int(capacity * self.sample_rate)
+        self.audio = np.zeros(self.pad + nb_samples + self.n_fft, dtype=np.float32)
+        self.features = np.zeros(
+            (self.n_mels, nb_samples // self.hop_length + 1), dtype=np.float32
+        )
+        self.output = np.empty((self.n_mels, self.nb_max_frames), dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        self.nb_samples = 0  # Samples received in the turn
+        self.nb_frames = 0  # Frames computed
+        self.padded = False  # Start reflect padding filled
+
+    def get_audio(self, start=0):
+        """View of the turn audio from sample `start`"""
+        return self.audio[self.pad + start : self.pad + self.nb_samples]
+
+    def _reserve(self, nb_samples):
+        size = self.pad + nb_samples + self.n_fft
+        if size > len(self.audio):
+            audio = np.zeros(max(size, 2 * len(self.audio)), dtype=np.float32)
+            audio[: len(self.audio)] = self.audio
+            self.audio = audio
+            features = np.zeros(
+                (self.n_mels, (len(audio) - self.pad) // self.hop_length + 1),
+                dtype=np.float32,
+            )
+            features[:, : self.nb_frames] = self.features[:, : self.nb_frames]
+            self.features = features
+
+    def append(self, raw_audio):
+        """Add int16 audio bytes and compute the frames that are complete"""
+        chunk = np.frombuffer(raw_audio, dtype=np.int16)
+        self._reserve(self.nb_samples + len(chunk))
+        start = self.pad + self.nb_samples
+        np.multiply(chunk, 1.0 / 32768.0, out=self.audio[start : start + len(chunk)])
+        self.nb_samples += len(chunk)
+        if not self.compute_features:
+            return
+        if not self.padded:
+            if self.nb_samples <= self.pad:
+                return
+            self._fill_padding()
+            self.padded = True
+        nb_ready = (self.pad + self.nb_samples - self.n_fft) // self.hop_length + 1
+        nb_ready = min(nb_ready, self.features.shape[1])
+        if nb_ready > self.nb_frames:
+            self.features[:, self.nb_frames : nb_ready] = self._compute(
+                self.nb_frames, nb_ready
+            )
+            self.nb_frames = nb_ready
+
+    def _fill_padding(self):
+        # audio[pad - j] = sample j for j in 1..pad (np.pad reflect mode)
+        self.audio[: self.pad] = self.audio[2 * self.pad : self.pad : -1]
+
+    def _compute(self, start, stop):
+        frames = np.lib.stride_tricks.sliding_window_view(
+            self.audio[start * self.hop_length : (stop - 1) * self.hop_length + self.n_fft],
+            self.n_fft,
+        )[:: self.hop_length]
+        spectrum = np.fft.rfft(frames * self.window, axis=1)
+        power = spectrum.real**2 + spectrum.imag**2
+        mel = (power @ self.mel_filters).astype(np.float32)
+        np.maximum(mel, 1e-10, out=mel)
+        np.log10(mel, out=mel)
+        return mel.T
+
+    def finalize(self):
+        """Return the normalized (n_mels, nb_max_frames) input features of the audio
+        received so far, or None if it is longer than the Whisper window. More audio
+        can still be appended afterwards"""
+        if self.nb_samples > self.nb_max_frames * self.hop_length:
+            return None
+        # The audio is zero padded to 30s, compute the frames overlapping its end
+        end = self.pad + self.nb_samples
+        self.audio[end : end + self.n_fft] = 0.0
+        if not self.padded:  # Short audio, the padding reflects zeros too
+            self._fill_padding()
+        nb_audio_frames = min(end // self.hop_length + 1, self.nb_max_frames)
+        nb_frames = min(self.nb_frames, nb_audio_frames)
+
+        output = self.output
+        output[:, :nb_frames] = self.features[:, :nb_frames]
+        if nb_audio_frames > nb_frames:
+            output[:, nb_frames:nb_audio_frames] = self._compute(nb_frames, nb_audio_frames)
+        output[:, nb_audio_frames:] = -10.0  # log10 of the mel floor, silent frames
+        np.maximum(output, output.max() - 8.0, out=output)
+        output += 4.0
+        output /= 4.0
+        return output
+
+
+def normalize_word(word):
+    return word.strip().lower().strip(".,!?;:\"'")
+
+
+class LocalAgreement:
+    """LocalAgreement-2 policy for streaming transcription : a word is confirmed once
+    two consecutive hypotheses agree on it. Words are (start, end, text) tuples with
+    absolute times in seconds."""
+
+    def __init__(self, max_ngram=5):
+        self.max_ngram = max_ngram
+        self.reset()
+
+    def reset(self):
+        self.confirmed = []  # Words confirmed by two consecutive hypotheses
+        self.pending = []  # Unconfirmed words of the last hypothesis
+        self.confirmed_end = 0.0  # End time of the last confirmed word
+
+    def _new_words(self, words):
+        """Remove from a hypothesis the words that were already confirmed"""
+        words = [w for w in words if w[0] > self.confirmed_end - 0.1]
+        if words and self.confirmed and abs(words[0][0] - self.confirmed_end) < 1.0:
+            # The same words can be transcribed again around the confirmation point
+            for n in range(min(len(self.confirmed), len(words), self.max_ngram), 0, -1):
+                tail = [normalize_word(w[2]) for w in self.confirmed[-n:]]
+                head = [normalize_word(w[2]) for w in words[:n]]
+                if tail == head:
+                    return words[n:]
+        return words
+
+    def insert(self, words):
+        """Add a new hypothesis, returns the newly confirmed words"""
+        words = self._new_words(words)
+        newly_confirmed = []
+        for previous, current in zip(self.pending, words):
+            if normalize_word(previous[2]) != normalize_word(current[2]):
+                break
+            newly_confirmed.append(current)
+        if newly_confirmed:
+            self.confirmed.extend(newly_confirmed)
+            self.confirmed_end = newly_confirmed[-1][1]
+        self.pending = words[len(newly_confirmed) :]
+        return newly_confirmed
+
+    def preview(self, words):
+        """Transcription if `words` was the last hypothesis, the state is unchanged"""
+        return self.confirmed + self._new_words(words)
+
+    def finalize(self, words):
+        """Add the last hypothesis of the turn, all its new words are accepted"""
+        words = self.preview(words)
+        self.pending = []
+        return words
+
+    def text(self, words=None):
+        words = self.confirmed + self.pending if words is None else words
+        return " ".join(w[2].strip() for w in words)
+
+
+class WhisperResources:
+    """Whisper model, processor and pipeline. Loaded once, they can be shared by the
+    ASR modules of several sessions, `lock` allows one decoding at a time
+
+    CPU performance options :
+        - quantize : int8 dynamic quantization of the linear layers (weights in int8,
+          activations quantized on the fly), about 4x less memory traffic
+        - compile : torch.compile of the encoder, its input is always 30s of features
+          so it compiles once. The decoder changes shape every step and is left as is
+        - num_threads : intra-op threads of torch (process wide)
+    Smaller checkpoints (openai/whisper-base.en, distil-whisper/distil-small.en, ...)
+    are selected with model_id, the English-only ones get no language argument.
+    The device is cuda if available when `device` is None.
+
+    With assistant_model_id, a small Whisper sharing the tokenizer of the model (e.g.
+    distil-whisper/distil-large-v3 for whisper-large-v3-turbo) drafts the tokens and
+    the model verifies them in one forward pass (assisted generation, greedy so the
+    transcript is the one of the model alone). Used for the end of turn decodings, not
+    for the word timestamps of the streaming mode.
+    """
+
+    def __init__(
+        self,
+        model_id,
+        device=None,
+        quantize=False,
+        compile=False,
+        num_threads=None,
+        assistant_model_id=None,
+    ):
+        # Imported here, torch and transformers take seconds to import, see startup.py
+        import torch
+        from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+
+        if device is None:
+            device = torch_device()
+        self.model_id = model_id
+        self.device = device
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+        self.model = AutoModelForSpeechSeq2Seq.from_pretrained(
+            model_id,
+            torch_dtype=self.torch_dtype,
+            low_cpu_mem_usage=True,
+            use_safetensors=True,
+        )
+        self.model.to(device)
+        if quantize:
+            if device != "cpu":
+                raise ValueError("WhisperResources : int8 dynamic quantization is CPU only")
+            self.torch_dtype = torch.float32
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model.float(), {torch.nn.Linear}, dtype=torch.qint8
+            )
+        if compile:
+            encoder = self.model.get_encoder()
+            encoder.forward = torch.compile(encoder.forward)
+        self.assistant_model = None
+        self.assisted_kwargs = {}  # Added to the generate calls of one sequence
+        if assistant_model_id is not None:
+            self.assistant_model = AutoModelForSpeechSeq2Seq.from_pretrained(
+                assistant_model_id,
+                torch_dtype=self.torch_dtype,
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+            )
+            self.assistant_model.to(device)
+            if quantize:
+                self.assistant_model = torch.ao.quantization.quantize_dynamic(
+                    self.assistant_model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+            if self.assistant_model.config.vocab_size != self.model.config.vocab_size:
+                raise ValueError(
+                    f"WhisperResources : {assistant_model_id} does not share the vocabulary of {model_id}"
+                )
+            self.assisted_kwargs = {"assistant_model": self.assistant_model}
+        # Only the multilingual checkpoints accept a language and a task
+        self.generate_kwargs = {}
+        if getattr(self.model.generation_config, "is_multilingual", True):
+            self.generate_kwargs = {"language": "en", "task": "transcribe"}
+        self.processor = AutoProcessor.from_pretrained(model_id)
+        self.pipe = pipeline(
+            "automatic-speech-recognition",
+            model=self.model,
+            tokenizer=self.processor.tokenizer,
+            feature_extractor=self.processor.feature_extractor,
+            torch_dtype=self.torch_dtype,
+            device=device,
+            model_kwargs={"language": "en"},
+        )
+        self.lock = threading.Lock()
+
+    def warmup(self, word_timestamps=False):
+        """Decode one second of quiet noise so the first turn does not pay for the
+        lazy initializations (kernels, allocator, generation config)"""
+        import torch
+
+        audio = (np.random.default_rng(0).standard_normal(16000) * 300).astype(np.int16)
+        buffer = IncrementalLogMel(self.processor.feature_extractor)
+        buffer.append(audio.tobytes())
+        input_features = torch.from_numpy(buffer.finalize())[None].to(
+            self.device, dtype=self.torch_dtype
+        )
+        with self.lock, torch.inference_mode():
+            self.model.generate(
+                input_features, **self.generate_kwargs, **self.assisted_kwargs
+            )
+            if word_timestamps:  # Used by the streaming mode
+                self.pipe(buffer.get_audio().copy(), return_timestamps="word")
 
 
 class ASR(retico_core.AbstractModule):
@@ -37,72 +318,360 @@ class ASR(retico_core.AbstractModule):
         self,
         model_id: str = "openai/whisper-large-v3-turbo",
         device: str = "cpu",
+        sample_rate: int = 16000,
+        streaming: bool = False,
+        stream_step: float = 0.5,
+        stream_min_audio: float = 1.0,
+        stream_trim: float = 5.0,
+        speculative: bool = False,
+        speculation_silence: float = 0.2,
+        tracer=None,
+        endpointing=None,
+        resources=None,
+        engine=None,
+        retention=None,
         **kwargs,
     ):
         super().__init__(**kwargs)
 
         self.device = device
         self.model_id = model_id
+        self.resources = resources  # Shared WhisperResources, loaded in setup if None
+        self.engine = engine  # Shared BatchedWhisperEngine, see asr_engine.py
         self.model = None
-        self.buffer = deque()  # Buffer to store audio chunks received from VAD module
+        self.sample_rate = sample_rate
+        self.buffer = None  # Audio and log-mel features of the turn, see setup()
+
+        # Streaming mode : decode the turn in the background while the user speaks
+        self.streaming = streaming
+        self.stream_step = stream_step  # Delay between two partial decodings (s)
+        self.stream_min_audio = stream_min_audio  # Audio needed before decoding (s)
+        self.stream_trim = stream_trim  # Confirmed audio kept in the window (s)
+        self.agreement = LocalAgreement()
+        self.stream_offset = 0  # Start of the decoding window (samples)
+        self.decoded_samples = 0  # Samples in the buffer at the last decoding
+        self.turn_id = 0  # Incremented at the end of each turn
+        self.lock = threading.Lock()  # Protects the buffer and the streaming state
+        self.model_lock = threading.Lock()  # One decoding at a time
+        self._stop_event = threading.Event()
+        self.stream_thread = None
+
+        # Speculative mode : transcribe the turn during the end of turn silence and
+        # send it as a speculative ADD IU so the NLG can start early
+        self.speculative = speculative
+        self.speculation_silence = speculation_silence  # Silence before speculating (s)
+        self.trailing_silence = 0.0  # Silence since the last speech frame (s)
+        self.speculation_id = 0  # Incremented when a speculation is started or cancelled
+        self.speculation = None  # Running or sent speculation of the current pause
+
+        self.tracer = tracer  # Latency tracing, see metrics.py
+        # IU retention (retention.py) : the frames are released once in the buffer
+        self.retention = retention
+        # Adaptive endpointing of the VAD, receives the partial transcripts
+        self.endpointing = endpointing
 
     def setup(self):
-        torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-        self.model = AutoModelForSpeechSeq2Seq.from_pretrained(
-            self.model_id,
-            torch_dtype=torch_dtype,
-            low_cpu_mem_usage=True,
-            use_safetensors=True,
-        )
-        self.model.to(self.device)
-        self.processor = AutoProcessor.from_pretrained(self.model_id)
-        self.pipe = pipeline(
-            "automatic-speech-recognition",
-            model=self.model,
-            tokenizer=self.processor.tokenizer,
-            feature_extractor=self.processor.feature_extractor,
-            torch_dtype=torch_dtype,
-            device=self.device,
-            model_kwargs={"language": "en"},
+        if self.resources is None:
+            self.resources = WhisperResources(self.model_id, self.device)
+        self.device = self.resources.device
+        self.torch_dtype = self.resources.torch_dtype
+        self.model = self.resources.model
+        self.processor = self.resources.processor
+        self.pipe = self.resources.pipe
+        self.model_lock = self.resources.lock
+        # The streaming mode decodes windows of raw audio, no need for the features
+        self.buffer = IncrementalLogMel(
+            self.processor.feature_extractor, compute_features=not self.streaming
         )
         logging.info(f"{ConsoleColors.BLUE}ASR:{ConsoleColors.RESET} Module setup done")
 
-    def process_update(self, update_message):
+    def prepare_run(self):
+        if self.streaming:
+            self._stop_event.clear()
+            self.stream_thread = threading.Thread(target=self.stream_loop, daemon=True)
+            self.stream_thread.start()
+        super().prepare_run()
 
-        iu, ut = next(update_message)  # Update message contains only one IU
+    def shutdown(self):
+        self._stop_event.set()
+        super().shutdown()
 
-        if ut == retico_core.UpdateType.ADD:
-            self.buffer.append(iu.raw_audio)
-            logging.debug(
-                f"{ConsoleColors.MAGENTA}ASR:{ConsoleColors.RESET} Received new audio chunk, buffer size = {len(self.buffer)}"
+    def decode_features(self, features):
+        """Run the Whisper encoder and decoder on precomputed input features"""
+        import torch
+
+        input_features = torch.from_numpy(features)[None].to(
+            self.device, dtype=self.torch_dtype
+        )
+        with torch.inference_mode():
+            predicted_ids = self.model.generate(
+                input_features,
+                **self.resources.generate_kwargs,
+                **self.resources.assisted_kwargs,
             )
+        return self.processor.batch_decode(predicted_ids, skip_special_tokens=True)[0]
+
+    def transcribe_words(self, audio_np, offset):
+        """Transcribe with word timestamps, returns (start, end, word) tuples with
+        absolute times, `offset` being the position of the audio in the turn (s)"""
+        result = self.pipe(audio_np, return_timestamps="word")
+        words = []
+        for chunk in result.get("chunks", []):
+            start, end = chunk["timestamp"]
+            if end is None:
+                end = start
+            words.append((start + offset, end + offset, chunk["text"]))
+        return words
+
+    def process_update(self, update_message):
+        # The VAD forwards the frames of a microphone or WebSocket message together,
+        # one IU per frame
+        output_message = retico_core.UpdateMessage()
+        for iu, ut in update_message:
+            output = self.process_iu(iu, ut)
+            if output is not None:
+                for output_iu, output_ut in output:
+                    output_message.add_iu(output_iu, output_ut)
+        return output_message if len(output_message) > 0 else None
+
+    def process_iu(self, iu, ut):
+        """Handle one audio frame of the VAD, returns the update message to send or None"""
+        if ut == retico_core.UpdateType.ADD:
+            with self.lock:
+                self.buffer.append(iu.raw_audio)
+            if self.retention is not None:
+                self.retention.release(iu)
+            # Called for every frame, the message is only formatted when it is printed
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(
+                    f"{ConsoleColors.MAGENTA}ASR:{ConsoleColors.RESET} Received new audio chunk, buffer size = {self.buffer.nb_samples}"
+                )
+            if self.speculative:
+                return self.update_speculation(iu)
             return None
         elif ut == retico_core.UpdateType.COMMIT:
             # COMMIT Audio => End of Turn chunck of audio
             # Update the buffer with the last chunk of audio
-            self.buffer.append(iu.raw_audio)
-            # Convert to list of bytes
-            audio_np = np.frombuffer(b"".join(self.buffer), dtype=np.int16)
-            # ASR on the audio
+            with self.lock:
+                self.buffer.append(iu.raw_audio)
+            if self.retention is not None:
+                self.retention.release(iu)
             start_time = time.time()
-            result = self.pipe(audio_np)
+            with self.lock:
+                speculation, self.speculation = self.speculation, None
+            if speculation is not None:
+                # No speech since the speculation, its transcription is the final one
+                speculation["done"].wait()
+            if speculation is not None and speculation["text"] is not None:
+                text = speculation["text"]
+                if self.streaming:
+                    self.current_output = []
+                logging.debug(
+                    f"{ConsoleColors.MAGENTA}ASR:{ConsoleColors.RESET} Speculative transcription confirmed"
+                )
+            else:
+                text = self.transcribe_turn(final=True)
             end_time = time.time()
 
             # Empty the buffer
-            self.buffer.clear()
+            self.reset_turn()
             logging.info(
-                f"{ConsoleColors.BLUE}ASR:{ConsoleColors.RESET}, End of Turn, Inference Time = {end_time-start_time}(s), User speech {result['text']}"
+                f"{ConsoleColors.BLUE}ASR:{ConsoleColors.RESET}, End of Turn, Inference Time = {end_time-start_time}(s), User speech {text}"
             )
             # Create a new IU with the result
             output_iu = self.create_iu()
-            output_iu.set_text(result["text"])
+            output_iu.set_text(text)
+            trace_id = iu.meta_data.get("trace_id")
+            output_iu.meta_data["trace_id"] = trace_id
+            if self.tracer is not None:
+                self.tracer.mark(trace_id, "transcript")
             return retico_core.UpdateMessage.from_iu(
                 output_iu, retico_core.UpdateType.COMMIT
             )
         elif ut == retico_core.UpdateType.REVOKE:  # Case False Turn Start
+            if self.retention is not None:
+                self.retention.release(iu)
             # Empty the buffer
-            self.buffer.clear()
+            self.reset_turn()
             logging.debug(
                 f"{ConsoleColors.MAGENTA}ASR:{ConsoleColors.RESET} Received REMOVE, clearing buffer"
             )
+            # Revoke the partial transcription of the turn
+            revoked = retico_core.UpdateMessage()
+            for output_iu in self.current_output:
+                output_iu.revoked = True
+                revoked.add_iu(output_iu, retico_core.UpdateType.REVOKE)
+            self.current_output = []
+            return revoked if len(revoked) > 0 else None
+
+    def reset_turn(self):
+        speculation_message = self.cancel_speculation()
+        if speculation_message is not None:
+            self.append(speculation_message)
+        with self.lock:
+            self.buffer.reset()
+            self.stream_offset = 0
+            self.decoded_samples = 0
+            self.agreement.reset()
+            self.turn_id += 1
+            self.trailing_silence = 0.0
+
+    def transcribe_turn(self, final=True):
+        """Transcribe the audio received so far in the turn"""
+        if self.streaming:
+            return self.transcribe_stream(final)
+        # ASR on the features computed while the user was speaking
+        if self.engine is not None:
+            with self.lock:
+                features = self.buffer.finalize()
+                if features is not None:  # The output buffer is reused by the next call
+                    features = features.copy()
+                    nb_frames = self.buffer.nb_samples // self.buffer.hop_length
+            if features is not None:  # Batched with the turns of the other sessions
+                return self.engine.transcribe(features, nb_frames)
+        with self.model_lock:
+            with self.lock:
+                features = self.buffer.finalize()
+                if features is None:  # Longer than 30s, long-form transcription
+                    audio_np = self.buffer.get_audio().copy()
+            if features is not None:
+                return self.decode_features(features)
+            return self.pipe(
+                audio_np, generate_kwargs=self.resources.assisted_kwargs
+            )["text"]
+
+    def update_speculation(self, iu):
+        """Follow the end of turn silence : start a speculation once it is long enough
+        and cancel it if the user speaks again"""
+        if iu.meta_data.get("is_speech", True):
+            self.trailing_silence = 0.0
+            return self.cancel_speculation()
+        self.trailing_silence += iu.nframes / iu.rate
+        if self.speculation is None and self.trailing_silence >= self.speculation_silence:
+            with self.lock:
+                self.speculation_id += 1
+                self.speculation = {
+                    "id": self.speculation_id,
+                    "turn_id": self.turn_id,
+                    "text": None,
+                    "iu": None,
+                    "done": threading.Event(),
+                }
+            threading.Thread(
+                target=self.speculate, args=(self.speculation,), daemon=True
+            ).start()
+        return None
+
+    def speculate(self, speculation):
+        start_time = time.time()
+        try:
+            text = self.transcribe_turn(final=False)
+        except Exception as e:
+            logging.error(
+                f"{ConsoleColors.RED}ASR:{ConsoleColors.RESET} Speculative transcription failed : {e}"
+            )
+            speculation["done"].set()
+            return
+        with self.lock:
+            if speculation["id"] != self.speculation_id:  # Cancelled in the meantime
+                speculation["done"].set()
+                return
+            output_iu = self.create_iu()
+            output_iu.set_text(text)
+            output_iu.meta_data["speculative"] = True
+            speculation["text"] = text
+            if self.endpointing is not None:
+                self.endpointing.update_transcript(text, speculation["turn_id"])
+            speculation["iu"] = output_iu
+        logging.debug(
+            f"{ConsoleColors.MAGENTA}ASR:{ConsoleColors.RESET} Speculative transcription in {time.time()-start_time}(s) : {text}"
+        )
+        self.append(
+            retico_core.UpdateMessage.from_iu(output_iu, retico_core.UpdateType.ADD)
+        )
+        speculation["done"].set()
+
+    def cancel_speculation(self):
+        """Cancel the current speculation, returns the REVOKE message of its IU if it
+        was already sent"""
+        with self.lock:
+            speculation = self.speculation
+            if speculation is None:
+                return None
+            self.speculation = None
+            self.speculation_id += 1
+            output_iu = speculation["iu"]
+        if output_iu is None:
             return None
+        output_iu.revoked = True
+        return retico_core.UpdateMessage.from_iu(
+            output_iu, retico_core.UpdateType.REVOKE
+        )
+
+    def stream_loop(self):
+        """Background decoding of the current turn while the user is speaking"""
+        while not self._stop_event.wait(self.stream_step):
+            with self.lock:
+                nb_samples = self.buffer.nb_samples
+                if (
+                    nb_samples < self.stream_min_audio * self.sample_rate
+                    or nb_samples - self.decoded_samples
+                    < self.stream_step * self.sample_rate
+                ):
+                    continue
+            with self.model_lock:
+                with self.lock:
+                    turn_id = self.turn_id
+                    offset = self.stream_offset
+                    self.decoded_samples = self.buffer.nb_samples
+                    audio_np = self.buffer.get_audio(offset).copy()
+                start_time = time.time()
+                words = self.transcribe_words(audio_np, offset / self.sample_rate)
+                with self.lock:
+                    if turn_id != self.turn_id:  # Turn ended during the decoding
+                        continue
+                    if self.endpointing is not None:
+                        self.endpointing.update_transcript(
+                            self.agreement.text(self.agreement.preview(words)), turn_id
+                        )
+                    confirmed = self.agreement.insert(words)
+                    # Drop the confirmed audio from the decoding window
+                    confirmed_end = int(self.agreement.confirmed_end * self.sample_rate)
+                    if confirmed and confirmed_end - self.stream_offset > (
+                        self.stream_trim * self.sample_rate
+                    ):
+                        self.stream_offset = confirmed_end
+                    update_message = self.partial_update(self.agreement.text())
+                    # Sent under the lock : the end of the turn cannot slip in between
+                    if len(update_message) > 0:
+                        self.append(update_message)
+                logging.debug(
+                    f"{ConsoleColors.MAGENTA}ASR:{ConsoleColors.RESET} Partial decoding in {time.time()-start_time}(s), confirmed = {self.agreement.text(self.agreement.confirmed)!r}, pending = {self.agreement.text(self.agreement.pending)!r}"
+                )
+
+    def partial_update(self, text):
+        """ADD/REVOKE word IUs so the output matches the current hypothesis"""
+        update_message, new_tokens = get_text_increment(self, text)
+        for token in new_tokens:
+            output_iu = self.create_iu()
+            output_iu.set_text(token)
+            self.current_output.append(output_iu)
+            update_message.add_iu(output_iu, retico_core.UpdateType.ADD)
+        return update_message
+
+    def transcribe_stream(self, final=True):
+        """Decode the unconfirmed end of the turn, returns the full transcription"""
+        with self.model_lock:
+            with self.lock:
+                offset = self.stream_offset
+                audio_np = self.buffer.get_audio(offset).copy()
+            words = []
+            if len(audio_np) > 0.1 * self.sample_rate:
+                words = self.transcribe_words(audio_np, offset / self.sample_rate)
+            with self.lock:
+                if not final:
+                    return self.agreement.text(self.agreement.preview(words))
+                text = self.agreement.text(self.agreement.finalize(words))
+        # The COMMIT IU replaces the partial word IUs
+        self.current_output = []
+        return text
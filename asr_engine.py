@@ -0,0 +1,135 @@
+import threading
+import time
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from console_colors import ConsoleColors
+
+
+class TranscriptionRequest:
+    def __init__(self, features, nb_frames, bucket):
+        self.features = features
+        self.nb_frames = nb_frames  # Log-mel frames of actual audio, before the padding
+        self.bucket = bucket
+        self.future = Future()
+        self.submit_time = time.perf_counter()
+
+
+class BatchedWhisperEngine:
+    """Whisper inference shared by the ASR modules of several sessions, the turns that
+    end at about the same time are decoded in one batched `generate`.
+
+    A worker thread takes the pending requests once `max_batch_size` of them are
+    waiting or the oldest one waited `max_wait` seconds. Whisper always encodes 30s of
+    padded features, so the batches are grouped by length bucket instead : turns of
+    similar duration decode a similar number of tokens, a short turn is not held back
+    by the decoding of a long one. The batch is made of the bucket of the oldest
+    request, completed with the closest buckets.
+    """
+
+    def __init__(self, resources, max_batch_size=8, max_wait=0.02, bucket_length=2.0):
+        self.resources = resources  # WhisperResources, its lock is held while decoding
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.bucket_frames = int(bucket_length * 100)  # 100 log-mel frames per second
+        self.pending = []
+        self.condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self.reset_stats()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, features, nb_frames=None):
+        """Queue the (n_mels, 3000) features of a turn, returns a Future of its text"""
+        nb_frames = features.shape[-1] if nb_frames is None else nb_frames
+        request = TranscriptionRequest(features, nb_frames, nb_frames // self.bucket_frames)
+        with self.condition:
+            self.pending.append(request)
+            self.condition.notify()
+        return request.future
+
+    def transcribe(self, features, nb_frames=None):
+        return self.submit(features, nb_frames).result()
+
+    def next_batch(self):
+        """Wait for a full batch or for the oldest request to time out"""
+        with self.condition:
+            while not self._stop_event.is_set():
+                if self.pending:
+                    wait = self.pending[0].submit_time + self.max_wait - time.perf_counter()
+                    if len(self.pending) >= self.max_batch_size or wait <= 0:
+                        break
+                    self.condition.wait(wait)
+                else:
+                    self.condition.wait(0.1)
+            else:
+                return []
+            bucket = self.pending[0].bucket
+            # Stable sort : same bucket first, then the closest ones, oldest first
+            order = sorted(self.pending, key=lambda r: abs(r.bucket - bucket))
+            batch = order[: self.max_batch_size]
+            selected = set(map(id, batch))
+            self.pending = [r for r in self.pending if id(r) not in selected]
+            return batch
+
+    def run(self):
+        while not self._stop_event.is_set():
+            batch = self.next_batch()
+            if not batch:
+                continue
+            start_time = time.perf_counter()
+            try:
+                texts = self.decode([request.features for request in batch])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            for request, text in zip(batch, texts):
+                request.future.set_result(text)
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["batch_sizes"].append(len(batch))
+            self.stats["queue_times"].extend(start_time - r.submit_time for r in batch)
+            logging.debug(
+                f"{ConsoleColors.MAGENTA}BatchedWhisperEngine:{ConsoleColors.RESET} Decoded a batch of {len(batch)} in {time.perf_counter() - start_time}(s)"
+            )
+
+    def decode(self, features):
+        import torch  # Loaded with the model, see startup.py
+
+        resources = self.resources
+        input_features = torch.from_numpy(np.stack(features)).to(
+            resources.device, dtype=resources.torch_dtype
+        )
+        # Assisted generation handles one sequence at a time
+        assisted_kwargs = resources.assisted_kwargs if len(features) == 1 else {}
+        with resources.lock, torch.inference_mode():
+            predicted_ids = resources.model.generate(
+                input_features, **resources.generate_kwargs, **assisted_kwargs
+            )
+        return resources.processor.batch_decode(predicted_ids, skip_special_tokens=True)
+
+    def reset_stats(self):
+        # Last requests and batches only, the server runs for days
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "queue_times": deque(maxlen=10000),
+            "batch_sizes": deque(maxlen=10000),
+        }
+
+    def log_stats(self):
+        queue_times = self.stats["queue_times"]
+        if not queue_times:
+            return
+        logging.info(
+            f"{ConsoleColors.BLUE}BatchedWhisperEngine:{ConsoleColors.RESET} Requests : {self.stats['requests']}, Mean batch size : {np.mean(self.stats['batch_sizes']):.2f}, Queue time p50 : {np.percentile(queue_times, 50)}(s), p95 : {np.percentile(queue_times, 95)}(s)"
+        )
+
+    def stop(self):
+        self._stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
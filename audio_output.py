@@ -0,0 +1,260 @@
+import threading
+import time
+import logging
+from math import gcd
+
+import numpy as np
+
+from console_colors import ConsoleColors
+
+
+class StreamingResampler:
+    """Polyphase FIR resampler of a stream of float32 chunks.
+
+    The last input samples are kept between two calls so the filter runs over the
+    chunk boundaries as if the audio was resampled in one piece. The filter is causal,
+    the output is delayed by half the filter length (under a millisecond with the
+    defaults) and `reset` drops that tail at the end of an utterance, it is silence.
+    """
+
+    def __init__(self, orig_rate, new_rate, half_taps=16, beta=8.0):
+        g = gcd(orig_rate, new_rate)
+        self.up = new_rate // g
+        self.down = orig_rate // g
+        # Windowed sinc low-pass at the lowest Nyquist, in the upsampled domain
+        factor = max(self.up, self.down)
+        nb_taps = 2 * half_taps * factor + 1
+        m = np.arange(nb_taps) - (nb_taps - 1) / 2
+        h = np.sinc(m / factor) / factor * np.kaiser(nb_taps, beta) * self.up
+        # Phase p holds the taps h[p + k * up], reversed to be applied to x[i - K + 1 .. i]
+        self.nb_phase_taps = -(-nb_taps // self.up)
+        h = np.concatenate([h, np.zeros(self.nb_phase_taps * self.up - nb_taps)])
+        self.phases = np.ascontiguousarray(
+            h.reshape(self.nb_phase_taps, self.up).T[:, ::-1], dtype=np.float32
+        )
+        self.history = np.zeros(self.nb_phase_taps - 1, dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        """Start a new stream"""
+        self.history[:] = 0.0
+        self.nb_input = 0  # Input samples received
+        self.nb_output = 0  # Output samples produced
+
+    def process(self, chunk):
+        """Resample a float32 chunk, returns the output samples it completes"""
+        chunk = np.asarray(chunk, dtype=np.float32)
+        if self.up == self.down:
+            return chunk
+        # Output n reads the input sample floor(n * down / up) and the ones before it
+        end = -(-(self.nb_input + len(chunk)) * self.up // self.down)
+        positions = np.arange(self.nb_output, end, dtype=np.int64) * self.down
+        buffer = np.concatenate([self.history, chunk])
+        windows = np.lib.stride_tricks.sliding_window_view(buffer, self.nb_phase_taps)
+        output = np.einsum(
+            "nk,nk->n",
+            windows[positions // self.up - self.nb_input],
+            self.phases[positions % self.up],
+        )
+        self.history[:] = buffer[len(buffer) - len(self.history) :]
+        self.nb_input += len(chunk)
+        self.nb_output = end
+        return output
+
+
+class PCMConverter:
+    """float32 [-1, 1] to 16 bits PCM bytes, in buffers allocated once"""
+
+    def __init__(self, max_samples=4096):
+        self.scaled = np.empty(max_samples, dtype=np.float32)
+        self.pcm = np.empty(max_samples, dtype=np.int16)
+
+    def convert(self, audio):
+        n = len(audio)
+        if n > len(self.scaled):
+            self.scaled = np.empty(n, dtype=np.float32)
+            self.pcm = np.empty(n, dtype=np.int16)
+        scaled = self.scaled[:n]
+        np.clip(audio, -1.0, 1.0, out=scaled)
+        scaled *= 32767.0
+        np.copyto(self.pcm[:n], scaled, casting="unsafe")
+        return self.pcm[:n].tobytes()
+
+
+class JitterBuffer(threading.Thread):
+    """Re-chunks the synthesized audio into frames of `frame_length` seconds and sends
+    them at the playback rate.
+
+    The TTS writes chunks of any size, the frames leave through `callback(frame,
+    is_final, epoch, trace_id)` at most `lead` seconds ahead of real time, so the next
+    modules receive a steady stream instead of a burst per chunk. The frames with audio
+    are never final : the end of an utterance is an empty final frame of its own, the
+    speakers only play the ADD IUs (see tts.py send_message). An utterance starts
+    playing once `prefill` seconds are buffered (or its end was written). The buffer
+    holds `capacity` seconds, a write that does not fit waits for the frames to leave.
+    Counters :
+        - underruns : the buffer ran dry in the middle of an utterance, the playback
+          stopped until `prefill` seconds were buffered again
+        - overruns : writes that found the buffer full and had to wait
+    """
+
+    def __init__(
+        self,
+        callback,
+        sample_rate,
+        frame_length=0.02,
+        prefill=0.1,
+        lead=0.1,
+        capacity=2.0,
+    ):
+        super().__init__(daemon=True)
+        self.callback = callback
+        self.sample_rate = sample_rate
+        self.frame_size = int(frame_length * sample_rate)
+        self.frame_length = self.frame_size / sample_rate
+        self.prefill = int(prefill * sample_rate)
+        self.lead = lead
+        self.audio = np.zeros(max(int(capacity * sample_rate), self.frame_size), dtype=np.float32)
+        self.frame = np.zeros(self.frame_size, dtype=np.float32)
+        self.condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self.epoch = 0  # Writes of an older epoch are dropped, see cancel()
+        self.nb_underruns = 0
+        self.nb_overruns = 0
+        self.underrun_time = 0.0  # Time spent waiting for audio mid-utterance (s)
+        self.clear()
+
+    def clear(self):
+        self.read_pos = 0  # Absolute sample positions, modulo the capacity in the ring
+        self.write_pos = 0
+        self.marks = []  # [end position, is_final, epoch, trace_id] of the writes
+        self.playing = False
+        self.starved_since = None
+
+    def write(self, audio, is_final=False, epoch=0, trace_id=None):
+        """Queue float32 audio (None for an empty end of utterance). Blocks while the
+        buffer is full, returns False if the epoch was cancelled"""
+        audio = np.zeros(0, dtype=np.float32) if audio is None else audio
+        capacity = len(self.audio)
+        with self.condition:
+            written = 0
+            overrun = False
+            while True:
+                if epoch < self.epoch:
+                    return False
+                space = capacity - (self.write_pos - self.read_pos)
+                n = min(space, len(audio) - written)
+                start = self.write_pos % capacity
+                first = min(n, capacity - start)
+                self.audio[start : start + first] = audio[written : written + first]
+                self.audio[: n - first] = audio[written + first : written + n]
+                self.write_pos += n
+                written += n
+                done = written == len(audio)
+                if n > 0 or done:  # Each part written has its mark, the last one is final
+                    self.marks.append([self.write_pos, is_final and done, epoch, trace_id])
+                self.condition.notify_all()
+                if done:
+                    return True
+                if not overrun:
+                    overrun = True
+                    self.nb_overruns += 1
+                self.condition.wait()
+
+    def cancel(self, epoch):
+        """Drop the buffered audio and the pending writes of the epochs before `epoch`"""
+        with self.condition:
+            self.epoch = epoch
+            self.clear()
+            self.condition.notify_all()
+
+    def next_frame(self):
+        """Wait for the next frame, returns (frame, is_final, epoch, trace_id)"""
+        with self.condition:
+            while not self._stop_event.is_set():
+                buffered = self.write_pos - self.read_pos
+                has_end = any(mark[1] for mark in self.marks)
+                if not self.playing and (buffered >= self.prefill or has_end) and self.marks:
+                    self.playing = True
+                    self.play_start = time.perf_counter()
+                    self.nb_played = 0
+                if self.playing and (buffered >= self.frame_size or has_end):
+                    if self.starved_since is not None:
+                        self.underrun_time += time.perf_counter() - self.starved_since
+                        self.starved_since = None
+                    return self.read_frame()
+                timeout = 0.1
+                if self.playing:
+                    # The frames sent ahead are still playing, starved once they are over
+                    wait = self.play_start + self.nb_played * self.frame_length - time.perf_counter()
+                    if wait > 0:
+                        timeout = wait
+                    else:
+                        self.nb_underruns += 1
+                        self.starved_since = time.perf_counter()
+                        self.playing = False
+                self.condition.wait(timeout)
+            return None
+
+    def read_frame(self):
+        stop = self.read_pos + self.frame_size
+        # A frame does not run over the end of an utterance, it is padded instead
+        final_end = next((mark[0] for mark in self.marks if mark[1]), None)
+        if final_end is not None and final_end <= stop:
+            stop = final_end
+        n = stop - self.read_pos
+        capacity = len(self.audio)
+        start = self.read_pos % capacity
+        first = min(n, capacity - start)
+        self.frame[:first] = self.audio[start : start + first]
+        self.frame[first:n] = self.audio[: n - first]
+        self.frame[n:] = 0.0
+        self.read_pos = stop
+        # Metadata of the last write the frame reads from
+        mark = None
+        while self.marks and self.marks[0][0] <= stop:
+            if self.marks[0][1] and n > 0:
+                break  # The next frame, empty, ends the utterance
+            mark = self.marks.pop(0)
+            if mark[1]:
+                break
+        if mark is None:
+            # No write ends in this frame : the pending one is only final at its end
+            _, _, epoch, trace_id = self.marks[0]
+            is_final = False
+        else:
+            _, is_final, epoch, trace_id = mark
+        if is_final:
+            self.playing = False
+        self.condition.notify_all()
+        frame = self.frame if n > 0 else self.frame[:0]
+        return frame, is_final, epoch, trace_id
+
+    def run(self):
+        while not self._stop_event.is_set():
+            item = self.next_frame()
+            if item is None:
+                continue
+            frame, is_final, epoch, trace_id = item
+            if len(frame) > 0:
+                # Pace the frames : at most `lead` seconds ahead of the playback
+                delay = self.play_start + self.nb_played * self.frame_length - self.lead - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self.nb_played += 1
+            with self.condition:
+                if epoch < self.epoch:
+                    continue  # Cancelled while waiting
+                self.callback(frame, is_final, epoch, trace_id)
+            if is_final:
+                self.log_stats()
+
+    def log_stats(self):
+        logging.info(
+            f"{ConsoleColors.BLUE}JitterBuffer:{ConsoleColors.RESET} Underruns : {self.nb_underruns}, Underrun time : {self.underrun_time} (s), Overruns : {self.nb_overruns}"
+        )
+
+    def stop(self):
+        self._stop_event.set()
+        with self.condition:
+            self.condition.notify_all()
@@ -0,0 +1,98 @@
+import numpy as np
+from retico_core.audio import AudioIU
+
+
+class AudioRing:
+    """Preallocated int16 ring buffer of the input audio, written once.
+
+    The audio source (or the VAD, for the microphone frames) writes every sample
+    once, the IUs forwarded downstream only hold a sample range of the ring. The ring
+    is mirrored : every sample is stored at `i` and `i + size`, so any range of up to
+    `size` samples is a contiguous view, without a join or a copy when it wraps.
+
+    Positions are absolute sample counts since the start of the stream, a range can be
+    read as long as it has not been overwritten, i.e. up to `capacity` seconds after
+    it was written. With `path` the ring is a memory-mapped file.
+    """
+
+    def __init__(self, capacity=60.0, sample_rate=16000, path=None):
+        self.sample_rate = sample_rate
+        self.size = int(capacity * sample_rate)
+        if path is not None:
+            self.buffer = np.memmap(path, dtype=np.int16, mode="w+", shape=(2 * self.size,))
+        else:
+            self.buffer = np.zeros(2 * self.size, dtype=np.int16)
+        self.end = 0  # Samples written since the start
+
+    def write(self, audio):
+        """Add int16 samples (array or PCM bytes), returns their (start, end) range"""
+        if not isinstance(audio, np.ndarray):
+            audio = np.frombuffer(audio, dtype=np.int16)
+        if len(audio) > self.size:
+            raise ValueError(f"AudioRing : {len(audio)} samples written at once, the capacity is {self.size}")
+        start = self.end
+        index = start % self.size
+        first = min(len(audio), self.size - index)
+        self.buffer[index : index + first] = audio[:first]
+        self.buffer[self.size + index : self.size + index + first] = audio[:first]
+        if first < len(audio):  # Wraps around
+            rest = len(audio) - first
+            self.buffer[:rest] = audio[first:]
+            self.buffer[self.size : self.size + rest] = audio[first:]
+        self.end = start + len(audio)
+        return start, self.end
+
+    def read(self, start, end):
+        """Contiguous int16 view of the samples [start, end)"""
+        if start < self.end - self.size or end > self.end or end - start > self.size:
+            raise ValueError(
+                f"AudioRing : samples [{start}, {end}) not available, written [{max(self.end - self.size, 0)}, {self.end})"
+            )
+        index = start % self.size
+        return self.buffer[index : index + end - start]
+
+
+class RingAudioIU(AudioIU):
+    """AudioIU whose audio is a sample range of an AudioRing.
+
+    `raw_audio` is a read-only byte memoryview of the ring, it works wherever bytes
+    are read (np.frombuffer, bytes(), len) without copying. IUs without a range
+    behave as plain AudioIUs.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.ring = None
+        self.start = self.end = 0
+        super().__init__(*args, **kwargs)
+
+    @property
+    def raw_audio(self):
+        if self.ring is None:
+            return self._raw_audio
+        return memoryview(self.ring.read(self.start, self.end)).cast("B").toreadonly()
+
+    @raw_audio.setter
+    def raw_audio(self, raw_audio):
+        self._raw_audio = raw_audio
+
+    def set_audio(self, raw_audio, nframes, rate, sample_width):
+        self.ring = None
+        super().set_audio(raw_audio, nframes, rate, sample_width)
+
+    @property
+    def samples(self):
+        """int16 view of the audio"""
+        if self.ring is None:
+            return np.frombuffer(self._raw_audio, dtype=np.int16)
+        return self.ring.read(self.start, self.end)
+
+    def set_range(self, ring, start, end):
+        """Sets the audio content of the IU to the samples [start, end) of `ring`"""
+        self.ring = ring
+        self.start = start
+        self.end = end
+        self._raw_audio = None
+        self.payload = None
+        self.nframes = end - start
+        self.rate = ring.sample_rate
+        self.sample_width = 2
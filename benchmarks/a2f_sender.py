@@ -0,0 +1,146 @@
+"""Send latency and throughput of the Audio2Face output against the local stub.
+
+Run from the repository root :
+    python -m benchmarks.a2f_sender --utterances 5 --duration 3
+
+Starts benchmarks/a2f_stub.py in-process and pushes utterances of `--duration`
+seconds in 20ms frames, like the TTS output, at real time (or all at once with
+`--burst`). For each stub speed (0 : unlimited, 1 : real time, below 1 : A2F slower
+than real time) it compares :
+    - sync : one PushAudioStream per frame on the calling thread, as A2FStream did
+    - block / drop : A2FSender, one stream per utterance, with each queue policy
+and reports the time the calling (retico) thread spends per frame, the time from the
+last frame to the end of the utterance stream, the throughput and the dropped audio.
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import grpc
+import numpy as np
+
+from a2f_sender import PUSH_AUDIO_STREAM, A2FSender, encode_audio_data, encode_start_marker
+from benchmarks.a2f_stub import StubA2F, serve
+from benchmarks.common import percentile
+
+INSTANCE = "/World/audio2face/PlayerStreaming"
+
+
+def frames_of(args):
+    frame_size = int(args.frame_length * args.sample_rate)
+    t = np.arange(int(args.duration * args.sample_rate)) / args.sample_rate
+    audio = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    return [audio[i : i + frame_size] for i in range(0, len(audio), frame_size)]
+
+
+def push_utterance(push, frames, args):
+    """Returns the time spent in push for each frame"""
+    stalls = []
+    next_time = time.perf_counter()
+    for i, frame in enumerate(frames):
+        start = time.perf_counter()
+        push(frame, i == len(frames) - 1)
+        stalls.append(time.perf_counter() - start)
+        if not args.burst:
+            next_time += args.frame_length
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    return stalls
+
+
+def run_sync(stub, frames, args):
+    channel = grpc.insecure_channel(f"localhost:{args.port}")
+    push_audio_stream = channel.stream_unary(PUSH_AUDIO_STREAM)
+
+    def push(frame, is_final):
+        push_audio_stream(
+            iter([encode_start_marker(INSTANCE, args.sample_rate), encode_audio_data(frame)])
+        )
+
+    stalls, tails = [], []
+    for _ in range(args.utterances):
+        stalls += push_utterance(push, frames, args)
+        tails.append(0.0)  # Sent when the last push returns
+    channel.close()
+    return stalls, tails, 0
+
+
+def run_sender(stub, frames, policy, args):
+    sender = A2FSender(
+        grpc_url=f"localhost:{args.port}",
+        instance_name=INSTANCE,
+        chunk_size=args.chunk_size,
+        max_blocks=args.max_blocks,
+        policy=policy,
+    )
+    sender.connect()
+    sender.start()
+    stalls, tails = [], []
+    for _ in range(args.utterances):
+        nb_streams = sender.stats["streams"]
+        stalls += push_utterance(
+            lambda frame, is_final: sender.push(frame, args.sample_rate, is_final), frames, args
+        )
+        last_push = time.perf_counter()
+        while sender.stats["streams"] == nb_streams:
+            time.sleep(0.001)
+        tails.append(time.perf_counter() - last_push)
+    dropped = sender.stats["dropped_samples"]
+    sender.stop()
+    return stalls, tails, dropped
+
+
+def run_mode(mode, speed, frames, args):
+    stub = StubA2F(speed=speed)
+    server = serve(stub, args.port)
+    start = time.perf_counter()
+    if mode == "sync":
+        stalls, tails, dropped = run_sync(stub, frames, args)
+    else:
+        stalls, tails, dropped = run_sender(stub, frames, mode, args)
+    elapsed = time.perf_counter() - start
+    server.stop(0)
+    nb_samples = sum(s[3] for s in stub.streams)
+    return {
+        "mode": mode,
+        "speed": speed,
+        "stall_median": statistics.median(stalls),
+        "stall_p99": percentile(stalls, 99),
+        "stall_max": max(stalls),
+        "tail_median": statistics.median(tails),
+        "throughput": nb_samples / args.sample_rate / elapsed,  # Audio seconds per second
+        "streams": len(stub.streams),
+        "dropped": dropped / args.sample_rate,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=50061)
+    parser.add_argument("--sample_rate", type=int, default=24000)
+    parser.add_argument("--frame_length", type=float, default=0.02)
+    parser.add_argument("--duration", type=float, default=3.0, help="Length of an utterance (s)")
+    parser.add_argument("--utterances", type=int, default=5)
+    parser.add_argument("--chunk_size", type=int, default=4000)
+    parser.add_argument("--max_blocks", type=int, default=8)
+    parser.add_argument("--speeds", type=float, nargs="+", default=[0.0, 1.0, 0.8])
+    parser.add_argument("--burst", action="store_true", help="Push the frames without real time pacing")
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    frames = frames_of(args)
+    results = []
+    print(f"{'mode':<6} {'speed':>5} {'stall p50 (ms)':>15} {'p99 (ms)':>9} {'max (ms)':>9} {'tail (s)':>9} {'audio s/s':>10} {'streams':>8} {'dropped (s)':>12}")
+    for speed in args.speeds:
+        for mode in ["sync", "block", "drop"]:
+            r = run_mode(mode, speed, frames, args)
+            results.append(r)
+            print(
+                f"{mode:<6} {speed:>5.2f} {r['stall_median'] * 1000:>15.3f} {r['stall_p99'] * 1000:>9.3f} {r['stall_max'] * 1000:>9.3f} {r['tail_median']:>9.3f} {r['throughput']:>10.2f} {r['streams']:>8} {r['dropped']:>12.2f}"
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,89 @@
+"""Stand-in for the Audio2Face gRPC streaming service, to test the A2F output without it.
+
+Run from the repository root :
+    python -m benchmarks.a2f_stub --port 50051 --speed 1.0
+
+Serves PushAudioStream : each stream is a start marker followed by float32 audio
+blocks. The stub consumes the audio `speed` times faster than real time (0 : as fast
+as it arrives) plus `block_delay` seconds per block, which mimics an A2F instance
+animating the face while it receives the audio, and logs every stream.
+"""
+
+import argparse
+import threading
+import time
+from concurrent import futures
+
+import grpc
+
+from a2f_sender import decode_fields, encode_bytes_field, encode_varint_field
+
+
+class StubA2F:
+    def __init__(self, speed=1.0, block_delay=0.0):
+        self.speed = speed
+        self.block_delay = block_delay
+        self.streams = []  # (instance name, samplerate, nb blocks, nb samples, duration)
+        self.lock = threading.Lock()
+
+    def push_audio_stream(self, request_iterator, context):
+        start_time = time.perf_counter()
+        instance_name, samplerate, nb_blocks, nb_samples = None, None, 0, 0
+        for request in request_iterator:
+            fields = decode_fields(request)
+            if 1 in fields:
+                start = decode_fields(fields[1])
+                instance_name = start.get(1, b"").decode()
+                samplerate = start.get(2)
+                continue
+            if samplerate is None:
+                return encode_varint_field(1, 0) + encode_bytes_field(2, b"Missing start marker")
+            block_samples = len(fields.get(2, b"")) // 4  # float32
+            nb_blocks += 1
+            nb_samples += block_samples
+            delay = self.block_delay
+            if self.speed > 0:
+                delay += block_samples / samplerate / self.speed
+            time.sleep(delay)
+        with self.lock:
+            self.streams.append(
+                (instance_name, samplerate, nb_blocks, nb_samples, time.perf_counter() - start_time)
+            )
+        return encode_varint_field(1, 1)
+
+
+def serve(stub, port=50051):
+    """Start the gRPC server, returns it"""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    handler = grpc.method_handlers_generic_handler(
+        "nvidia.audio2face.Audio2Face",
+        {"PushAudioStream": grpc.stream_unary_rpc_method_handler(stub.push_audio_stream)},
+    )
+    server.add_generic_rpc_handlers((handler,))
+    server.add_insecure_port(f"[::]:{port}")
+    server.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--speed", type=float, default=1.0, help="Consumption speed over real time, 0 for no limit")
+    parser.add_argument("--block_delay", type=float, default=0.0, help="Extra delay per block (s)")
+    args = parser.parse_args()
+
+    stub = StubA2F(args.speed, args.block_delay)
+    server = serve(stub, args.port)
+    print(f"Stub Audio2Face serving on localhost:{args.port}")
+    seen = 0
+    try:
+        while True:
+            time.sleep(0.5)
+            with stub.lock:
+                new, seen = stub.streams[seen:], len(stub.streams)
+            for instance_name, samplerate, nb_blocks, nb_samples, duration in new:
+                print(
+                    f"{instance_name} : {nb_blocks} blocks, {nb_samples / samplerate:.2f}s of audio at {samplerate}Hz in {duration:.2f}s"
+                )
+    except KeyboardInterrupt:
+        server.stop(0)
@@ -0,0 +1,111 @@
+"""Speedup and acceptance rate of the assisted (speculative) Whisper decoding on CPU.
+
+Run from the repository root :
+    python -m benchmarks.asr_assisted --model_id openai/whisper-large-v3-turbo --assistant_model_id distil-whisper/distil-large-v3
+
+Uses the clips of benchmarks/asr_cpu.py (the synthesized sentences of
+assets/asr_benchmark.txt, or `--wav`). Every clip is decoded by the model alone and
+with the assistant, the report gives :
+    - speedup : plain latency / assisted latency (median over the clips)
+    - identical : fraction of the clips where both decodings give the same tokens
+    - acceptance : drafted tokens accepted by the model / drafted tokens, counted with
+      forward hooks on the decoders. The plain decoding runs the decoder once per
+      generated token, a verification pass of the assisted decoding accepts some of
+      the drafted tokens and adds one token of its own
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import torch
+
+from asr import IncrementalLogMel, WhisperResources
+from benchmarks.asr_cpu import load_clips, synthesize_clips
+
+
+class CallCounter:
+    def __init__(self, module):
+        self.count = 0
+        module.register_forward_hook(self.hook)
+
+    def hook(self, module, inputs, output):
+        self.count += 1
+
+
+def decode(resources, input_features, **kwargs):
+    start = time.perf_counter()
+    with torch.inference_mode():
+        ids = resources.model.generate(input_features, **resources.generate_kwargs, **kwargs)
+    return ids[0].tolist(), time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_id", type=str, default="openai/whisper-large-v3-turbo")
+    parser.add_argument("--assistant_model_id", type=str, default="distil-whisper/distil-large-v3")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument("--wav", type=str, nargs="*", default=None, help="Clips to use instead of the synthesized ones")
+    parser.add_argument("--sentences", type=str, default="./assets/asr_benchmark.txt")
+    parser.add_argument("--clips_dir", type=str, default="./benchmark_clips")
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    clips = load_clips(args.wav or synthesize_clips(args))
+    resources = WhisperResources(
+        args.model_id, args.device, quantize=args.quantize, assistant_model_id=args.assistant_model_id
+    )
+    resources.warmup()
+    model_calls = CallCounter(resources.model.get_decoder())
+    draft_calls = CallCounter(resources.assistant_model.get_decoder())
+
+    results = []
+    for audio, reference in clips:
+        buffer = IncrementalLogMel(resources.processor.feature_extractor)
+        buffer.append(audio.tobytes())
+        input_features = torch.from_numpy(buffer.finalize())[None].to(
+            resources.device, dtype=resources.torch_dtype
+        )
+        model_calls.count = 0
+        plain_ids, plain_latency = decode(resources, input_features)
+        nb_tokens = model_calls.count  # One decoder pass per generated token
+        model_calls.count = draft_calls.count = 0
+        assisted_ids, assisted_latency = decode(resources, input_features, **resources.assisted_kwargs)
+        # Tokens beyond one per verification pass come from accepted drafts
+        accepted = max(nb_tokens - model_calls.count, 0)
+        results.append(
+            {
+                "reference": reference,
+                "text": resources.processor.decode(plain_ids, skip_special_tokens=True),
+                "identical": plain_ids == assisted_ids,
+                "plain_latency": plain_latency,
+                "assisted_latency": assisted_latency,
+                "speedup": plain_latency / assisted_latency,
+                "tokens": nb_tokens,
+                "verification_passes": model_calls.count,
+                "drafted": draft_calls.count,
+                "accepted": accepted,
+            }
+        )
+
+    drafted = sum(r["drafted"] for r in results)
+    summary = {
+        "model_id": args.model_id,
+        "assistant_model_id": args.assistant_model_id,
+        "speedup_median": statistics.median(r["speedup"] for r in results),
+        "plain_latency_median": statistics.median(r["plain_latency"] for r in results),
+        "assisted_latency_median": statistics.median(r["assisted_latency"] for r in results),
+        "identical": sum(r["identical"] for r in results) / len(results),
+        "acceptance_rate": sum(r["accepted"] for r in results) / max(drafted, 1),
+        "tokens_per_pass": sum(r["tokens"] for r in results) / max(sum(r["verification_passes"] for r in results), 1),
+    }
+    for key, value in summary.items():
+        print(f"{key:<24} {value:.3f}" if isinstance(value, float) else f"{key:<24} {value}")
+    for r in results:
+        if not r["identical"]:
+            print(f"Different transcript : {r['text']!r}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "clips": results}, f, indent=2)
@@ -0,0 +1,101 @@
+"""Throughput and queueing latency of the batched Whisper engine with concurrent streams.
+
+Run from the repository root :
+    python -m benchmarks.asr_batching turn1.wav turn2.wav --device cpu --streams 1 2 4 8 16
+
+Every WAV file is one user turn, its features are computed once. Each stream is a
+thread that submits a turn, waits for its transcript, then waits `--think` seconds
+before the next one (a closed loop, like sessions waiting for the reply). For every
+engine configuration (max batch size, max wait) and every number of streams :
+    - throughput : turns transcribed per second
+    - latency : submission to transcript, queue : submission to the start of its batch
+A max batch size of 1 is the sequential decoding of the ASR module without engine.
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+
+import numpy as np
+
+from asr import IncrementalLogMel, WhisperResources
+from asr_engine import BatchedWhisperEngine
+from benchmarks.common import load_wav, percentile
+
+
+def load_features(resources, path):
+    buffer = IncrementalLogMel(resources.processor.feature_extractor)
+    buffer.append(load_wav(path).tobytes())
+    return buffer.finalize().copy(), buffer.nb_samples // buffer.hop_length
+
+
+def run_level(engine, turns, nb_streams, args):
+    latencies = []
+    deadline = time.perf_counter() + args.duration
+
+    def stream(index):
+        i = index
+        while time.perf_counter() < deadline:
+            features, nb_frames = turns[i % len(turns)]
+            start = time.perf_counter()
+            engine.transcribe(features, nb_frames)
+            latencies.append(time.perf_counter() - start)
+            i += 1
+            time.sleep(args.think)
+
+    engine.reset_stats()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=stream, args=(i,)) for i in range(nb_streams)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    queue_times = engine.stats["queue_times"]
+    return {
+        "streams": nb_streams,
+        "turns": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "latency_median": statistics.median(latencies),
+        "latency_p95": percentile(latencies, 95),
+        "queue_median": statistics.median(queue_times),
+        "queue_p95": percentile(queue_times, 95),
+        "mean_batch_size": float(np.mean(engine.stats["batch_sizes"])),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wav", nargs="+", help="16 bits WAV files, one user turn each (< 30s)")
+    parser.add_argument("--model_id", type=str, default="openai/whisper-large-v3-turbo")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--max_waits", type=float, nargs="+", default=[0.01, 0.05])
+    parser.add_argument("--duration", type=float, default=30.0, help="Run time per level (s)")
+    parser.add_argument("--think", type=float, default=0.0, help="Pause between the turns of a stream (s)")
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    resources = WhisperResources(args.model_id, args.device)
+    turns = [load_features(resources, path) for path in args.wav]
+    report = []
+    print(f"{'batch':>5} {'wait (s)':>8} {'streams':>7} {'turns/s':>8} {'median (s)':>11} {'p95 (s)':>8} {'queue p50':>10} {'queue p95':>10} {'batch':>6}")
+    for batch_size in args.batch_sizes:
+        # The wait does not matter without batching
+        for max_wait in args.max_waits if batch_size > 1 else [0.0]:
+            engine = BatchedWhisperEngine(resources, max_batch_size=batch_size, max_wait=max_wait)
+            engine.transcribe(*turns[0])  # Warm-up
+            for nb_streams in args.streams:
+                level = run_level(engine, turns, nb_streams, args)
+                level.update(max_batch_size=batch_size, max_wait=max_wait)
+                report.append(level)
+                print(
+                    f"{batch_size:>5} {max_wait:>8.3f} {nb_streams:>7} {level['throughput']:>8.2f} {level['latency_median']:>11.3f} {level['latency_p95']:>8.3f} {level['queue_median']:>10.3f} {level['queue_p95']:>10.3f} {level['mean_batch_size']:>6.2f}"
+                )
+            engine.stop()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
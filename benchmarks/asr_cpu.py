@@ -0,0 +1,154 @@
+"""Accuracy (WER) and latency of the Whisper CPU configurations.
+
+Run from the repository root :
+    python -m benchmarks.asr_cpu --model_ids openai/whisper-base.en distil-whisper/distil-small.en --threads 4 8
+
+The test clips are the sentences of assets/asr_benchmark.txt, synthesized once with
+Kokoro (several voices) into `--clips_dir`, or the WAV files given with `--wav`
+(each with its transcript `<name>.txt` next to it). Every combination of model,
+quantization (fp32 / int8), torch.compile and thread count transcribes all the
+clips, like the ASR module at the end of a turn, and is reported with :
+    - wer : word error rate over all the clips
+    - latency : median and p95 time to transcribe a clip, rtf : latency / duration
+    - load : time to load (and quantize) the model
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import statistics
+import time
+import wave
+
+import numpy as np
+import torch
+
+from asr import IncrementalLogMel, WhisperResources
+from audio_output import StreamingResampler
+from benchmarks.common import load_wav, percentile
+
+VOICES = ["af_heart", "am_fenrir", "bf_emma", "am_michael"]
+
+
+def normalize(text):
+    return re.sub(r"[^a-z0-9' ]", " ", text.lower()).split()
+
+
+def edit_distance(reference, hypothesis):
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word))
+            )
+        previous = current
+    return previous[-1]
+
+
+def synthesize_clips(args):
+    """Synthesize the benchmark sentences with Kokoro, once"""
+    from tts import KokoroResources
+
+    with open(args.sentences) as f:
+        sentences = [line.strip() for line in f if line.strip()]
+    os.makedirs(args.clips_dir, exist_ok=True)
+    kokoro = None
+    paths = []
+    for i, sentence in enumerate(sentences):
+        path = os.path.join(args.clips_dir, f"clip_{i:02d}.wav")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+        if kokoro is None:
+            kokoro = KokoroResources({"device": "cpu", "lang_code": "a", "repo_id": "hexgrad/Kokoro-82M"})
+        audio = np.concatenate(
+            [chunk.numpy() for _, _, chunk in kokoro.pipeline(sentence, voice=VOICES[i % len(VOICES)])]
+        )
+        audio = StreamingResampler(24000, 16000).process(audio)
+        with wave.open(path, "wb") as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(16000)
+            w.writeframes((np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes())
+        with open(os.path.splitext(path)[0] + ".txt", "w") as f:
+            f.write(sentence)
+    return paths
+
+
+def load_clips(paths):
+    clips = []
+    for path in paths:
+        with open(os.path.splitext(path)[0] + ".txt") as f:
+            clips.append((load_wav(path), f.read().strip()))
+    return clips
+
+
+def transcribe(resources, audio):
+    buffer = IncrementalLogMel(resources.processor.feature_extractor)
+    buffer.append(audio.tobytes())
+    input_features = torch.from_numpy(buffer.finalize())[None].to(
+        resources.device, dtype=resources.torch_dtype
+    )
+    with torch.inference_mode():
+        predicted_ids = resources.model.generate(input_features, **resources.generate_kwargs)
+    return resources.processor.batch_decode(predicted_ids, skip_special_tokens=True)[0]
+
+
+def run_config(model_id, quantize, compile, num_threads, clips):
+    start = time.perf_counter()
+    resources = WhisperResources(
+        model_id, "cpu", quantize=quantize, compile=compile, num_threads=num_threads
+    )
+    load_time = time.perf_counter() - start
+    resources.warmup()
+    errors, nb_words, latencies, rtfs = 0, 0, [], []
+    for audio, reference in clips:
+        start = time.perf_counter()
+        text = transcribe(resources, audio)
+        latency = time.perf_counter() - start
+        latencies.append(latency)
+        rtfs.append(latency / (len(audio) / 16000))
+        errors += edit_distance(normalize(reference), normalize(text))
+        nb_words += len(normalize(reference))
+    return {
+        "model_id": model_id,
+        "quantize": quantize,
+        "compile": compile,
+        "threads": num_threads,
+        "load_time": load_time,
+        "wer": errors / max(nb_words, 1),
+        "latency_median": statistics.median(latencies),
+        "latency_p95": percentile(latencies, 95),
+        "rtf_median": statistics.median(rtfs),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_ids", type=str, nargs="+", default=["openai/whisper-large-v3-turbo", "openai/whisper-small.en", "openai/whisper-base.en"])
+    parser.add_argument("--quantize", type=str, nargs="+", default=["fp32", "int8"], choices=["fp32", "int8"])
+    parser.add_argument("--compile", action="store_true", help="Also run every configuration with torch.compile")
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()])
+    parser.add_argument("--wav", type=str, nargs="*", default=None, help="Clips to use instead of the synthesized ones")
+    parser.add_argument("--sentences", type=str, default="./assets/asr_benchmark.txt")
+    parser.add_argument("--clips_dir", type=str, default="./benchmark_clips")
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    clips = load_clips(args.wav or synthesize_clips(args))
+    results = []
+    print(f"{'model':<36} {'quant':>5} {'compile':>7} {'threads':>7} {'load (s)':>8} {'WER':>6} {'median (s)':>10} {'p95 (s)':>8} {'RTF':>6}")
+    for model_id, quantize, compile, num_threads in itertools.product(
+        args.model_ids, args.quantize, [False, True] if args.compile else [False], args.threads
+    ):
+        r = run_config(model_id, quantize == "int8", compile, num_threads, clips)
+        results.append(r)
+        print(
+            f"{model_id:<36} {quantize:>5} {str(compile):>7} {num_threads:>7} {r['load_time']:>8.1f} {r['wer']:>6.3f} {r['latency_median']:>10.3f} {r['latency_p95']:>8.3f} {r['rtf_median']:>6.3f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
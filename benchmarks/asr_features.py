@@ -0,0 +1,66 @@
+"""Post-turn cost of the Whisper feature extraction, batch vs incremental.
+
+Run from the repository root :
+    python -m benchmarks.asr_features --model_id openai/whisper-large-v3-turbo
+
+"batch" is the previous COMMIT path : join the deque of 20ms chunks, np.frombuffer and
+run the feature extractor on the whole turn. "incremental" is IncrementalLogMel, where
+the frames are computed as the chunks arrive and only `finalize` runs at the COMMIT.
+Only the feature extractor is loaded, the encoder/decoder time is the same in both.
+"""
+
+import argparse
+import statistics
+import time
+from collections import deque
+
+import numpy as np
+from transformers import AutoFeatureExtractor
+
+from asr import IncrementalLogMel
+from benchmarks.common import split_frames
+
+
+def batch_features(chunks, feature_extractor):
+    buffer = deque(chunks)
+    audio_np = np.frombuffer(b"".join(buffer), dtype=np.int16)
+    return feature_extractor(
+        audio_np.astype(np.float32) / 32768.0,
+        sampling_rate=feature_extractor.sampling_rate,
+        return_tensors="np",
+    ).input_features[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model_id", type=str, default="openai/whisper-large-v3-turbo")
+    parser.add_argument("--durations", type=float, nargs="+", default=[2, 4, 6, 8, 10])
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    feature_extractor = AutoFeatureExtractor.from_pretrained(args.model_id)
+    mel = IncrementalLogMel(feature_extractor)
+    rng = np.random.default_rng(0)
+
+    print(f"{'turn (s)':>8} {'batch (ms)':>11} {'incremental (ms)':>17} {'per chunk (us)':>15} {'max diff':>9}")
+    for duration in args.durations:
+        audio = (rng.standard_normal(int(duration * 16000)) * 3000).astype(np.int16)
+        chunks = [frame.tobytes() for frame in split_frames(audio)]
+        batch, incremental, append = [], [], []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            reference = batch_features(chunks, feature_extractor)
+            batch.append(time.perf_counter() - start)
+
+            mel.reset()
+            start = time.perf_counter()
+            for chunk in chunks:
+                mel.append(chunk)
+            append.append((time.perf_counter() - start) / len(chunks))
+            start = time.perf_counter()
+            features = mel.finalize()
+            incremental.append(time.perf_counter() - start)
+        diff = np.abs(features - reference).max()
+        print(
+            f"{duration:>8.1f} {1e3 * statistics.median(batch):>11.2f} {1e3 * statistics.median(incremental):>17.2f} {1e6 * statistics.median(append):>15.1f} {diff:>9.2e}"
+        )
@@ -0,0 +1,82 @@
+"""End-of-turn to transcript latency of the ASR module, with and without streaming.
+
+Run from the repository root :
+    python -m benchmarks.asr_latency turn1.wav turn2.wav --device cpu
+
+Every WAV file is one user turn. Its frames are sent to the ASR module as ADD
+messages at real time (or `--speed` times faster) followed by a COMMIT, the latency
+is the time spent handling the COMMIT, i.e. from the end of the turn to the transcript.
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import retico_core
+
+from asr import ASR
+from benchmarks.common import audio_message, load_wav, split_frames
+
+
+def run_turn(asr, frames, frame_length, speed):
+    partials = []
+    asr.append = lambda update_message: partials.append(update_message)
+    for frame in frames[:-1]:
+        start = time.perf_counter()
+        asr.process_update(audio_message(frame, retico_core.UpdateType.ADD))
+        delay = frame_length / speed - (time.perf_counter() - start)
+        if delay > 0:
+            time.sleep(delay)
+    start = time.perf_counter()
+    result = asr.process_update(audio_message(frames[-1], retico_core.UpdateType.COMMIT))
+    latency = time.perf_counter() - start
+    iu, _ = next(result)
+    return latency, iu.text, len(partials)
+
+
+def run_mode(streaming, turns, args):
+    asr = ASR(model_id=args.model_id, device=args.device, streaming=streaming)
+    asr.setup()
+    asr.prepare_run()
+    run_turn(asr, turns[0], args.frame_length, args.speed)  # Warm-up
+    results = []
+    for path, frames in zip(args.wav, turns):
+        latency, text, nb_partials = run_turn(asr, frames, args.frame_length, args.speed)
+        results.append(
+            {
+                "file": path,
+                "duration": len(frames) * args.frame_length,
+                "latency": latency,
+                "partial_updates": nb_partials,
+                "text": text,
+            }
+        )
+    asr.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wav", nargs="+", help="16 bits WAV files, one user turn each")
+    parser.add_argument("--model_id", type=str, default="openai/whisper-large-v3-turbo")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--frame_length", type=float, default=0.02)
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed-up over real time")
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    turns = [split_frames(load_wav(path), args.frame_length) for path in args.wav]
+    report = {}
+    for streaming in (False, True):
+        mode = "streaming" if streaming else "batch"
+        report[mode] = run_mode(streaming, turns, args)
+        latencies = [r["latency"] for r in report[mode]]
+        print(
+            f"{mode:<10} median end-of-turn latency = {statistics.median(latencies):.3f}(s), max = {max(latencies):.3f}(s)"
+        )
+        for r in report[mode]:
+            print(f"    {r['file']} ({r['duration']:.1f}s) : {r['latency']:.3f}(s) {r['text']!r}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,114 @@
+"""Allocations and CPU time of the input audio path, bytes vs shared audio ring.
+
+Run from the repository root :
+    python -m benchmarks.audio_path --duration 60
+    python -m benchmarks.audio_path speech.wav
+
+The audio (synthetic speech bursts and noise, or a WAV file) is sent as the client
+of server.py does, in messages of `--message_length` seconds, through the session
+source (WebSocketSource), the VAD and the ASR feature buffer (IncrementalLogMel),
+called directly without the retico threads. Each mode is reported with :
+    - alloc : bytes allocated per audio second (sum over the messages of the
+      tracemalloc peak above the memory in use before the message)
+    - cpu : CPU time per audio second, measured in a second run without tracemalloc
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import retico_core
+
+from asr import IncrementalLogMel
+from audio_ring import AudioRing
+from benchmarks.common import load_wav
+from benchmarks.vad_backends import synthetic_audio
+from server import WebSocketSource
+from vad import VAD
+
+
+class FeatureExtractor:
+    """Whisper (80 mels) feature extractor parameters, without transformers"""
+
+    n_fft = 400
+    hop_length = 160
+    sampling_rate = 16000
+    nb_max_frames = 3000
+    mel_filters = np.random.default_rng(0).random((201, 80)).astype(np.float32) / 100
+
+
+def create_path(ring_enabled, args):
+    ring = AudioRing(sample_rate=16000) if ring_enabled else None
+    source = WebSocketSource(ring=ring)
+    vad = VAD(
+        mode=3,
+        sample_rate=16000,
+        max_silence_length=0.700,
+        frame_length=0.02,
+        min_turn_length=0.150,
+        backend=args.vad_backend,
+        ring=ring,
+    )
+    vad.setup()
+    buffer = IncrementalLogMel(FeatureExtractor())
+    return source, vad, buffer
+
+
+def run(source, vad, buffer, messages, measure):
+    """Send the messages through the path, returns the bytes allocated"""
+    allocated = 0
+    for message in messages:
+        if measure:
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        source.push(message)
+        while not source.frames.empty():
+            frame_message = source.process_update(None)
+            output = vad.process_update(frame_message)
+            if output is None:
+                continue
+            for iu, ut in output:
+                if ut == retico_core.UpdateType.REVOKE:
+                    buffer.reset()
+                    continue
+                buffer.append(iu.raw_audio)  # What the ASR does with every frame
+                if ut == retico_core.UpdateType.COMMIT:
+                    buffer.finalize()
+                    buffer.reset()
+        if measure:
+            _, peak = tracemalloc.get_traced_memory()
+            allocated += peak - current
+    return allocated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wav", nargs="?", default=None, help="16 bits WAV file, synthetic audio by default")
+    parser.add_argument("--duration", type=float, default=60.0, help="Length of the synthetic audio (s)")
+    parser.add_argument("--message_length", type=float, default=0.1, help="Audio per client message (s)")
+    parser.add_argument("--vad_backend", type=str, default="energy", choices=["webrtc", "energy"])
+    args = parser.parse_args()
+
+    audio = load_wav(args.wav) if args.wav else synthetic_audio(args.duration, speech_ratio=0.5)
+    duration = len(audio) / 16000
+    message_size = int(args.message_length * 16000)
+    messages = [audio[i : i + message_size].tobytes() for i in range(0, len(audio), message_size)]
+
+    print(f"{duration:.0f}(s) of audio in {len(messages)} messages")
+    print(f"{'mode':<6} {'alloc (KB/s)':>12} {'cpu (ms/s)':>10}")
+    for name, ring_enabled in [("bytes", False), ("ring", True)]:
+        source, vad, buffer = create_path(ring_enabled, args)
+        run(source, vad, buffer, messages[:50], measure=False)  # Warm-up
+        tracemalloc.start()
+        allocated = run(source, vad, buffer, messages, measure=True)
+        tracemalloc.stop()
+
+        source, vad, buffer = create_path(ring_enabled, args)
+        run(source, vad, buffer, messages[:50], measure=False)
+        start = time.process_time()
+        run(source, vad, buffer, messages, measure=False)
+        cpu_time = time.process_time() - start
+        print(
+            f"{name:<6} {allocated / 1024 / duration:>12.1f} {cpu_time * 1000 / duration:>10.2f}"
+        )
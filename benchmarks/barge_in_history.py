@@ -0,0 +1,68 @@
+"""Dialogue history of an interrupted reply, for every order of the barge-in events.
+
+Run from the repository root :
+    python -m benchmarks.barge_in_history
+
+On a barge-in the NLG is told to stop (Interruption.trigger, NLG.interrupt), the TTS
+reports the part of the reply that was played (Interruption.report_spoken,
+NLG.trim_reply) and the NLG thread adds the reply to the history (NLG.add_reply).
+The three run on different threads, the check plays each order on a scripted NLG
+and verifies that the history ends with the spoken part only (nothing if no audio
+was played).
+"""
+
+from interruption import Interruption
+from nlg import NLG
+
+REPLY = "Sure, I went there last summer and the food was amazing, you should really try it."
+SPOKEN = "Sure, I went there"
+
+
+class ScriptedNLG(NLG):
+    def generate_response(self, messages=None):
+        return REPLY
+
+
+def start_reply(nlg):
+    """What respond does before generating"""
+    with nlg.history_lock:
+        nlg.dialogue_history.append({"role": "user", "content": "Have you been to Lisbon?"})
+        nlg.generating = True
+        nlg.spoken_text = None
+        nlg.pending_index = None
+    nlg._cancel.clear()
+
+
+SCENARIOS = {
+    "interrupt, trim_reply, add_reply": (["interrupt", "spoken", "add_reply"], SPOKEN),
+    "interrupt, add_reply, trim_reply": (["interrupt", "add_reply", "spoken"], SPOKEN),
+    "add_reply, interrupt, trim_reply": (["add_reply", "interrupt", "spoken"], SPOKEN),
+    "interrupt, add_reply, nothing played": (["interrupt", "add_reply"], None),
+    "not interrupted": (["add_reply"], REPLY),
+}
+
+
+if __name__ == "__main__":
+    for name, (events, expected) in SCENARIOS.items():
+        interruption = Interruption()
+        nlg = ScriptedNLG(interruption=interruption)
+        nlg.dialogue_history.append({"role": "system", "content": "Be brief."})
+        start_reply(nlg)
+        for event in events:
+            if event == "interrupt":
+                interruption.trigger()
+            elif event == "spoken":
+                interruption.report_spoken(SPOKEN)
+            else:
+                nlg.add_reply(REPLY)
+        last = nlg.dialogue_history[-1]
+        result = last["content"] if last["role"] == "assistant" else None
+        if result != expected:
+            raise AssertionError(f"{name} : history ends with {result!r}, expected {expected!r}")
+        # The next turn is appended after the reply
+        start_reply(nlg)
+        nlg.add_reply(REPLY)
+        roles = [message["role"] for message in nlg.dialogue_history]
+        if roles != ["system", "user"] + (["assistant"] if expected else []) + ["user", "assistant"]:
+            raise AssertionError(f"{name} : history roles {roles}")
+        print(f"{name} : {result!r}")
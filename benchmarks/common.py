@@ -0,0 +1,45 @@
+"""Helpers shared by the benchmark scripts"""
+
+import wave
+
+import numpy as np
+import retico_core
+from retico_core.audio import AudioIU
+from scipy.signal import resample_poly
+
+
+def load_wav(path, sample_rate=16000):
+    """Load a mono 16 bits WAV file as int16 samples at `sample_rate`"""
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path} : only 16 bits WAV files are supported")
+        rate = f.getframerate()
+        audio = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        if f.getnchannels() > 1:
+            audio = audio.reshape(-1, f.getnchannels()).mean(axis=1).astype(np.int16)
+    if rate != sample_rate:
+        audio = resample_poly(audio.astype(np.float32), sample_rate, rate)
+        audio = np.clip(audio, -32768, 32767).astype(np.int16)
+    return audio
+
+
+def split_frames(audio, frame_length=0.02, sample_rate=16000):
+    """Split int16 samples into frames of `frame_length` seconds (last one padded)"""
+    frame_size = int(frame_length * sample_rate)
+    nb_frames = -(-len(audio) // frame_size)
+    padded = np.zeros(nb_frames * frame_size, dtype=np.int16)
+    padded[: len(audio)] = audio
+    return padded.reshape(nb_frames, frame_size)
+
+
+def audio_message(frame, update_type, sample_rate=16000):
+    """Build an update message with one AudioIU holding `frame`"""
+    iu = AudioIU()
+    iu.set_audio(frame.tobytes(), len(frame), sample_rate, 2)
+    return retico_core.UpdateMessage.from_iu(iu, update_type)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return float(np.percentile(values, q))
@@ -0,0 +1,138 @@
+"""Prompt size and NLG latency over a long session, unbounded history vs token budget.
+
+Run from the repository root :
+    python -m benchmarks.dialogue_memory --turns 200 --memory_tokens 3072 --max_model_len 4096
+
+Plays `--turns` user turns into OpenAINLG against benchmarks/stub_llm.py (started
+here, it rejects the prompts over `--max_model_len` like vLLM), once with the
+unbounded dialogue history and once with the dialogue memory of
+dialogue_memory.py. The next turn starts `--gap` seconds after the reply, the time
+the user would take to answer, during which the summary is generated. For every
+window of `--window` turns the report gives :
+    - prompt : median and max prompt tokens
+    - latency : median NLG time of a turn (request to last token)
+    - ttft : median time to first token
+    - failed : turns rejected by the server (context length exceeded)
+and for the memory the number of folds, the summary time and the truncated prompts.
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import time
+
+from retico_core.text import TextIU
+
+from benchmarks.stub_llm import StubLLM, serve
+from nlg import OpenAINLG
+
+SUBJECTS = ["my sister", "the new job", "our trip to Lisbon", "the football game", "my cat", "the book club", "the garden", "my old laptop"]
+VERBS = ["keeps surprising me", "was a bit of a mess", "made me laugh yesterday", "is taking more time than I thought", "reminded me of you"]
+ENDINGS = ["what do you think?", "have you ever had that?", "anyway, how was your week?", "I should tell you more about it later.", "it is a long story."]
+
+
+def user_turn(i):
+    return f"You know, {SUBJECTS[i % len(SUBJECTS)]} {VERBS[i % len(VERBS)]}, {ENDINGS[i % len(ENDINGS)]}"
+
+
+def run_session(args, memory_tokens):
+    llm = StubLLM(args.llm_model_id, args.token_delay, args.prefill_delay, max_model_len=args.max_model_len)
+    server = serve(llm, port=args.llm_port)
+    nlg = OpenAINLG(
+        api_key="token-abc123",
+        api_base=f"http://127.0.0.1:{args.llm_port}/v1",
+        model_id=args.llm_model_id,
+        inference_args={"max_tokens": args.max_tokens},
+        tokenizer_id=args.tokenizer_id,
+        stream=True,
+        memory_tokens=memory_tokens,
+        memory_recent=args.memory_recent,
+    )
+    nlg.setup()
+    turns = []
+    for i in range(args.turns):
+        iu = TextIU(iuid=i)
+        iu.set_text(user_turn(i))
+        nlg.prompt_stats = {}
+        start = time.perf_counter()
+        failed = False
+        try:
+            nlg.respond(iu)
+        except Exception as e:  # Context length exceeded
+            failed = True
+            nlg.add_reply("")
+            logging.debug(f"Turn {i} failed : {e}")
+        turns.append(
+            {
+                "prompt_tokens": nlg.prompt_stats.get("prompt_tokens"),
+                "latency": time.perf_counter() - start,
+                "ttft": nlg.prompt_stats.get("prefill_time"),
+                "failed": failed,
+            }
+        )
+        time.sleep(args.gap)
+    if nlg.memory is not None:
+        nlg.memory.wait()
+    server.shutdown()
+    return turns, dict(nlg.memory.stats) if nlg.memory is not None else None
+
+
+def summarize_window(turns):
+    ok = [t for t in turns if not t["failed"]]
+    return {
+        "prompt_median": statistics.median(t["prompt_tokens"] for t in ok) if ok else None,
+        "prompt_max": max(t["prompt_tokens"] for t in ok) if ok else None,
+        "latency_median": statistics.median(t["latency"] for t in ok) if ok else None,
+        "ttft_median": statistics.median(t["ttft"] for t in ok if t["ttft"] is not None) if ok else None,
+        "failed": len(turns) - len(ok),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--window", type=int, default=25, help="Turns per line of the report")
+    parser.add_argument("--memory_tokens", type=int, default=3072)
+    parser.add_argument("--memory_recent", type=int, default=6)
+    parser.add_argument("--max_model_len", type=int, default=4096)
+    parser.add_argument("--max_tokens", type=int, default=250)
+    parser.add_argument("--tokenizer_id", type=str, default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--llm_model_id", type=str, default="stub")
+    parser.add_argument("--llm_port", type=int, default=8101)
+    parser.add_argument("--token_delay", type=float, default=0.005)
+    parser.add_argument("--prefill_delay", type=float, default=0.0001)
+    parser.add_argument("--gap", type=float, default=0.5, help="Time before the next user turn (s)")
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    report = {}
+    for name, memory_tokens in [("unbounded", None), ("memory", args.memory_tokens)]:
+        turns, memory_stats = run_session(args, memory_tokens)
+        windows = [
+            summarize_window(turns[i : i + args.window]) for i in range(0, len(turns), args.window)
+        ]
+        report[name] = {"windows": windows, "memory": memory_stats, "turns": turns}
+        print(f"\n{name}")
+        print(f"{'turns':>9} {'prompt p50':>10} {'prompt max':>10} {'latency (s)':>11} {'ttft (s)':>9} {'failed':>6}")
+        for i, w in enumerate(windows):
+            first = i * args.window
+            print(
+                f"{first:>4}-{min(first + args.window, len(turns)) - 1:<4} "
+                + " ".join(
+                    f"{w[key]:>{width}.{digits}f}" if w[key] is not None else f"{'-':>{width}}"
+                    for key, width, digits in [
+                        ("prompt_median", 10, 0),
+                        ("prompt_max", 10, 0),
+                        ("latency_median", 11, 3),
+                        ("ttft_median", 9, 3),
+                    ]
+                )
+                + f" {w['failed']:>6}"
+            )
+        if memory_stats is not None:
+            print(", ".join(f"{key} : {value}" for key, value in memory_stats.items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,126 @@
+"""End of turn latency vs false cut-offs of the fixed and adaptive endpointing.
+
+Run from the repository root :
+    python -m benchmarks.endpointing dialogue/*.wav
+
+Every WAV file is one complete user turn, pauses included. Its frames go through the
+VAD module followed by `--tail` seconds of silence :
+    - a COMMIT before the last speech frame of the file is a false cut-off
+    - the latency is the time between the last speech frame and the COMMIT
+If a transcript `<name>.txt` is next to a WAV file, its words are given to the
+predictor as partial transcripts, spread evenly over the speech of the turn and
+delayed by `--asr_delay` seconds like the streaming ASR would. Without transcripts,
+only the prosody is used.
+"""
+
+import argparse
+import json
+import os
+import statistics
+
+import numpy as np
+import retico_core
+
+from benchmarks.common import audio_message, load_wav, split_frames
+from endpointing import EndOfTurnPredictor
+from vad import VAD
+from vad_backends import create_backend
+
+FIXED = [0.3, 0.5, 0.7, 1.0]
+ADAPTIVE = [(0.2, 0.7), (0.25, 0.7), (0.3, 0.9), (0.4, 1.0)]
+
+
+def load_turn(path, frame_length):
+    frames = split_frames(load_wav(path), frame_length)
+    transcript_path = os.path.splitext(path)[0] + ".txt"
+    words = []
+    if os.path.exists(transcript_path):
+        with open(transcript_path) as f:
+            words = f.read().split()
+    return frames, words
+
+
+def run_turn(vad, frames, words, args):
+    """Returns (number of false cut-offs, latency of the final COMMIT or None)"""
+    # Reference decisions from a separate classifier, the VAD one keeps a state
+    is_speech = create_backend(prefilter=False).is_speech_batch(frames)
+    speech_frames = np.flatnonzero(is_speech).tolist()
+    if not speech_frames:
+        return 0, None
+    first_speech, last_speech = speech_frames[0], speech_frames[-1]
+    delay = int(args.asr_delay / args.frame_length)
+    tail = np.zeros((int(args.tail / args.frame_length), frames.shape[1]), dtype=np.int16)
+    cut_offs = 0
+    for i, frame in enumerate(np.concatenate([frames, tail])):
+        if vad.endpointing is not None and words:
+            # Words heard up to the frame i - delay
+            progress = (i - delay - first_speech) / max(last_speech - first_speech, 1)
+            nb_words = int(np.clip(progress, 0.0, 1.0) * len(words))
+            vad.endpointing.update_transcript(" ".join(words[:nb_words]))
+        message = vad.process_update(audio_message(frame, retico_core.UpdateType.ADD))
+        if message is None:
+            continue
+        for _, ut in message:
+            if ut == retico_core.UpdateType.COMMIT:
+                if i < last_speech:
+                    cut_offs += 1
+                else:
+                    return cut_offs, (i - last_speech) * args.frame_length
+    return cut_offs, None
+
+
+def run_config(name, endpointing, max_silence, turns, args):
+    vad = VAD(
+        mode=3,
+        max_silence_length=max_silence,
+        frame_length=args.frame_length,
+        min_turn_length=0.150,
+        endpointing=endpointing,
+    )
+    vad.setup()
+    latencies, cut_offs, missed = [], 0, 0
+    for frames, words in turns:
+        turn_cut_offs, latency = run_turn(vad, frames, words, args)
+        cut_offs += turn_cut_offs
+        if latency is None:
+            missed += 1
+        else:
+            latencies.append(latency)
+    return {
+        "config": name,
+        "mean_latency": statistics.mean(latencies) if latencies else None,
+        "p95_latency": float(np.percentile(latencies, 95)) if latencies else None,
+        "cut_off_rate": cut_offs / len(turns),
+        "missed": missed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wav", nargs="+", help="16 bits WAV files, one complete user turn each")
+    parser.add_argument("--frame_length", type=float, default=0.02)
+    parser.add_argument("--tail", type=float, default=2.0, help="Silence after each turn (s)")
+    parser.add_argument("--asr_delay", type=float, default=0.3, help="Delay of the partial transcripts (s)")
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    turns = [load_turn(path, args.frame_length) for path in args.wav]
+    results = []
+    for max_silence in FIXED:
+        results.append(run_config(f"fixed {max_silence}", None, max_silence, turns, args))
+    for min_silence, max_silence in ADAPTIVE:
+        predictor = EndOfTurnPredictor(
+            min_silence=min_silence, max_silence=max_silence, frame_length=args.frame_length
+        )
+        results.append(
+            run_config(f"adaptive {min_silence}-{max_silence}", predictor, max_silence, turns, args)
+        )
+
+    print(f"{'config':<20} {'mean (s)':>9} {'p95 (s)':>8} {'cut-offs/turn':>14} {'missed':>7}")
+    for r in results:
+        mean = f"{r['mean_latency']:.3f}" if r["mean_latency"] is not None else "-"
+        p95 = f"{r['p95_latency']:.3f}" if r["p95_latency"] is not None else "-"
+        print(f"{r['config']:<20} {mean:>9} {p95:>8} {r['cut_off_rate']:>14.3f} {r['missed']:>7}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
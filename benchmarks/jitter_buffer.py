@@ -0,0 +1,79 @@
+"""Frames cut by the TTS jitter buffer, one final frame per utterance.
+
+Run from the repository root :
+    python -m benchmarks.jitter_buffer --utterances 200
+
+Writes `--utterances` utterances of random chunks (the last one flagged final, and
+sometimes empty as in the immediate delivery mode) into the JitterBuffer of
+audio_output.py from a producer thread and reads the frames as its output thread
+does, without the real time pacing. Checks that every utterance gives exactly one
+final frame, its last one, that this frame carries no audio (it is sent as a COMMIT,
+the speakers only play ADD IUs) and that no sample is lost, then reports the number
+of frames and overruns.
+"""
+
+import argparse
+import threading
+
+import numpy as np
+
+from audio_output import JitterBuffer
+
+
+def produce(buffer, utterances):
+    for chunks in utterances:
+        for i, chunk in enumerate(chunks):
+            buffer.write(chunk, is_final=i == len(chunks) - 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--utterances", type=int, default=200)
+    parser.add_argument("--sample_rate", type=int, default=24000)
+    parser.add_argument("--frame_length", type=float, default=0.02)
+    parser.add_argument("--capacity", type=float, default=0.5, help="Jitter buffer capacity (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    utterances = []
+    for _ in range(args.utterances):
+        sizes = list(rng.integers(1, args.sample_rate, size=rng.integers(1, 6)))
+        if rng.random() < 0.3:
+            sizes.append(0)  # Empty final chunk
+        utterances.append([np.full(n, 0.1, dtype=np.float32) for n in sizes])
+
+    buffer = JitterBuffer(
+        lambda *_: None,
+        args.sample_rate,
+        frame_length=args.frame_length,
+        prefill=0.0,
+        capacity=args.capacity,
+    )
+    producer = threading.Thread(target=produce, args=(buffer, utterances), daemon=True)
+    producer.start()
+
+    nb_frames = 0
+    end = 0  # Position of the end of the utterance in the buffer
+    for index, chunks in enumerate(utterances):
+        end += sum(len(chunk) for chunk in chunks)
+        while True:
+            frame, is_final, _, _ = buffer.next_frame()
+            nb_frames += 1
+            if is_final:
+                break
+            if buffer.read_pos > end:
+                raise AssertionError(f"Utterance {index} : a frame runs over its end")
+        if len(frame) > 0:
+            raise AssertionError(f"Utterance {index} : {len(frame)} samples in its final frame")
+        # The final frame is the last one : it ends at the end of the utterance
+        if buffer.read_pos != end:
+            raise AssertionError(
+                f"Utterance {index} : final frame ends at {buffer.read_pos}, the utterance at {end}"
+            )
+    producer.join()
+    if buffer.write_pos != buffer.read_pos or buffer.marks:
+        raise AssertionError("Audio or marks left in the jitter buffer after the last utterance")
+    print(
+        f"{args.utterances} utterances, {nb_frames} frames, one empty final frame each, Overruns : {buffer.nb_overruns}"
+    )
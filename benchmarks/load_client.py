@@ -0,0 +1,129 @@
+"""Load generator for server.py : concurrent sessions replaying recorded user turns.
+
+Start the server (and the LLM server, e.g. benchmarks/stub_llm.py), then from the
+repository root :
+    python -m benchmarks.load_client turn1.wav turn2.wav --sessions 1 2 4 8 --turns 5
+
+For each concurrency level, every session streams its microphone in real time like
+a client would : a turn, then silence until the reply has been received (or
+`--reply_timeout`). The latency of a turn is the time between the end of its audio and
+the first byte of agent speech, the reply time the time until "reply_end".
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import numpy as np
+from websockets.asyncio.client import connect
+
+from benchmarks.common import load_wav, percentile, split_frames
+
+FRAME_LENGTH = 0.02
+
+
+async def run_session(args, turns, session_index, results):
+    silence = np.zeros(int(FRAME_LENGTH * 16000), dtype=np.int16).tobytes()
+    async with connect(args.url, max_size=2**22) as websocket:
+        ready = json.loads(await websocket.recv())
+        assert ready["type"] == "ready", ready
+        state = {"first_audio": None, "reply_end": None}
+        reply_received = asyncio.Event()
+
+        async def receive():
+            async for message in websocket:
+                now = time.perf_counter()
+                if isinstance(message, bytes):
+                    if state["first_audio"] is None:
+                        state["first_audio"] = now
+                elif json.loads(message)["type"] == "reply_end":
+                    state["reply_end"] = now
+                    reply_received.set()
+
+        receiver = asyncio.create_task(receive())
+        next_time = time.perf_counter()
+
+        async def send_frame(frame):
+            # Real time pacing on a fixed schedule
+            nonlocal next_time
+            next_time += FRAME_LENGTH
+            await websocket.send(frame)
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        for turn_index in range(args.turns):
+            frames = turns[(session_index + turn_index) % len(turns)]
+            state.update(first_audio=None, reply_end=None)
+            reply_received.clear()
+            for frame in frames:
+                await send_frame(frame.tobytes())
+            speech_end = time.perf_counter()
+            deadline = speech_end + args.reply_timeout
+            while not reply_received.is_set() and time.perf_counter() < deadline:
+                await send_frame(silence)
+            results.append(
+                {
+                    "session": session_index,
+                    "turn": turn_index,
+                    "latency": None if state["first_audio"] is None else state["first_audio"] - speech_end,
+                    "reply_time": None if state["reply_end"] is None else state["reply_end"] - speech_end,
+                }
+            )
+            # The user listens to the end of the reply before speaking again
+            for _ in range(int(args.pause / FRAME_LENGTH)):
+                await send_frame(silence)
+        receiver.cancel()
+
+
+async def run_level(args, turns, nb_sessions):
+    results = []
+    outcomes = await asyncio.gather(
+        *(run_session(args, turns, i, results) for i in range(nb_sessions)),
+        return_exceptions=True,
+    )
+    errors = [repr(outcome) for outcome in outcomes if isinstance(outcome, Exception)]
+    latencies = [r["latency"] for r in results if r["latency"] is not None]
+    return {
+        "sessions": nb_sessions,
+        "turns": len(results),
+        "timeouts": sum(r["latency"] is None for r in results),
+        "errors": errors,
+        "latency_median": statistics.median(latencies) if latencies else None,
+        "latency_p95": percentile(latencies, 95),
+        "latency_max": max(latencies, default=None),
+        "results": results,
+    }
+
+
+def format_seconds(value):
+    return f"{value:.3f}" if value is not None else "-"
+
+
+async def main(args):
+    turns = [split_frames(load_wav(path), FRAME_LENGTH) for path in args.wav]
+    report = []
+    print(f"{'sessions':>8} {'turns':>6} {'timeouts':>9} {'errors':>7} {'median (s)':>11} {'p95 (s)':>8} {'max (s)':>8}")
+    for nb_sessions in args.sessions:
+        level = await run_level(args, turns, nb_sessions)
+        report.append(level)
+        print(
+            f"{nb_sessions:>8} {level['turns']:>6} {level['timeouts']:>9} {len(level['errors']):>7} {format_seconds(level['latency_median']):>11} {format_seconds(level['latency_p95']):>8} {format_seconds(level['latency_max']):>8}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wav", nargs="+", help="16 bits WAV files, one user turn each")
+    parser.add_argument("--url", type=str, default="ws://localhost:8765")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session")
+    parser.add_argument("--reply_timeout", type=float, default=20.0)
+    parser.add_argument("--pause", type=float, default=1.0, help="Silence after a reply (s)")
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,289 @@
+"""Offline replay of recorded user turns through the VAD, ASR, NLG and TTS modules.
+
+Run from the repository root :
+    python -m benchmarks.replay turn1.wav turn2.wav --device cpu --speed 2 --output replay.json
+
+The WAV files are played by a file source instead of the microphone, each one
+followed by `--gap` seconds of silence so the VAD commits the turn, and the next one
+starts once the agent reply has been received. The NLG talks to the stub server of
+benchmarks/stub_llm.py (started here unless `--llm_url` is given) and the speaker is
+replaced by a sink that records when the audio arrives. The report holds the latency
+of every stage of each turn (see metrics.py) and the real-time factors :
+    - asr : ASR time / duration of the input audio
+    - tts : time from the first to the last audio chunk of a reply / duration of the reply
+    - pipeline : wall time of the replay / duration of the input audio
+With `--speed` > 1 the audio is sent faster than real time, the VAD still counts the
+silence in frames but the endpointing interval is measured in wall time and shrinks.
+"""
+
+import argparse
+import json
+import logging
+import statistics
+import threading
+import time
+
+import numpy as np
+import retico_core
+from retico_core.audio import AudioIU
+
+from asr import ASR
+from benchmarks.common import load_wav, split_frames
+from benchmarks.stub_llm import StubLLM, serve
+from metrics import LatencyTracer
+from nlg import OpenAINLG
+from tts import TTS
+from vad import VAD
+
+
+class WavSource(retico_core.AbstractProducingModule):
+    """Plays user turns as 16 bits audio frames, paced at `speed` times real time"""
+
+    @staticmethod
+    def name():
+        return "WAV Source Module"
+
+    @staticmethod
+    def description():
+        return "A module that replays WAV files as if they came from the microphone"
+
+    @staticmethod
+    def output_iu():
+        return AudioIU
+
+    def __init__(
+        self,
+        turns,
+        frame_length=0.02,
+        sample_rate=16000,
+        speed=1.0,
+        gap=1.5,
+        reply_done=None,
+        reply_timeout=30.0,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.turns = turns  # int16 samples of each turn
+        self.frame_length = frame_length
+        self.sample_rate = sample_rate
+        self.speed = speed
+        self.gap = gap  # Silence after each turn (s), longer than the VAD max silence
+        self.reply_done = reply_done  # Event set when the agent finished its reply
+        self.reply_timeout = reply_timeout
+        self.done = threading.Event()
+        self.frames = self.generate_frames()
+        self.next_time = None
+
+    def generate_frames(self):
+        silence = np.zeros(int(self.gap * self.sample_rate), dtype=np.int16)
+        for turn in self.turns:
+            if self.reply_done is not None:
+                self.reply_done.clear()
+            for frame in split_frames(
+                np.concatenate([turn, silence]), self.frame_length, self.sample_rate
+            ):
+                yield frame
+            if self.reply_done is not None:
+                if not self.reply_done.wait(self.reply_timeout):
+                    logging.warning("[REPLAY] No reply received for the turn")
+                self.next_time = None
+
+    def process_update(self, _):
+        if self.done.is_set():
+            time.sleep(0.05)
+            return None
+        frame = next(self.frames, None)
+        if frame is None:
+            self.done.set()
+            return None
+        # Pace the frames on a fixed schedule so the delays do not accumulate
+        now = time.perf_counter()
+        if self.next_time is None:
+            self.next_time = now
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+        self.next_time += self.frame_length / self.speed
+        output_iu = self.create_iu()
+        output_iu.set_audio(frame.tobytes(), len(frame), self.sample_rate, 2)
+        return retico_core.UpdateMessage.from_iu(output_iu, retico_core.UpdateType.ADD)
+
+
+class TimingSink(retico_core.AbstractConsumingModule):
+    """Replaces the speaker : records the arrival of the audio of each reply"""
+
+    @staticmethod
+    def name():
+        return "Timing Sink Module"
+
+    @staticmethod
+    def description():
+        return "A module that records when the agent audio would be played"
+
+    @staticmethod
+    def input_ius():
+        return [AudioIU]
+
+    @staticmethod
+    def output_iu():
+        return None
+
+    def __init__(self, tracer=None, **kwargs):
+        super().__init__(**kwargs)
+        self.tracer = tracer
+        self.reply_done = threading.Event()
+        self.replies = []
+        self.current = None
+
+    def process_update(self, update_message):
+        for iu, ut in update_message:
+            now = time.monotonic()
+            if self.current is None:
+                self.current = {
+                    "trace_id": iu.meta_data.get("trace_id"),
+                    "first_chunk": None,
+                    "last_chunk": None,
+                    "audio_duration": 0.0,
+                }
+            if iu.nframes > 0:
+                if self.tracer is not None:
+                    self.tracer.mark(iu.meta_data.get("trace_id"), "first_output")
+                if self.current["first_chunk"] is None:
+                    self.current["first_chunk"] = now
+                self.current["last_chunk"] = now
+                self.current["audio_duration"] += iu.nframes / iu.rate
+            if ut == retico_core.UpdateType.COMMIT:
+                self.replies.append(self.current)
+                self.current = None
+                self.reply_done.set()
+        return None
+
+
+def build_report(args, tracer, sink, asr_time, input_duration, wall_time):
+    durations = dict(tracer.completed)
+    turns = []
+    tts_time, tts_audio = 0.0, 0.0
+    for reply in sink.replies:
+        turn = {"trace_id": reply["trace_id"], "reply_duration": reply["audio_duration"]}
+        turn.update(durations.get(reply["trace_id"], {}))
+        if reply["first_chunk"] is not None:
+            tts_time += reply["last_chunk"] - reply["first_chunk"]
+            tts_audio += reply["audio_duration"]
+        turns.append(turn)
+    intervals = {}
+    for name in LatencyTracer.INTERVALS:
+        values = [turn[name] for turn in turns if name in turn]
+        if values:
+            intervals[name] = {
+                "median": statistics.median(values),
+                "p95": float(np.percentile(values, 95)),
+                "max": max(values),
+            }
+    return {
+        "config": vars(args),
+        "input_duration": input_duration,
+        "wall_time": wall_time,
+        "rtf": {
+            "asr": asr_time / input_duration,
+            "tts": tts_time / tts_audio if tts_audio > 0 else None,
+            "pipeline": wall_time / input_duration,
+        },
+        "intervals": intervals,
+        "turns": turns,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wav", nargs="+", help="16 bits WAV files, one user turn each")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--asr_model_id", type=str, default="openai/whisper-large-v3-turbo")
+    parser.add_argument("--asr_streaming", action="store_true")
+    parser.add_argument("--tokenizer_id", type=str, default="Qwen/Qwen2.5-0.5B-Instruct")
+    parser.add_argument("--llm_url", type=str, default=None, help="Use this server instead of the stub")
+    parser.add_argument("--llm_model_id", type=str, default="stub")
+    parser.add_argument("--llm_port", type=int, default=8100)
+    parser.add_argument("--token_delay", type=float, default=0.02)
+    parser.add_argument("--tts_delivery", type=str, default="immediate", choices=["lookahead", "immediate"])
+    parser.add_argument("--tts_pipelined", action="store_true")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed-up over real time")
+    parser.add_argument("--gap", type=float, default=1.5, help="Silence after each turn (s)")
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    frame_length = 0.02
+    sample_rate = 16000
+    turns = [load_wav(path, sample_rate) for path in args.wav]
+    input_duration = sum(len(turn) for turn in turns) / sample_rate
+
+    llm_url = args.llm_url
+    server = None
+    if llm_url is None:
+        server = serve(StubLLM(args.llm_model_id, args.token_delay), port=args.llm_port)
+        llm_url = f"http://127.0.0.1:{args.llm_port}/v1"
+
+    tracer = LatencyTracer()
+    sink = TimingSink(tracer=tracer)
+    source = WavSource(
+        turns,
+        frame_length=frame_length,
+        sample_rate=sample_rate,
+        speed=args.speed,
+        gap=args.gap,
+        reply_done=sink.reply_done,
+    )
+    vad = VAD(
+        mode=3,
+        sample_rate=sample_rate,
+        max_silence_length=0.700,
+        frame_length=frame_length,
+        min_turn_length=0.150,
+        tracer=tracer,
+    )
+    asr = ASR(
+        model_id=args.asr_model_id,
+        device=args.device,
+        sample_rate=sample_rate,
+        streaming=args.asr_streaming,
+        tracer=tracer,
+    )
+    nlg = OpenAINLG(
+        api_key="token-abc123",
+        api_base=llm_url,
+        model_id=args.llm_model_id,
+        inference_args={"max_tokens": 250},
+        tokenizer_id=args.tokenizer_id,
+        stream=True,
+        tracer=tracer,
+    )
+    tts = TTS(
+        sample_rate=24000,
+        model_args={"device": args.device, "lang_code": "a", "repo_id": "hexgrad/Kokoro-82M"},
+        delivery=args.tts_delivery,
+        pipelined=args.tts_pipelined,
+        tracer=tracer,
+    )
+    source.subscribe(vad)
+    vad.subscribe(asr)
+    asr.subscribe(nlg)
+    nlg.subscribe(tts)
+    tts.subscribe(sink)
+
+    retico_core.network.run(source)  # Loads the models before the replay starts
+    start = time.perf_counter()
+    source.done.wait()
+    wall_time = time.perf_counter() - start
+    retico_core.network.stop(source)
+    if server is not None:
+        server.shutdown()
+
+    asr_time = sum(turn.get("asr", 0.0) for _, turn in tracer.completed)
+    report = build_report(args, tracer, sink, asr_time, input_duration, wall_time)
+    print(f"{len(report['turns'])} turns, {input_duration:.1f}(s) of audio replayed in {wall_time:.1f}(s)")
+    print(f"{'interval':<16} {'median':>8} {'p95':>8} {'max':>8}")
+    for name, values in report["intervals"].items():
+        print(f"{name:<16} {values['median']:>8.3f} {values['p95']:>8.3f} {values['max']:>8.3f}")
+    print("RTF : " + ", ".join(f"{k} = {v:.3f}" for k, v in report["rtf"].items() if v is not None))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
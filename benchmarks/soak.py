@@ -0,0 +1,182 @@
+"""Memory of a long session, IUs kept by retico vs released by the IU retention.
+
+Run from the repository root :
+    python -m benchmarks.soak --hours 2
+    python -m benchmarks.soak --hours 8 --report_every 1800 --output soak.json
+
+Streams `--hours` of synthetic conversation (speech bursts and noise) faster than
+real time through the modules of a session, called directly without the retico
+threads : the WebSocket source of server.py, the VAD, the ASR (feature buffer, the
+decoding is replaced by a stub engine) and, for every committed turn,
+`--reply_length` seconds of agent speech through the TTS output frames and the
+WebSocket sink (messages dropped). Each mode runs in its own process,
+with a report every `--report_every` seconds of audio :
+    - rss : resident memory (MB)
+    - ius : IncrementalUnit objects alive
+    - chain : IUs reachable from the last IU of the source, the VAD and the TTS
+    - held : audio bytes held by these chains (KB)
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing
+import queue
+import threading
+import time
+import types
+
+import numpy as np
+import retico_core
+
+from asr import ASR
+from audio_ring import AudioRing, RingAudioIU
+from audio_output import PCMConverter
+from benchmarks.audio_path import FeatureExtractor
+from benchmarks.vad_backends import synthetic_audio
+from retention import IURetention, rss_bytes
+from server import WebSocketSink, WebSocketSource
+from tts import TTS
+from vad import VAD
+
+TTS_RATE = 24000
+
+
+class StubEngine:
+    """Replaces the Whisper decoding of the turns"""
+
+    def transcribe(self, features, nb_frames=None):
+        return "hello there"
+
+
+def chain_stats(module):
+    """(IUs, audio bytes) reachable from the last IU created by the module"""
+    nb_ius, nb_bytes = 0, 0
+    iu = module._previous_iu
+    while iu is not None:
+        nb_ius += 1
+        if isinstance(iu, RingAudioIU) and iu.ring is not None:
+            nb_bytes += 2 * (iu.end - iu.start)
+        elif getattr(iu, "raw_audio", None) is not None:
+            audio = iu.raw_audio
+            nb_bytes += audio.nbytes if hasattr(audio, "nbytes") else len(audio)
+        iu = iu.previous_iu
+    return nb_ius, nb_bytes
+
+
+def create_session(retention, args):
+    ring = AudioRing(sample_rate=16000)
+    source = WebSocketSource(ring=ring)
+    vad = VAD(
+        mode=3,
+        sample_rate=16000,
+        max_silence_length=0.700,
+        frame_length=0.02,
+        min_turn_length=0.150,
+        backend=args.vad_backend,
+        ring=ring,
+        retention=retention,
+    )
+    vad.setup()
+    resources = types.SimpleNamespace(
+        device="cpu",
+        torch_dtype=None,
+        model=None,
+        processor=types.SimpleNamespace(feature_extractor=FeatureExtractor()),
+        pipe=None,
+        lock=threading.Lock(),
+    )
+    asr = ASR(sample_rate=16000, resources=resources, engine=StubEngine(), retention=retention)
+    asr.setup()
+    tts = TTS(sample_rate=TTS_RATE, model_args={})
+    tts.converter = PCMConverter(int(0.02 * TTS_RATE))
+    sink = WebSocketSink(lambda message: None, retention=retention)
+    tts.subscribe(sink)
+    return source, vad, asr, tts, sink
+
+
+def reply(tts, sink, args):
+    """Agent speech of a turn, in frames of 20ms through the TTS output and the sink"""
+    frame = (0.1 * np.sin(np.arange(int(0.02 * TTS_RATE)) / 10)).astype(np.float32)
+    nb_frames = int(args.reply_length / 0.02)
+    sink_queue = tts.right_buffers()[0]
+    for i in range(nb_frames):
+        tts.send_message(frame, is_final=i == nb_frames - 1)
+        while True:
+            try:
+                sink.process_update(sink_queue.get_nowait())
+            except queue.Empty:
+                break
+
+
+def soak(mode, args):
+    retention = IURetention() if mode == "released" else None
+    source, vad, asr, tts, sink = create_session(retention, args)
+    # The same synthetic audio is played in a loop, the memory of the generator is
+    # not part of the measure
+    audio = synthetic_audio(args.loop_length, speech_ratio=0.5)
+    message_size = int(args.message_length * 16000)
+    messages = [audio[i : i + message_size].tobytes() for i in range(0, len(audio), message_size)]
+    total = int(args.hours * 3600 / args.message_length)
+    per_report = int(args.report_every / args.message_length)
+    reports, turns = [], 0
+    start = time.perf_counter()
+    for i in range(total):
+        source.push(messages[i % len(messages)])
+        while not source.frames.empty():
+            output = vad.process_update(source.process_update(None))
+            if output is None:
+                continue
+            for iu, ut in output:
+                text = asr.process_update(retico_core.UpdateMessage.from_iu(iu, ut))
+                if text is not None and ut == retico_core.UpdateType.COMMIT:
+                    turns += 1
+                    reply(tts, sink, args)
+        if (i + 1) % per_report == 0:
+            gc.collect()
+            chains = [chain_stats(module) for module in (source, vad, tts)]
+            reports.append(
+                {
+                    "audio_hours": (i + 1) * args.message_length / 3600,
+                    "rss_mb": rss_bytes() / 2**20,
+                    "ius": sum(
+                        1 for o in gc.get_objects() if isinstance(o, retico_core.IncrementalUnit)
+                    ),
+                    "chain": sum(c[0] for c in chains),
+                    "held_kb": sum(c[1] for c in chains) / 1024,
+                    "turns": turns,
+                    "elapsed": time.perf_counter() - start,
+                }
+            )
+    return {"mode": mode, "reports": reports, "retention": retention.stats if retention else None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=2.0, help="Audio streamed per mode")
+    parser.add_argument("--report_every", type=float, default=600.0, help="Audio between two reports (s)")
+    parser.add_argument("--message_length", type=float, default=0.1, help="Audio per client message (s)")
+    parser.add_argument("--loop_length", type=float, default=600.0, help="Synthetic audio played in a loop (s)")
+    parser.add_argument("--reply_length", type=float, default=3.0, help="Agent speech per turn (s)")
+    parser.add_argument("--vad_backend", type=str, default="energy", choices=["webrtc", "energy"])
+    parser.add_argument("--modes", type=str, nargs="+", default=["retained", "released"])
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")  # A fresh process per mode for the RSS
+    report = {}
+    for mode in args.modes:
+        with context.Pool(1) as pool:
+            result = pool.apply(soak, (mode, args))
+        report[mode] = result
+        print(f"\n{mode}")
+        print(f"{'hours':>6} {'rss (MB)':>9} {'ius':>7} {'chain':>6} {'held (KB)':>9} {'turns':>6} {'time (s)':>8}")
+        for r in result["reports"]:
+            print(
+                f"{r['audio_hours']:>6.2f} {r['rss_mb']:>9.1f} {r['ius']:>7} {r['chain']:>6} {r['held_kb']:>9.1f} {r['turns']:>6} {r['elapsed']:>8.1f}"
+            )
+        if result["retention"] is not None:
+            print(", ".join(f"{key} : {value}" for key, value in result["retention"].items()))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
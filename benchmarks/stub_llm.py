@@ -0,0 +1,185 @@
+"""Stand-in for the vLLM OpenAI-compatible server, for benchmarks without a GPU.
+
+Run from the repository root :
+    python -m benchmarks.stub_llm --port 8000 --token_delay 0.02
+
+Serves /v1/models and /v1/completions (streamed or not). The replies are canned
+sentences sent word by word, one word per token, `token_delay` seconds apart. The
+prompt is processed in `prefill_delay` seconds per token not shared with the previous
+prompt, which mimics the prefix cache of vLLM, the shared tokens are reported as
+`cached_tokens` in the usage. With `max_model_len`, the requests that do not fit are
+rejected with an error 400, like vLLM.
+"""
+
+import argparse
+import itertools
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLIES = [
+    "Oh nice, that sounds fun. What did you like the most about it?",
+    "I am not sure, to be honest. Maybe we could look it up together later?",
+    "Yeah, I know what you mean. It happens to me all the time, especially on Mondays.",
+    "That is a good question. I think it depends on the weather, but probably yes.",
+]
+
+
+class StubLLM:
+    def __init__(
+        self,
+        model_id="stub",
+        token_delay=0.02,
+        prefill_delay=0.0001,
+        replies=REPLIES,
+        max_model_len=None,
+    ):
+        self.model_id = model_id
+        self.token_delay = token_delay  # Time between two generated tokens (s)
+        self.prefill_delay = prefill_delay  # Time per uncached prompt token (s)
+        self.replies = itertools.cycle(replies)
+        self.max_model_len = max_model_len  # Prompt and reply tokens, unlimited if None
+        self.lock = threading.Lock()
+        self.last_prompt = []
+        self.nb_requests = 0
+
+    def prefill(self, prompt):
+        """Wait for the prefill of the prompt, returns (prompt tokens, cached tokens)"""
+        if isinstance(prompt, str):
+            prompt = prompt.split()
+        with self.lock:
+            cached = 0
+            for previous, current in zip(self.last_prompt, prompt):
+                if previous != current:
+                    break
+                cached += 1
+            self.last_prompt = list(prompt)
+            self.nb_requests += 1
+            reply = next(self.replies)
+        time.sleep(self.prefill_delay * (len(prompt) - cached))
+        return len(prompt), cached, reply
+
+    def tokens(self, reply, max_tokens):
+        return re.findall(r"\S+\s*", reply)[:max_tokens]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    llm = None  # Set by serve
+
+    def log_message(self, format, *args):
+        pass  # Keep the benchmark output readable
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/v1/models":
+            return self.send_json({"error": "not found"}, 404)
+        self.send_json(
+            {
+                "object": "list",
+                "data": [
+                    {"id": self.llm.model_id, "object": "model", "created": 0, "owned_by": "stub"}
+                ],
+            }
+        )
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/completions":
+            return self.send_json({"error": "not found"}, 404)
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        max_tokens = request.get("max_tokens") or 250
+        prompt = request["prompt"]
+        nb_tokens = len(prompt.split() if isinstance(prompt, str) else prompt)
+        if self.llm.max_model_len is not None and nb_tokens + max_tokens > self.llm.max_model_len:
+            message = f"This model's maximum context length is {self.llm.max_model_len} tokens. However, you requested {nb_tokens + max_tokens} tokens"
+            return self.send_json(
+                {"object": "error", "message": message, "type": "BadRequestError", "code": 400}, 400
+            )
+        prompt_tokens, cached_tokens, reply = self.llm.prefill(prompt)
+        tokens = self.llm.tokens(reply, max_tokens)
+        completion_id = f"cmpl-{uuid.uuid4().hex}"
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+
+        def completion(text, finish_reason):
+            return {
+                "id": completion_id,
+                "object": "text_completion",
+                "created": int(time.time()),
+                "model": self.llm.model_id,
+                "choices": [
+                    {"index": 0, "text": text, "logprobs": None, "finish_reason": finish_reason}
+                ],
+            }
+
+        if not request.get("stream", False):
+            time.sleep(self.llm.token_delay * len(tokens))
+            body = completion("".join(tokens), "stop")
+            body["usage"] = usage
+            return self.send_json(body)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for i, token in enumerate(tokens):
+                time.sleep(self.llm.token_delay)
+                finish_reason = "stop" if i == len(tokens) - 1 else None
+                self.send_event(completion(token, finish_reason))
+            if (request.get("stream_options") or {}).get("include_usage"):
+                body = completion("", None)
+                body["choices"] = []
+                body["usage"] = usage
+                self.send_event(body)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client aborted the request (barge-in, cancelled speculation)
+
+    def send_event(self, body):
+        self.wfile.write(f"data: {json.dumps(body)}\n\n".encode())
+        self.wfile.flush()
+
+
+def serve(llm, host="127.0.0.1", port=8000):
+    """Start the server on a background thread, returns the server"""
+    handler = type("Handler", (StubHandler,), {"llm": llm})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model_id", type=str, default="stub")
+    parser.add_argument("--token_delay", type=float, default=0.02)
+    parser.add_argument("--prefill_delay", type=float, default=0.0001)
+    parser.add_argument("--max_model_len", type=int, default=None)
+    args = parser.parse_args()
+
+    llm = StubLLM(args.model_id, args.token_delay, args.prefill_delay, max_model_len=args.max_model_len)
+    server = serve(llm, args.host, args.port)
+    print(f"Stub LLM serving {args.model_id} on http://{args.host}:{args.port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
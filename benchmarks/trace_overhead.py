@@ -0,0 +1,85 @@
+"""Cost of the hot-path trace recorder and of the per-frame debug messages.
+
+Run from the repository root :
+    python -m benchmarks.trace_overhead --duration 60 --trace trace.json
+
+Reports, in microseconds per call :
+    - record : TraceRecorder.record alone
+    - vad : VAD.process_update on a 20ms frame (synthetic speech bursts), without
+      recorder and instrumented with instrument_module
+    - debug f-string : a logging.debug f-string with debug logging off, formatted or
+      behind the isEnabledFor check the modules use
+With `--trace` the trace of the instrumented run is written as Chrome trace JSON.
+"""
+
+import argparse
+import logging
+import time
+
+import retico_core
+
+from benchmarks.common import audio_message
+from benchmarks.vad_backends import synthetic_audio
+from console_colors import ConsoleColors
+from trace_recorder import TraceRecorder
+from vad import VAD
+
+
+def per_call(function, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        function()
+    return (time.perf_counter() - start) * 1e6 / n
+
+
+def run_vad(frames, args, recorder=None):
+    vad = VAD(mode=3, sample_rate=16000, frame_length=0.02, backend=args.vad_backend)
+    vad.setup()
+    if recorder is not None:
+        recorder.instrument_module(vad, "VAD")
+    messages = [audio_message(frame, retico_core.UpdateType.ADD) for frame in frames]
+    start = time.perf_counter()
+    for message in messages:
+        vad.process_update(message)
+    return (time.perf_counter() - start) * 1e6 / len(messages)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=60.0, help="Audio sent to the VAD (s)")
+    parser.add_argument("--calls", type=int, default=200000, help="Calls of the micro benchmarks")
+    parser.add_argument("--vad_backend", type=str, default="energy", choices=["webrtc", "energy"])
+    parser.add_argument("--trace", type=str, default=None, help="Write the trace of the instrumented VAD")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    recorder = TraceRecorder()
+    key = recorder.key("benchmark", "record")
+    print(f"record : {per_call(lambda: recorder.record(key, time.perf_counter_ns()), args.calls):.3f} (us)")
+
+    audio = synthetic_audio(args.duration)
+    frames = audio[: len(audio) // 320 * 320].reshape(-1, 320)
+    run_vad(frames[:500], args)  # Warm-up
+    baseline = min(run_vad(frames, args) for _ in range(3))
+    recorder = TraceRecorder()
+    instrumented = min(run_vad(frames, args, recorder) for _ in range(3))
+    print(f"vad : {baseline:.2f} (us) without recorder, {instrumented:.2f} (us) instrumented")
+    if args.trace:
+        recorder.dump(args.trace)
+
+    nb_samples = 32000
+
+    def formatted():
+        logging.debug(
+            f"{ConsoleColors.MAGENTA}ASR:{ConsoleColors.RESET} Received new audio chunk, buffer size = {nb_samples}"
+        )
+
+    def guarded():
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(
+                f"{ConsoleColors.MAGENTA}ASR:{ConsoleColors.RESET} Received new audio chunk, buffer size = {nb_samples}"
+            )
+
+    print(
+        f"debug f-string : {per_call(formatted, args.calls):.3f} (us) formatted, {per_call(guarded, args.calls):.3f} (us) guarded"
+    )
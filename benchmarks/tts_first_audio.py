@@ -0,0 +1,88 @@
+"""Time-to-first-audio of KoKoRoTTS for each delivery mode.
+
+Run from the repository root :
+    python -m benchmarks.tts_first_audio --device cpu --runs 5
+
+Each text is synthesized as a single final segment. "first chunk" is the delay until
+the first chunk reaches the output callback, "first audible" the delay until the first
+ADD chunk (SpeakerModule only plays ADD IUs, a lone COMMIT chunk is never heard).
+Kokoro splits its input on new lines, the multi-line texts produce several chunks.
+"""
+
+import argparse
+import json
+import queue
+import statistics
+import time
+
+from tts import KoKoRoTTS, Segment
+
+TEXTS = [
+    "Sure, that sounds great.",
+    "I went hiking last weekend.\nThe weather was perfect the whole day.\nWe should go together next time!",
+    "Honestly, I have no idea.\nMaybe we can ask someone else?\nOr just look it up later tonight.\nWhat do you think?",
+]
+
+MODES = [
+    ("lookahead", False),
+    ("lookahead", True),
+    ("immediate", False),
+    ("immediate", True),
+]
+
+
+def run_mode(delivery, pipelined, args):
+    events = []
+
+    def callback(audio, is_final, epoch=0, trace_id=None):
+        events.append((time.perf_counter(), audio is not None and len(audio) > 0, is_final))
+
+    tts = KoKoRoTTS(
+        buffer_in=queue.Queue(),
+        sample_rate=args.sample_rate,
+        callback=callback,
+        model_args={"device": args.device, "lang_code": "a", "repo_id": "hexgrad/Kokoro-82M"},
+        delivery=delivery,
+        pipelined=pipelined,
+    )
+    tts.synthesize(Segment(TEXTS[0], True))  # Warm-up
+
+    first_chunk, first_audible, total = [], [], []
+    for _ in range(args.runs):
+        for text in TEXTS:
+            events.clear()
+            start = time.perf_counter()
+            tts.synthesize(Segment(text, True))
+            end = time.perf_counter()
+            audio_events = [t for t, has_audio, _ in events if has_audio]
+            audible = [t for t, has_audio, is_final in events if has_audio and not is_final]
+            first_chunk.append(audio_events[0] - start)
+            first_audible.append((audible[0] if audible else end) - start)
+            total.append(end - start)
+
+    return {
+        "delivery": delivery,
+        "pipelined": pipelined,
+        "first_chunk_median": statistics.median(first_chunk),
+        "first_audible_median": statistics.median(first_audible),
+        "total_median": statistics.median(total),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--sample_rate", type=int, default=24000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", type=str, default=None, help="Write a JSON report")
+    args = parser.parse_args()
+
+    results = [run_mode(delivery, pipelined, args) for delivery, pipelined in MODES]
+    print(f"{'delivery':<10} {'pipelined':<10} {'first chunk':>12} {'first audible':>14} {'total':>8}")
+    for r in results:
+        print(
+            f"{r['delivery']:<10} {str(r['pipelined']):<10} {r['first_chunk_median']:>12.3f} {r['first_audible_median']:>14.3f} {r['total_median']:>8.3f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
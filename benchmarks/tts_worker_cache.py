@@ -0,0 +1,91 @@
+"""The TTS audio cache with Kokoro in-process and in a TTS worker.
+
+Run from the repository root :
+    python -m benchmarks.tts_worker_cache --device cpu
+
+For each mode (in-process : KokoroResources, worker : TTSWorker of workers.py) a
+KoKoRoTTS with an AudioCache writing to a temporary directory prewarms the phrases
+as TTS.setup does, then synthesizes them as final segments. Checks that every
+phrase is a cache hit and gives the audio of the prewarm, and that a new cache on
+the same directory gives it back from disk. Reports the synthesis time of the cold
+(prewarm) and cached passes and the cache stats.
+"""
+
+import argparse
+import queue
+import tempfile
+import time
+
+import numpy as np
+
+from tts import KokoroResources, KoKoRoTTS, Segment
+from tts_cache import AudioCache
+from workers import TTSWorker
+
+PHRASES = ["Sure.", "Hmm, let me think.", "Could you say that again?", "That sounds great!"]
+
+
+def synthesize(tts, outputs, phrase):
+    outputs.clear()
+    tts.synthesize(Segment(phrase, True))
+    return np.concatenate([audio for audio in outputs if audio is not None])
+
+
+def run_mode(resources, cache_dir, args):
+    outputs = []
+    model_args = {"device": args.device, "lang_code": "a", "repo_id": "hexgrad/Kokoro-82M"}
+    cache = AudioCache(cache_dir=cache_dir)
+    tts = KoKoRoTTS(
+        buffer_in=queue.Queue(),
+        sample_rate=24000,
+        callback=lambda audio, *_: outputs.append(audio),
+        model_args=model_args,
+        cache=cache,
+        resources=resources,
+    )
+    start = time.perf_counter()
+    tts.prewarm(PHRASES)
+    cold = time.perf_counter() - start
+    expected = {}
+    for phrase in PHRASES:
+        chunks = cache.get(cache.key(phrase, tts.voice, tts.sample_rate, tts.model_name))
+        expected[phrase] = np.concatenate([audio for _, _, audio in chunks])
+    cache.stats["hits"] = 0
+
+    start = time.perf_counter()
+    for phrase in PHRASES:
+        if not np.array_equal(synthesize(tts, outputs, phrase), expected[phrase]):
+            raise AssertionError(f"Cached audio of {phrase!r} differs from the prewarm")
+    cached = time.perf_counter() - start
+    if cache.stats["hits"] != len(PHRASES):
+        raise AssertionError(f"{cache.stats['hits']} cache hits for {len(PHRASES)} phrases")
+
+    # A restart : the entries are read back from the disk
+    disk_cache = AudioCache(cache_dir=cache_dir)
+    for phrase in PHRASES:
+        chunks = disk_cache.get(disk_cache.key(phrase, tts.voice, tts.sample_rate, tts.model_name))
+        if chunks is None or not np.array_equal(
+            np.concatenate([audio for _, _, audio in chunks]), expected[phrase]
+        ):
+            raise AssertionError(f"Disk entry of {phrase!r} missing or different")
+    return cold, cached, cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--modes", type=str, nargs="+", default=["in-process", "worker"])
+    args = parser.parse_args()
+
+    model_args = {"device": args.device, "lang_code": "a", "repo_id": "hexgrad/Kokoro-82M"}
+    for mode in args.modes:
+        resources = KokoroResources(model_args) if mode == "in-process" else TTSWorker(model_args)
+        try:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                cold, cached, cache = run_mode(resources, cache_dir, args)
+        finally:
+            if mode == "worker":
+                resources.stop()
+        print(
+            f"{mode} : {len(PHRASES)} phrases, prewarm {cold:.3f} (s), cached {cached:.3f} (s), Entries : {len(cache.entries)}, Size : {cache.nb_bytes / 1024:.1f} KB"
+        )
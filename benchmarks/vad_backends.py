@@ -0,0 +1,96 @@
+"""CPU cost of the VAD backends per second of audio.
+
+Run from the repository root :
+    python -m benchmarks.vad_backends                # Synthetic audio
+    python -m benchmarks.vad_backends speech.wav     # Recorded audio
+
+Each backend classifies the same 20ms frames, one frame per call (what the VAD module
+does with the microphone) and in batches of `--batch` frames. `--streams` independent
+streams are also classified together in one call per time step, as a server would.
+The CPU time (time.process_time) is divided by the duration of audio classified, and
+the decisions are compared with plain webrtcvad.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.common import load_wav, split_frames
+from vad_backends import EnergyBackend, PrefilterBackend, WebRTCBackend
+
+BACKENDS = {
+    "webrtc": lambda: WebRTCBackend(mode=3),
+    "webrtc+prefilter": lambda: PrefilterBackend(WebRTCBackend(mode=3)),
+    "energy": lambda: EnergyBackend(),
+    "energy+prefilter": lambda: PrefilterBackend(EnergyBackend()),
+}
+
+
+def synthetic_audio(duration, sample_rate=16000, speech_ratio=0.3, seed=0):
+    """Low noise with voiced bursts (harmonics of a moving pitch) covering `speech_ratio`"""
+    rng = np.random.default_rng(seed)
+    audio = rng.normal(0, 30, int(duration * sample_rate))
+    t = np.arange(len(audio)) / sample_rate
+    position = 0.0
+    while position < duration:
+        length = rng.uniform(0.3, 1.5)
+        if rng.random() < speech_ratio:
+            start, end = int(position * sample_rate), int(min(position + length, duration) * sample_rate)
+            pitch = 120 + 30 * np.sin(2 * np.pi * 0.7 * t[start:end])
+            phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+            audio[start:end] += 3000 * sum(np.sin(k * phase) / k for k in range(1, 6))
+        position += length
+    return np.clip(audio, -32768, 32767).astype(np.int16)
+
+
+def cpu_time(function):
+    start = time.process_time()
+    result = function()
+    return time.process_time() - start, result
+
+
+def per_frame(backend, frames):
+    return np.array([backend.is_speech(frame.tobytes()) for frame in frames])
+
+
+def batched(backend, frames, batch):
+    return np.concatenate(
+        [backend.is_speech_batch(frames[i : i + batch]) for i in range(0, len(frames), batch)]
+    )
+
+
+def multi_stream(backend, frames, nb_streams):
+    """Same audio on every stream, one call per time step for all the streams"""
+    streams = np.arange(nb_streams)
+    result = []
+    for frame in frames:
+        result.append(backend.is_speech_batch(np.repeat(frame[None, :], nb_streams, axis=0), streams))
+    return np.array(result)[:, 0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("wav", nargs="?", help="16 bits WAV file, synthetic audio if omitted")
+    parser.add_argument("--duration", type=float, default=60.0, help="Synthetic audio duration (s)")
+    parser.add_argument("--batch", type=int, default=50)
+    parser.add_argument("--streams", type=int, default=8)
+    args = parser.parse_args()
+
+    audio = load_wav(args.wav) if args.wav else synthetic_audio(args.duration)
+    frames = split_frames(audio)
+    duration = len(frames) * 0.02
+    reference = per_frame(WebRTCBackend(mode=3), frames)
+
+    print(f"{duration:.1f}(s) of audio, {reference.mean():.2f} of the frames are speech for webrtcvad")
+    print(f"{'backend':<18} {'per frame':>10} {'batch':>10} {f'{args.streams} streams':>11} {'agreement':>10} {'skipped':>8}")
+    for name, factory in BACKENDS.items():
+        single_time, decisions = cpu_time(lambda: per_frame(factory(), frames))
+        backend = factory()
+        batch_time, _ = cpu_time(lambda: batched(backend, frames, args.batch))
+        streams_time, _ = cpu_time(lambda: multi_stream(factory(), frames, args.streams))
+        skipped = backend.nb_skipped / backend.nb_frames if isinstance(backend, PrefilterBackend) else 0.0
+        # CPU milliseconds per second of audio (per stream for the multi-stream case)
+        print(
+            f"{name:<18} {1e3 * single_time / duration:>8.3f}ms {1e3 * batch_time / duration:>8.3f}ms {1e3 * streams_time / duration / args.streams:>9.3f}ms {np.mean(decisions == reference):>10.3f} {skipped:>8.2f}"
+        )
@@ -0,0 +1,143 @@
+"""Jitter of the 20ms VAD loop while the ASR and TTS run, in-process vs worker processes.
+
+Run from the repository root :
+    python -m benchmarks.worker_jitter --duration 30 --device cpu
+
+A thread plays the microphone : every 20ms it wakes up and runs VAD.process_update
+on the next frame (synthetic speech bursts), as the retico microphone and VAD threads
+do. Meanwhile two threads keep the models busy, one transcribing a turn of
+`--turn_length` seconds with Whisper (features computed in the thread, like the ASR
+module), the other synthesizing a sentence with Kokoro. Modes :
+    - idle : no inference, the baseline
+    - in-process : WhisperResources and KokoroResources in the threads (GIL shared)
+    - workers : ASRWorker and TTSWorker (workers.py), the threads wait on the workers
+For each mode the report gives the lateness of the frames (wake-up time - schedule),
+the VAD processing time (p50, p99, max, in ms), the frames more than 20ms late and
+the number of transcriptions and syntheses done.
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+import retico_core
+import torch
+
+from asr import IncrementalLogMel, WhisperResources
+from benchmarks.common import audio_message, load_wav, percentile
+from benchmarks.vad_backends import synthetic_audio
+from tts import KokoroResources
+from vad import VAD
+from workers import ASRWorker, TTSWorker
+
+SENTENCE = "Sure, I can help with that. Let me think about the best way to explain it in a few words."
+
+
+def transcribe(resources, audio):
+    buffer = IncrementalLogMel(resources.processor.feature_extractor)
+    buffer.append(audio.tobytes())
+    features = buffer.finalize()
+    if isinstance(resources, ASRWorker):
+        return resources.transcribe(features)
+    input_features = torch.from_numpy(features)[None].to(resources.device, dtype=resources.torch_dtype)
+    with resources.lock, torch.inference_mode():
+        ids = resources.model.generate(input_features, **resources.generate_kwargs)
+    return resources.processor.batch_decode(ids, skip_special_tokens=True)[0]
+
+
+def synthesize(resources, voice):
+    generator = resources.pipeline(SENTENCE, voice=voice)
+    while True:
+        with resources.lock:
+            item = next(generator, None)
+        if item is None:
+            return
+
+
+def load_loop(stop, counts, name, function):
+    while not stop.is_set():
+        function()
+        counts[name] += 1
+
+
+def run_mode(mode, whisper, kokoro, frames, turn_audio, args):
+    vad = VAD(mode=3, sample_rate=16000, frame_length=0.02, backend=args.vad_backend)
+    vad.setup()
+    stop = threading.Event()
+    counts = {"transcriptions": 0, "syntheses": 0}
+    threads = []
+    if whisper is not None:
+        threads.append(threading.Thread(target=load_loop, args=(stop, counts, "transcriptions", lambda: transcribe(whisper, turn_audio))))
+        threads.append(threading.Thread(target=load_loop, args=(stop, counts, "syntheses", lambda: synthesize(kokoro, args.voice))))
+    for thread in threads:
+        thread.start()
+    time.sleep(1.0)  # Let the inference start
+
+    lateness, processing = [], []
+    next_time = time.perf_counter()
+    for frame in frames:
+        next_time += 0.02
+        delay = next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        wake = time.perf_counter()
+        lateness.append(wake - next_time)
+        vad.process_update(audio_message(frame, retico_core.UpdateType.ADD))
+        processing.append(time.perf_counter() - wake)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    def stats(values):
+        return [1000 * v for v in (percentile(values, 50), percentile(values, 99), max(values))]
+
+    return {
+        "mode": mode,
+        "lateness_ms": stats(lateness),
+        "vad_ms": stats(processing),
+        "late_frames": sum(1 for v in lateness if v > 0.02),
+        **counts,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=30.0, help="Audio played per mode (s)")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--asr_model_id", type=str, default="openai/whisper-small.en")
+    parser.add_argument("--voice", type=str, default="am_fenrir")
+    parser.add_argument("--turn", type=str, default=None, help="WAV file transcribed in a loop")
+    parser.add_argument("--turn_length", type=float, default=5.0)
+    parser.add_argument("--vad_backend", type=str, default="webrtc", choices=["webrtc", "energy"])
+    parser.add_argument("--modes", type=str, nargs="+", default=["idle", "in-process", "workers"])
+    args = parser.parse_args()
+
+    audio = synthetic_audio(args.duration)
+    frames = audio[: len(audio) // 320 * 320].reshape(-1, 320)
+    turn_audio = load_wav(args.turn) if args.turn else synthetic_audio(args.turn_length, speech_ratio=1.0)
+    tts_args = {"device": args.device, "lang_code": "a", "repo_id": "hexgrad/Kokoro-82M"}
+
+    results = []
+    for mode in args.modes:
+        whisper = kokoro = None
+        if mode == "in-process":
+            whisper = WhisperResources(args.asr_model_id, args.device)
+            kokoro = KokoroResources(tts_args)
+        elif mode == "workers":
+            whisper = ASRWorker(args.asr_model_id, args.device)
+            kokoro = TTSWorker(tts_args)
+        if whisper is not None:  # Not measured : first decoding and synthesis
+            transcribe(whisper, turn_audio)
+            synthesize(kokoro, args.voice)
+        results.append(run_mode(mode, whisper, kokoro, frames, turn_audio, args))
+        if mode == "workers":
+            whisper.stop()
+            kokoro.stop()
+
+    print(f"{'mode':<11} {'late p50':>9} {'p99':>7} {'max':>7} {'vad p50':>8} {'p99':>7} {'max':>7} {'>20ms':>6} {'asr':>4} {'tts':>4}")
+    for r in results:
+        late, vad = r["lateness_ms"], r["vad_ms"]
+        print(
+            f"{r['mode']:<11} {late[0]:>9.2f} {late[1]:>7.2f} {late[2]:>7.2f} {vad[0]:>8.3f} {vad[1]:>7.3f} {vad[2]:>7.3f} {r['late_frames']:>6} {r['transcriptions']:>4} {r['syntheses']:>4}"
+        )
@@ -0,0 +1,148 @@
+import logging
+import threading
+import time
+
+from console_colors import ConsoleColors
+
+SUMMARY_PREFIX = "Summary of the earlier conversation : "
+
+
+class DialogueMemory:
+    """Token budget of the dialogue history sent to the LLM.
+
+    The token count of each message is computed once and cached. When the history
+    goes over `fold_ratio` of the budget at the end of a turn, the oldest turns are
+    folded into a rolling summary, generated on a background thread so the next turn
+    never waits for it : the summary request runs between the turns, and the folded
+    turns are replaced by the summary (appended to the system prompt) once it is
+    ready. The system prompt and the last `keep_recent` messages are always kept
+    verbatim. Until the summary is ready, `window` drops the oldest turns that do not
+    fit, so a prompt never exceeds the budget.
+
+    `count_tokens(message)` returns the number of tokens of a message (with its chat
+    template overhead), `summarize(summary, messages)` returns the previous summary
+    extended with `messages`.
+    """
+
+    def __init__(
+        self,
+        count_tokens,
+        summarize,
+        max_tokens=3072,
+        keep_recent=6,
+        fold_ratio=0.75,
+        target_ratio=0.5,
+    ):
+        self.count_tokens = count_tokens
+        self.summarize = summarize
+        self.max_tokens = max_tokens  # Prompt budget, the reply needs room too
+        self.keep_recent = keep_recent  # Messages never folded
+        self.fold_ratio = fold_ratio  # Fold once the history reaches this part of the budget
+        self.target_ratio = target_ratio  # Size of the history after a fold
+        self.counts = {}  # (role, content) : number of tokens
+        self.system_prompt = None  # System prompt without the summary
+        self.summary = ""
+        self.folding = None
+        self.stats = {
+            "folds": 0,
+            "folded_messages": 0,
+            "summary_time": 0.0,
+            "truncated_prompts": 0,
+            "failures": 0,
+        }
+
+    def count(self, message):
+        key = (message["role"], message["content"])
+        count = self.counts.get(key)
+        if count is None:
+            count = self.count_tokens(message)
+            self.counts[key] = count
+        return count
+
+    def total(self, messages):
+        return sum(self.count(message) for message in messages)
+
+    def window(self, messages):
+        """Messages of the prompt : the system prompt and the most recent messages
+        that fit in the budget, all of them unless the summary fell behind"""
+        start = 1 if messages and messages[0]["role"] == "system" else 0
+        budget = self.max_tokens - self.total(messages[:start])
+        first = len(messages)
+        while first > start and (
+            first == len(messages) or self.count(messages[first - 1]) <= budget
+        ):
+            budget -= self.count(messages[first - 1])
+            first -= 1
+        if first == start:
+            return list(messages)
+        # Chat templates expect the turns to start with the user
+        while first < len(messages) - 1 and messages[first]["role"] != "user":
+            first += 1
+        self.stats["truncated_prompts"] += 1
+        logging.warning(
+            f"{ConsoleColors.YELLOW}DialogueMemory:{ConsoleColors.RESET} History over the budget of {self.max_tokens} tokens, {first - start} messages dropped from the prompt"
+        )
+        return messages[:start] + messages[first:]
+
+    def fold_range(self, messages):
+        """End of the messages to fold, None if the history fits"""
+        total = self.total(messages)
+        if total < self.fold_ratio * self.max_tokens:
+            return None
+        start = 1 if messages and messages[0]["role"] == "system" else 0
+        end = start
+        last = len(messages) - self.keep_recent
+        while end < last and total > self.target_ratio * self.max_tokens:
+            total -= self.count(messages[end])
+            end += 1
+        # The recent messages start with a user turn
+        while end < last and messages[end]["role"] != "user":
+            end += 1
+        return end if end > start else None
+
+    def maybe_fold(self, messages, apply):
+        """Start summarizing the oldest turns in the background if the history is
+        close to the budget. `apply(folded, messages)` replaces the `folded` messages
+        at the start of the history by `messages` and returns True, or returns False
+        if they changed. It is called from the background thread"""
+        if self.folding is not None and self.folding.is_alive():
+            return
+        end = self.fold_range(messages)
+        if end is None:
+            return
+        self.folding = threading.Thread(
+            target=self.fold, args=([dict(m) for m in messages[:end]], apply), daemon=True
+        )
+        self.folding.start()
+
+    def fold(self, folded, apply):
+        start = 1 if folded[0]["role"] == "system" else 0
+        if self.system_prompt is None:
+            self.system_prompt = folded[0]["content"] if start else ""
+        start_time = time.time()
+        try:
+            summary = self.summarize(self.summary, folded[start:])
+        except Exception as e:
+            self.stats["failures"] += 1
+            logging.warning(
+                f"{ConsoleColors.YELLOW}DialogueMemory:{ConsoleColors.RESET} Summarization failed : {e}"
+            )
+            return
+        summary_time = time.time() - start_time
+        content = f"{self.system_prompt}\n\n{SUMMARY_PREFIX}{summary}".strip()
+        if not apply(folded, [{"role": "system", "content": content}]):
+            return  # The history changed meanwhile, folded again next turn
+        self.summary = summary
+        for message in folded:
+            self.counts.pop((message["role"], message["content"]), None)
+        self.stats["folds"] += 1
+        self.stats["folded_messages"] += len(folded) - start
+        self.stats["summary_time"] += summary_time
+        logging.info(
+            f"{ConsoleColors.BLUE}DialogueMemory:{ConsoleColors.RESET} {len(folded) - start} messages folded into the summary in {summary_time:.2f} (s), Folds : {self.stats['folds']}, Summary tokens : {self.count({'role': 'system', 'content': content})}"
+        )
+
+    def wait(self, timeout=None):
+        """Wait for the summary in progress"""
+        if self.folding is not None:
+            self.folding.join(timeout)
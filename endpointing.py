@@ -0,0 +1,147 @@
+import re
+import threading
+import logging
+from collections import deque
+
+import numpy as np
+
+from console_colors import ConsoleColors
+
+
+class EndOfTurnPredictor:
+    """Adaptive end of turn detection for the VAD.
+
+    Instead of one fixed silence length, the silence required to commit a turn depends
+    on how likely the user is done speaking. The probability is computed from
+        - the prosody of the last speech frames : the energy falls and the pitch moves
+          (falls on statements, rises on questions) at the end of a turn, it stays flat
+          on filled pauses and mid-sentence hesitations
+        - the latest partial transcript, if the ASR provides one : final punctuation and
+          question forms mark an end, a trailing conjunction or filler a hesitation
+    A neutral prediction keeps `max_silence`, confident ends commit after `min_silence`
+    and hesitations wait up to `hesitation_silence`.
+    """
+
+    HESITATIONS = {
+        "um", "uh", "erm", "hmm", "uhm", "er", "ah",
+        "and", "but", "or", "so", "because", "if", "then", "that", "which",
+        "the", "a", "an", "to", "of", "with", "for", "in", "on", "at",
+        "my", "your", "i", "i'm", "we", "like", "is", "was", "are",
+    }
+    QUESTION_STARTS = {
+        "what", "why", "how", "when", "where", "who", "which", "whose",
+        "do", "does", "did", "is", "are", "was", "were", "can", "could",
+        "would", "will", "should", "shall", "have", "has", "may",
+    }
+
+    def __init__(
+        self,
+        sample_rate=16000,
+        min_silence=0.25,
+        max_silence=0.7,
+        hesitation_silence=1.2,
+        window=0.4,
+        frame_length=0.02,
+    ):
+        self.sample_rate = sample_rate
+        self.min_silence = min_silence
+        self.max_silence = max_silence
+        self.hesitation_silence = hesitation_silence
+        self.nb_window_frames = max(int(window / frame_length), 3)  # Frames of the turn end
+        self.fft_size = 1024
+        # Pitch search range : 60-400Hz
+        self.min_lag = sample_rate // 400
+        self.max_lag = sample_rate // 60
+        self.lock = threading.Lock()  # The transcript is updated from the ASR thread
+        # Turns ended (reset calls), follows the turn_id of the ASR : a transcript of a
+        # turn that already ended is ignored
+        self.turn = -1
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.turn += 1
+            self.energies = []  # dB of every speech frame of the turn
+            self.pitches = deque(maxlen=self.nb_window_frames)  # (frame index, semitones)
+            self.nb_frames = 0
+            self.transcript = ""
+
+    def update_audio(self, raw_audio):
+        """Add a speech frame (16 bits PCM) of the current turn"""
+        frame = np.frombuffer(raw_audio, dtype=np.int16).astype(np.float32) / 32768.0
+        energy = 10 * np.log10(np.mean(frame**2) + 1e-10)
+        pitch = self.pitch(frame)
+        with self.lock:
+            self.energies.append(energy)
+            if pitch is not None:
+                self.pitches.append((self.nb_frames, 12 * np.log2(pitch / 100.0)))
+            self.nb_frames += 1
+
+    def update_transcript(self, text, turn=None):
+        """Latest (partial) transcription of the turn `turn` (the current one if None),
+        ignored if that turn already ended"""
+        with self.lock:
+            if turn is not None and turn != self.turn:
+                return
+            self.transcript = text.strip()
+
+    def pitch(self, frame):
+        """F0 (Hz) of a voiced frame from its autocorrelation, None if unvoiced"""
+        if len(frame) <= self.max_lag:
+            return None
+        frame = frame - frame.mean()
+        spectrum = np.fft.rfft(frame, self.fft_size)
+        autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum))[: self.max_lag + 1]
+        if autocorrelation[0] <= 0:
+            return None
+        # Unbiased : each lag is averaged over the samples that overlap
+        autocorrelation = autocorrelation / (len(frame) - np.arange(self.max_lag + 1))
+        candidates = autocorrelation[self.min_lag :]
+        # Shortest lag close to the maximum, the multiples of the period peak as well
+        lag = self.min_lag + int(np.argmax(candidates >= 0.9 * candidates.max()))
+        if autocorrelation[lag] / autocorrelation[0] < 0.5:  # Not periodic enough
+            return None
+        return self.sample_rate / lag
+
+    def probability(self):
+        """Probability that the user finished the turn"""
+        with self.lock:
+            energies = self.energies[-self.nb_window_frames :]
+            turn_energy = np.median(self.energies) if self.energies else 0.0
+            pitches = list(self.pitches)
+            transcript = self.transcript
+        logit = 0.0
+        if len(energies) >= 3:
+            # Energy of the last frames below the turn level (dB)
+            energy_drop = turn_energy - np.mean(energies[-3:])
+            logit += 0.8 * np.clip(energy_drop / 6.0, -1.0, 1.0)
+        if len(pitches) >= 4:
+            # Pitch movement at the end of the turn (semitones/frame), either direction
+            index, semitones = zip(*pitches)
+            slope = np.polyfit(index, semitones, 1)[0]
+            logit += 1.0 * np.clip(abs(slope) / 0.3, 0.0, 1.0) - 0.4
+        if transcript:
+            words = re.findall(r"[\w']+", transcript.lower())
+            if transcript[-1] in ".?!":
+                logit += 1.5
+            elif transcript[-1] in ",;:-":
+                logit -= 1.0
+            if words and words[-1] in self.HESITATIONS:
+                logit -= 2.0
+            elif len(words) >= 3 and words[0] in self.QUESTION_STARTS:
+                logit += 0.5
+        return 1.0 / (1.0 + np.exp(-logit))
+
+    def required_silence(self):
+        """Silence length (s) after which the turn is committed"""
+        p = self.probability()
+        if p >= 0.5:
+            confidence = min((p - 0.5) / 0.4, 1.0)
+            return self.max_silence - confidence * (self.max_silence - self.min_silence)
+        hesitation = min((0.5 - p) / 0.4, 1.0)
+        return self.max_silence + hesitation * (self.hesitation_silence - self.max_silence)
+
+    def log_prediction(self, silence_length):
+        logging.debug(
+            f"{ConsoleColors.MAGENTA}EndOfTurnPredictor:{ConsoleColors.RESET} End of turn probability = {self.probability():.2f}, silence = {silence_length:.2f}(s), transcript = {self.transcript!r}"
+        )
@@ -0,0 +1,47 @@
+import threading
+import logging
+
+from console_colors import ConsoleColors
+
+
+class Interruption:
+    """Barge-in signal shared by the modules of the pipeline.
+
+    The VAD triggers it when the user starts speaking, the modules generating or
+    playing the agent reply subscribe to it to abort their work. Every trigger starts
+    a new epoch : the replies are stamped with the epoch they started in, so the
+    output of an interrupted reply can be recognized and dropped wherever it is.
+    The TTS reports the part of the reply that was actually spoken so the NLG can
+    trim its dialogue history.
+    """
+
+    def __init__(self):
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self._handlers = []
+        self._spoken_handlers = []
+
+    def subscribe(self, handler):
+        """`handler(epoch)` is called when the user interrupts the agent"""
+        self._handlers.append(handler)
+
+    def subscribe_spoken(self, handler):
+        """`handler(text)` is called with the part of the interrupted reply that was played"""
+        self._spoken_handlers.append(handler)
+
+    def trigger(self):
+        with self.lock:
+            self.epoch += 1
+            epoch = self.epoch
+        logging.debug(
+            f"{ConsoleColors.MAGENTA}Interruption:{ConsoleColors.RESET} Speech onset, starting epoch {epoch}"
+        )
+        for handler in self._handlers:
+            handler(epoch)
+
+    def report_spoken(self, text):
+        logging.info(
+            f"{ConsoleColors.BLUE}Interruption:{ConsoleColors.RESET} Agent interrupted, spoken part : {text!r}"
+        )
+        for handler in self._spoken_handlers:
+            handler(text)
@@ -1,12 +1,21 @@
 import time
 import retico_core
-from retico_core.audio import MicrophoneModule, SpeakerModule
-import torch
+from retico_core.audio import MicrophoneModule
 from vad import VAD
-from asr import ASR
-from nlg import OpenAINLG
-from tts import TTS
+from audio_ring import AudioRing
+from asr import ASR, WhisperResources
+from nlg import OpenAINLG, OpenAIResources
+from tts import TTS, KokoroResources
 from a2f import A2FStream
+from interruption import Interruption
+from metrics import LatencyTracer
+from retention import IURetention
+from trace_recorder import TraceRecorder
+from tts_cache import AudioCache
+from endpointing import EndOfTurnPredictor
+from speaker import InterruptibleSpeakerModule
+from startup import Startup, signal_ready
+from workers import ASRWorker, TTSWorker
 import argparse
 
 
@@ -17,9 +26,6 @@ logging.basicConfig(level=logging.INFO)
 # If set to True, TTS will stream its output to the A2F instead of the speaker
 
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-
-
 if __name__ == "__main__":
 
     logging.info("[MAIN] Starting Retico System")
@@ -34,6 +40,198 @@ if __name__ == "__main__":
     parser.add_argument("--a2f_api_url", type=str, default="http://localhost:8011")
     parser.add_argument("--a2f_grpc_url", type=str, default="localhost:50051")
     parser.add_argument("--use_a2f", action="store_true", help="Enable A2F usage")
+    parser.add_argument(
+        "--a2f_player",
+        type=str,
+        default=None,
+        help="Streaming player of the A2F scene, listed by the A2F REST API by default",
+    )
+    parser.add_argument(
+        "--a2f_queue_policy",
+        type=str,
+        default="block",
+        choices=["block", "drop"],
+        help="When A2F falls behind, wait for it (block) or drop the oldest audio (drop)",
+    )
+    parser.add_argument(
+        "--nlg_stream",
+        action="store_true",
+        help="Stream the NLG output to TTS sentence by sentence",
+    )
+    parser.add_argument(
+        "--nlg_string_prompt",
+        action="store_true",
+        help="Render the full prompt as a string every turn instead of sending cached token ids",
+    )
+    parser.add_argument(
+        "--nlg_memory_tokens",
+        type=int,
+        default=None,
+        help="Token budget of the prompt, older turns are folded into a summary (unbounded history by default)",
+    )
+    parser.add_argument(
+        "--nlg_memory_recent",
+        type=int,
+        default=6,
+        help="Last messages always kept verbatim in the prompt",
+    )
+    parser.add_argument(
+        "--asr_streaming",
+        action="store_true",
+        help="Transcribe the user turn in the background while the user is speaking",
+    )
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Start the NLG reply from a speculative transcription during the end of turn silence",
+    )
+    parser.add_argument(
+        "--vad_backend",
+        type=str,
+        default="webrtc",
+        choices=["webrtc", "energy"],
+        help="Speech / silence classifier of the VAD",
+    )
+    parser.add_argument(
+        "--vad_prefilter",
+        action="store_true",
+        help="Skip the VAD classifier on clearly silent frames (energy below -50 dBFS)",
+    )
+    parser.add_argument(
+        "--no_audio_ring",
+        action="store_true",
+        help="Forward the microphone audio as bytes instead of ranges of a shared ring buffer",
+    )
+    parser.add_argument(
+        "--audio_ring_file",
+        type=str,
+        default=None,
+        help="Memory-map the audio ring buffer to this file",
+    )
+    parser.add_argument(
+        "--no_iu_retention",
+        action="store_true",
+        help="Keep the consumed audio IUs linked with their audio, as retico does",
+    )
+    parser.add_argument(
+        "--adaptive_endpointing",
+        action="store_true",
+        help="Adapt the end of turn silence to the prosody and the partial transcript",
+    )
+    parser.add_argument(
+        "--barge_in",
+        action="store_true",
+        help="Interrupt the agent when the user starts speaking",
+    )
+    parser.add_argument(
+        "--tts_delivery",
+        type=str,
+        default="immediate",
+        choices=["lookahead", "immediate"],
+        help="Send TTS chunks as soon as they are generated (immediate) or hold the last one to flag it as final (lookahead)",
+    )
+    parser.add_argument(
+        "--tts_pipelined",
+        action="store_true",
+        help="Synthesize the next TTS chunk while the current one is delivered",
+    )
+    parser.add_argument(
+        "--tts_frame_length",
+        type=float,
+        default=0.02,
+        help="Duration of the TTS output frames (s)",
+    )
+    parser.add_argument(
+        "--tts_jitter_prefill",
+        type=float,
+        default=0.1,
+        help="TTS audio buffered before a reply starts playing (s)",
+    )
+    parser.add_argument(
+        "--tts_cache_mb",
+        type=float,
+        default=64,
+        help="Memory budget of the TTS audio cache in MB, 0 to disable it",
+    )
+    parser.add_argument(
+        "--tts_cache_dir",
+        type=str,
+        default=None,
+        help="Directory where the TTS audio cache is persisted",
+    )
+    parser.add_argument(
+        "--tts_prewarm",
+        type=str,
+        default="./assets/tts_phrases.txt",
+        help="Phrases (one per line) synthesized into the TTS cache at startup",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=None,
+        help="Expose the per turn latency metrics on this port for Prometheus",
+    )
+    parser.add_argument(
+        "--trace_file",
+        type=str,
+        default=None,
+        help="Record a hot-path trace, written as Chrome trace JSON to this file on SIGUSR1 and at exit",
+    )
+    parser.add_argument(
+        "--trace_capacity",
+        type=int,
+        default=2**16,
+        help="Records kept by the hot-path trace (oldest overwritten)",
+    )
+    parser.add_argument(
+        "--asr_model_id",
+        type=str,
+        default="openai/whisper-large-v3-turbo",
+        help="Whisper checkpoint, e.g. openai/whisper-base.en or distil-whisper/distil-small.en on CPU",
+    )
+    parser.add_argument(
+        "--asr_quantize",
+        action="store_true",
+        help="int8 dynamic quantization of the Whisper linear layers (CPU)",
+    )
+    parser.add_argument(
+        "--asr_compile",
+        action="store_true",
+        help="torch.compile the Whisper encoder",
+    )
+    parser.add_argument(
+        "--asr_assistant_model_id",
+        type=str,
+        default=None,
+        help="Small Whisper drafting the tokens of the ASR model (assisted generation), e.g. distil-whisper/distil-large-v3",
+    )
+    parser.add_argument(
+        "--asr_threads",
+        type=int,
+        default=None,
+        help="Number of torch threads",
+    )
+    parser.add_argument(
+        "--asr_worker",
+        action="store_true",
+        help="Run Whisper in a dedicated process (audio and features through shared memory)",
+    )
+    parser.add_argument(
+        "--tts_worker",
+        action="store_true",
+        help="Run Kokoro in a dedicated process (audio through shared memory)",
+    )
+    parser.add_argument(
+        "--no_warmup",
+        action="store_true",
+        help="Skip the ASR and TTS warm-up pass at startup",
+    )
+    parser.add_argument(
+        "--ready_file",
+        type=str,
+        default=None,
+        help="File created once the pipeline is running (readiness probe)",
+    )
 
     args = parser.parse_args()
 
@@ -45,18 +243,143 @@ if __name__ == "__main__":
         rate=sample_rate,
     )
 
+    # Barge-in signal shared by VAD, NLG, TTS, the speaker and A2F
+    interruption = Interruption() if args.barge_in else None
+
+    # Per turn latency tracing shared by all the modules
+    tracer = LatencyTracer()
+    # The audio IUs are released by their last consumer, with the memory watermark
+    retention = None
+    if not args.no_iu_retention:
+        retention = IURetention()
+        retention.register(tracer.registry)
+    if args.metrics_port is not None:
+        tracer.serve(args.metrics_port)
+
+    # Hot-path trace of the modules, dumped with `kill -USR1 <pid>`
+    recorder = None
+    if args.trace_file:
+        recorder = TraceRecorder(capacity=args.trace_capacity)
+        recorder.dump_on_signal(args.trace_file)
+
+    # ? Startup : the models are loaded concurrently, then warmed up with a synthetic
+    # pass so the first turn does not pay for the lazy initializations. The loaders
+    # import torch and choose the device (cuda if available)
+    asr_model_id = args.asr_model_id
+    tts_model_args = {
+        "lang_code": "a",
+        "repo_id": "hexgrad/Kokoro-82M",
+    }
+
+    def load_tts_cache():
+        if args.tts_cache_mb <= 0:
+            return None
+        return AudioCache(
+            max_bytes=int(args.tts_cache_mb * 2**20), cache_dir=args.tts_cache_dir
+        )
+
+    def load_a2f():
+        try:
+            # Audio2Face Streamer
+            a2f = A2FStream(
+                scene_path="./assets/mark_solved_streaming.usd",
+                api_url=args.a2f_api_url,
+                grpc_url=args.a2f_grpc_url,
+                fps=30,
+                chunck_size=4000,
+                use_keyframes=True,
+                use_global_emotion=False,
+                global_emotion={"joy": 0.9, "sadness": 0.1},
+                tracer=tracer,
+                retention=retention,
+                queue_policy=args.a2f_queue_policy,
+                interruption=interruption,
+                instance_name=args.a2f_player,
+            )
+            a2f.setup()
+            logging.info("[MAIN] A2F initialized")
+            return a2f
+        except Exception:
+            logging.error(
+                "[MAIN] Unable to initialize Audio2Face, falling back to SpeakerModule"
+            )
+            return None
+
+    # With --asr_worker / --tts_worker the models are loaded and run in worker
+    # processes (workers.py), the modules use them through the same interface
+    whisper_options = {
+        "quantize": args.asr_quantize,
+        "compile": args.asr_compile,
+        "num_threads": args.asr_threads,
+        "assistant_model_id": args.asr_assistant_model_id,
+    }
+    startup = Startup()
+    if args.asr_worker:
+        startup.add("whisper", lambda: ASRWorker(asr_model_id, **whisper_options))
+    else:
+        startup.add(
+            "whisper", lambda: WhisperResources(asr_model_id, **whisper_options)
+        )
+    if args.tts_worker:
+        startup.add("kokoro", lambda: TTSWorker(tts_model_args))
+    else:
+        startup.add("kokoro", lambda: KokoroResources(tts_model_args))
+    startup.add(
+        "openai",
+        lambda: OpenAIResources(args.nlg_api_key, args.nlg_api_base, args.nlg_model_id),
+    )
+    startup.add("tts_cache", load_tts_cache)
+    startup.add("a2f", load_a2f)
+    if not args.no_warmup:
+        startup.add(
+            "asr_warmup",
+            lambda whisper: whisper.warmup(word_timestamps=args.asr_streaming),
+            after=["whisper"],
+        )
+        startup.add("tts_warmup", lambda kokoro: kokoro.warmup(), after=["kokoro"])
+    loaded = startup.run()
+
     # ? VAD
+    endpointing = None
+    if args.adaptive_endpointing:
+        # The partial transcripts come from the ASR in streaming or speculative mode
+        endpointing = EndOfTurnPredictor(
+            sample_rate=sample_rate,
+            min_silence=0.250,
+            max_silence=0.700,
+            hesitation_silence=1.200,
+            frame_length=frame_length,
+        )
+    # Shared audio ring : the VAD writes each microphone frame once, the ASR reads it
+    # in place
+    ring = None
+    if not args.no_audio_ring:
+        ring = AudioRing(sample_rate=sample_rate, path=args.audio_ring_file)
     vad_module = VAD(
         mode=3,
         sample_rate=sample_rate,
         max_silence_length=0.700,
         frame_length=frame_length,
         min_turn_length=0.150,
+        interruption=interruption,
+        tracer=tracer,
+        endpointing=endpointing,
+        backend=args.vad_backend,
+        prefilter=args.vad_prefilter,
+        ring=ring,
+        retention=retention,
     )
     # ? ASR
     asr_module = ASR(
-        model_id="openai/whisper-large-v3-turbo",
-        device=device,
+        model_id=asr_model_id,
+        sample_rate=sample_rate,
+        streaming=args.asr_streaming,
+        speculative=args.speculative,
+        tracer=tracer,
+        endpointing=endpointing,
+        resources=loaded["whisper"],
+        engine=loaded["whisper"] if args.asr_worker else None,
+        retention=retention,
     )
 
     inference_args = {"max_tokens": 250, "stop": ["<|eot_id|>"]}
@@ -65,44 +388,63 @@ if __name__ == "__main__":
         api_base=args.nlg_api_base,
         model_id=args.nlg_model_id,
         inference_args=inference_args,
+        token_prompt=not args.nlg_string_prompt,
+        stream=args.nlg_stream,
+        memory_tokens=args.nlg_memory_tokens,
+        memory_recent=args.nlg_memory_recent,
+        interruption=interruption,
+        speculative=args.speculative,
+        tracer=tracer,
+        resources=loaded["openai"],
     )
 
     # A2F
-    try:
-        # Audio2Face Streamer
-        a2f_module = A2FStream(
-            scene_path="./assets/mark_solved_streaming.usd",
-            api_url=args.a2f_api_url,
-            grpc_url=args.a2f_grpc_url,
-            fps=30,
-            chunck_size=4000,
-            use_keyframes=True,
-            use_global_emotion=False,
-            global_emotion={"joy": 0.9, "sadness": 0.1},
-        )
-        a2f_module.setup()
-        logging.info("[MAIN] A2F initialized")
-    except Exception:
-        logging.error(
-            "[MAIN] Unable to initialize Audio2Face, falling back to SpeakerModule"
-        )
+    a2f_module = loaded["a2f"]
+    if a2f_module is None:
         args.use_a2f = False
 
     # TTS
     tts_sample_rate = 24000
-    tts_model_args = {
-        "device": device,
-        "lang_code": "a",
-        "repo_id": "hexgrad/Kokoro-82M",
-    }
+    tts_cache = loaded["tts_cache"]
+    prewarm_phrases = []
+    if tts_cache is not None and args.tts_prewarm:
+        with open(args.tts_prewarm) as f:
+            prewarm_phrases = [line.strip() for line in f if line.strip()]
     tts_module = TTS(
         sample_rate=tts_sample_rate,
         model_args=tts_model_args,
         output_audio_bytes=not args.use_a2f,
+        delivery=args.tts_delivery,
+        pipelined=args.tts_pipelined,
+        frame_length=args.tts_frame_length,
+        jitter_prefill=args.tts_jitter_prefill,
+        interruption=interruption,
+        tracer=tracer,
+        cache=tts_cache,
+        prewarm_phrases=prewarm_phrases,
+        resources=loaded["kokoro"],
+        recorder=recorder,
     )
 
-    # Speaker
-    speaker_module = SpeakerModule(rate=tts_sample_rate)
+    # Speaker, plays the audio in blocks that can be interrupted and marks the
+    # first sample of each reply for the latency tracing
+    speaker_module = InterruptibleSpeakerModule(
+        interruption=interruption,
+        tracer=tracer,
+        retention=retention,
+        rate=tts_sample_rate,
+    )
+
+    if recorder is not None:
+        recorder.instrument_module(vad_module, "VAD")
+        recorder.instrument_module(asr_module, "ASR")
+        recorder.instrument(asr_module, "transcribe_turn", "ASR")
+        recorder.instrument_module(nlg_module, "NLG")
+        recorder.instrument(nlg_module, "generate_response", "NLG")
+        recorder.instrument_module(tts_module, "TTS")
+        if a2f_module is not None:
+            recorder.instrument_module(a2f_module, "A2FStream")
+        recorder.instrument_module(speaker_module, "Speaker")
 
     microphone_module.subscribe(vad_module)
     vad_module.subscribe(asr_module)
@@ -118,20 +460,33 @@ if __name__ == "__main__":
         tts_module.subscribe(speaker_module)
 
     retico_core.network.run(microphone_module)
-try:
-    input()
-    microphone_module.stop()
-    vad_module.stop()
-    nlg_module.stop()
-    tts_module.stop()
-    asr_module.stop()
-    speaker_module.stop()
-    a2f_module.stop()
-except (KeyboardInterrupt, AttributeError) as e:
-    microphone_module.stop()
-    vad_module.stop()
-    nlg_module.stop()
-    tts_module.stop()
-    asr_module.stop()
-    speaker_module.stop()
-    a2f_module.stop()
+    logging.info("[MAIN] Pipeline running")
+    if args.ready_file:
+        signal_ready(args.ready_file)
+    try:
+        input()
+        microphone_module.stop()
+        vad_module.stop()
+        nlg_module.stop()
+        tts_module.stop()
+        asr_module.stop()
+        speaker_module.stop()
+        if a2f_module is not None:
+            a2f_module.stop()
+    except (KeyboardInterrupt, AttributeError) as e:
+        microphone_module.stop()
+        vad_module.stop()
+        nlg_module.stop()
+        tts_module.stop()
+        asr_module.stop()
+        speaker_module.stop()
+        if a2f_module is not None:
+            a2f_module.stop()
+    if retention is not None:
+        retention.log_stats()
+    if recorder is not None:
+        recorder.dump(args.trace_file)
+    # Worker processes (daemons, they would also exit with the main process)
+    for resources in (loaded["whisper"], loaded["kokoro"]):
+        if isinstance(resources, (ASRWorker, TTSWorker)):
+            resources.stop()
@@ -0,0 +1,143 @@
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict, deque
+
+import numpy as np
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import start_http_server
+
+from console_colors import ConsoleColors
+
+
+class LatencyTracer:
+    """End-to-end latency of the user turns.
+
+    The VAD starts a trace when it commits a turn, its id is carried by the
+    `trace_id` meta data of the IUs down to the output module. Each module marks the
+    time (time.monotonic) at which its stage of the turn is reached, only the first
+    mark of a stage counts. When the first audio sample is handed to the output the
+    durations between the stages are added to Prometheus histograms and to rolling
+    windows from which the p50/p95/p99 gauges are computed.
+
+    Stages, in order :
+        - speech_end : last speech frame of the turn
+        - vad_commit : end of turn detected by the VAD
+        - transcript : transcription of the turn ready
+        - first_token : first token of the reply received from the LLM
+        - first_tts_chunk : first audio chunk of the reply synthesized
+        - first_output : first audio sample handed to the speaker or A2F
+    """
+
+    STAGES = [
+        "speech_end",
+        "vad_commit",
+        "transcript",
+        "first_token",
+        "first_tts_chunk",
+        "first_output",
+    ]
+    # Reported intervals : name -> (from stage, to stage)
+    INTERVALS = {
+        "endpointing": ("speech_end", "vad_commit"),
+        "asr": ("vad_commit", "transcript"),
+        "nlg_first_token": ("transcript", "first_token"),
+        "tts_first_chunk": ("first_token", "first_tts_chunk"),
+        "output": ("first_tts_chunk", "first_output"),
+        "turn": ("speech_end", "first_output"),  # User stop to agent start
+    }
+    QUANTILES = [0.5, 0.95, 0.99]
+
+    def __init__(self, window=500, max_open_traces=64):
+        self.lock = threading.Lock()
+        self.traces = OrderedDict()  # trace_id -> {stage: timestamp}
+        self.max_open_traces = max_open_traces  # Turns that never reach the output
+        self.windows = {name: deque(maxlen=window) for name in self.INTERVALS}
+        self.completed = deque(maxlen=window)  # (trace_id, {interval: duration})
+
+        self.registry = CollectorRegistry()
+        self.histogram = Histogram(
+            "s2s_turn_latency_seconds",
+            "Latency of the stages of a user turn",
+            ["interval"],
+            buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0),
+            registry=self.registry,
+        )
+        self.dropped = Counter(
+            "s2s_turn_traces_dropped",
+            "Traces that never reached the output (interrupted or revoked turns)",
+            registry=self.registry,
+        )
+        quantile_gauge = Gauge(
+            "s2s_turn_latency_quantile_seconds",
+            "Rolling quantiles of the latency of the stages of a user turn",
+            ["interval", "quantile"],
+            registry=self.registry,
+        )
+        for name in self.INTERVALS:
+            for q in self.QUANTILES:
+                quantile_gauge.labels(name, str(q)).set_function(
+                    lambda name=name, q=q: self.quantile(name, q)
+                )
+
+    def serve(self, port):
+        """Expose the metrics at http://localhost:<port>/metrics"""
+        start_http_server(port, registry=self.registry)
+        logging.info(
+            f"{ConsoleColors.BLUE}LatencyTracer:{ConsoleColors.RESET} Metrics served on port {port}"
+        )
+
+    def start_trace(self, speech_end=None):
+        """Start the trace of a committed turn, returns its id"""
+        trace_id = uuid.uuid4().hex[:16]
+        now = time.monotonic()
+        with self.lock:
+            self.traces[trace_id] = {
+                "speech_end": speech_end if speech_end is not None else now,
+                "vad_commit": now,
+            }
+            while len(self.traces) > self.max_open_traces:
+                self.traces.popitem(last=False)
+                self.dropped.inc()
+        return trace_id
+
+    def mark(self, trace_id, stage, timestamp=None):
+        """The turn `trace_id` reached `stage`, ignored if the stage was already marked"""
+        if trace_id is None:
+            return
+        timestamp = timestamp if timestamp is not None else time.monotonic()
+        with self.lock:
+            trace = self.traces.get(trace_id)
+            if trace is None or stage in trace:
+                return
+            trace[stage] = timestamp
+            if stage != "first_output":
+                return
+            del self.traces[trace_id]
+            durations = {}
+            for name, (start, end) in self.INTERVALS.items():
+                if start in trace and end in trace:
+                    durations[name] = trace[end] - trace[start]
+                    self.windows[name].append(durations[name])
+            self.completed.append((trace_id, durations))
+        for name, duration in durations.items():
+            self.histogram.labels(name).observe(duration)
+        logging.info(
+            f"{ConsoleColors.BLUE}LatencyTracer:{ConsoleColors.RESET} Turn {trace_id} : "
+            + ", ".join(f"{name} = {duration:.3f}(s)" for name, duration in durations.items())
+        )
+
+    def quantile(self, name, q):
+        with self.lock:
+            values = list(self.windows[name])
+        if not values:
+            return float("nan")
+        return float(np.quantile(values, q))
+
+    def summary(self):
+        """Rolling quantiles of every interval, {interval: {quantile: seconds}}"""
+        return {
+            name: {f"p{int(q * 100)}": self.quantile(name, q) for q in self.QUANTILES}
+            for name in self.INTERVALS
+        }
@@ -1,3 +1,6 @@
+import re
+import queue
+import threading
 import time
 import numpy as np
 import retico_core
@@ -5,12 +8,207 @@ from retico_core.audio import AudioIU
 from retico_core.text import TextIU
 import logging
 from console_colors import ConsoleColors
-from openai import OpenAI
-from transformers import AutoTokenizer
+from dialogue_memory import DialogueMemory
 
 from abc import ABC, abstractmethod
 
 
+class SentenceSegmenter:
+    """Splits a stream of text deltas into sentence (or clause) sized segments.
+
+    Segments are raw slices of the input, so joining every segment returned by
+    `push` with the output of `flush` gives back the exact streamed text.
+    """
+
+    SENTENCE_END = re.compile(r"[.!?…]+[\"')\]]*\s|\n")
+    CLAUSE_END = re.compile(r"[,;:]\s")
+    ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "st", "vs", "etc", "e.g", "i.e"}
+
+    def __init__(self, min_clause_chars=40, max_chars=200):
+        self.min_clause_chars = min_clause_chars  # Split on , ; : only past this length
+        self.max_chars = max_chars  # Force a split on whitespace past this length
+        self.buffer = ""
+
+    def push(self, delta):
+        """Add a text delta, returns the list of completed segments"""
+        self.buffer += delta
+        segments = []
+        cut = self._find_cut()
+        while cut is not None:
+            segments.append(self.buffer[:cut])
+            self.buffer = self.buffer[cut:]
+            cut = self._find_cut()
+        return segments
+
+    def flush(self):
+        """Return the remaining text as the last segment"""
+        segment, self.buffer = self.buffer, ""
+        return segment
+
+    def _find_cut(self):
+        for match in self.SENTENCE_END.finditer(self.buffer):
+            words = self.buffer[: match.start()].split()
+            if words and words[-1].lower() in self.ABBREVIATIONS:
+                continue
+            if self.buffer[: match.end()].strip():
+                return match.end()
+        if len(self.buffer) >= self.min_clause_chars:
+            for match in self.CLAUSE_END.finditer(self.buffer, self.min_clause_chars):
+                return match.end()
+        if len(self.buffer) >= self.max_chars:
+            cut = self.buffer.rfind(" ", 0, self.max_chars)
+            if cut > 0:
+                return cut + 1
+        return None
+
+
+class PromptCache:
+    """Chat prompt rendered and tokenized message by message.
+
+    Each message is rendered once, by applying the chat template to the first message
+    followed by the new one and keeping what comes after the first message. The token
+    ids of all the messages are kept, so the prompt of a new turn extends the previous
+    one token for token and the prefix cache of the server always hits. Templates that
+    cannot be rendered that way are detected on the first prompt and fully rendered.
+    """
+
+    def __init__(self, tokenizer, block_size=16):
+        self.tokenizer = tokenizer
+        self.block_size = block_size  # Prefix cache block size of the server (vLLM: 16)
+        self.incremental = None  # Unknown until the first prompt is checked
+        self.last_prompt = []
+        self.reset()
+
+    def reset(self):
+        self.messages = []  # (role, content) of the rendered messages
+        self.offsets = []  # Position of each message in token_ids
+        self.token_ids = []
+        self.head = None  # Rendering of the first message
+        self.generation_ids = []  # Empty assistant turn added at the end of the prompt
+
+    def render(self, messages):
+        """Return the token ids of the prompt and the number of tokens that the server
+        can reuse from the previous prompt"""
+        prompt_ids = None
+        if self.incremental is not False:
+            try:
+                prompt_ids = self.render_incremental(messages)
+            except Exception as e:
+                logging.warning(
+                    f"{ConsoleColors.YELLOW}PromptCache:{ConsoleColors.RESET} Chat template can not be rendered incrementally : {e}"
+                )
+                self.incremental = False
+                self.reset()
+        if prompt_ids is None:
+            prompt_ids = self.tokenize(self.apply_template(messages, True))
+
+        shared = 0
+        for previous, current in zip(self.last_prompt, prompt_ids):
+            if previous != current:
+                break
+            shared += 1
+        self.last_prompt = prompt_ids
+        return prompt_ids, shared - shared % self.block_size
+
+    def render_incremental(self, messages):
+        keys = [(m["role"], m["content"]) for m in messages]
+        # First message that changed since the last prompt
+        index = 0
+        while index < min(len(keys), len(self.messages)) and keys[index] == self.messages[index]:
+            index += 1
+        if index == 0:
+            self.reset()
+            self.head = self.apply_template(messages[:1], False)
+            generation = self.apply_template(messages[:1], True)
+            self.generation_ids = self.tokenize(generation[len(self.head) :])
+        elif index < len(self.messages):
+            del self.token_ids[self.offsets[index] :]
+            del self.offsets[index:]
+            del self.messages[index:]
+
+        for i in range(index, len(messages)):
+            if i == 0:
+                text = self.head
+            else:
+                text = self.apply_template([messages[0], messages[i]], False)
+                if not text.startswith(self.head):
+                    raise ValueError("the first message is rendered differently")
+                text = text[len(self.head) :]
+            self.messages.append(keys[i])
+            self.offsets.append(len(self.token_ids))
+            self.token_ids.extend(self.tokenize(text))
+        prompt_ids = self.token_ids + self.generation_ids
+
+        if self.incremental is None:  # Compare once with the full rendering
+            full_ids = self.tokenize(self.apply_template(messages, True))
+            if full_ids != prompt_ids:
+                raise ValueError("the messages are not rendered independently")
+            self.incremental = True
+        return prompt_ids
+
+    def apply_template(self, messages, add_generation_prompt):
+        return self.tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=add_generation_prompt
+        )
+
+    def tokenize(self, text):
+        # Special tokens are part of the rendered template
+        return self.tokenizer.encode(text, add_special_tokens=False)
+
+
+class SpeculativeReply:
+    """Reply generated in the background from a speculative transcription.
+
+    The deltas are buffered while the user may still be speaking. If the final
+    transcription matches, the reply is promoted and its deltas are read as if they
+    came from the model, otherwise it is cancelled and its deltas are wasted.
+    """
+
+    def __init__(self, text, messages, generate_stream):
+        self.text = text  # Speculative user input
+        self.messages = messages  # Dialogue history the reply was generated from
+        self.deltas = queue.Queue()
+        self.cancelled = threading.Event()
+        self.nb_deltas = 0  # One delta per generated token when streaming from the server
+        self.start_time = time.time()
+        self.end_time = None
+        self.thread = threading.Thread(
+            target=self.run, args=(generate_stream,), daemon=True
+        )
+        self.thread.start()
+
+    def run(self, generate_stream):
+        generator = generate_stream(self.messages)
+        try:
+            for delta in generator:
+                if self.cancelled.is_set():
+                    break
+                self.nb_deltas += 1
+                self.deltas.put(delta)
+        except Exception as e:
+            logging.error(
+                f"{ConsoleColors.RED}NLG:{ConsoleColors.RESET} Speculative generation failed : {e}"
+            )
+        finally:
+            generator.close()
+            self.end_time = time.time()
+            self.deltas.put(None)
+
+    def stream(self):
+        """Yield the deltas of the reply, generated or to come"""
+        try:
+            while True:
+                delta = self.deltas.get()
+                if delta is None:
+                    return
+                yield delta
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
 class NLG(retico_core.AbstractModule, ABC):
     """NLG Module, manages dialogue history and generates responses."""
 
@@ -30,40 +228,328 @@ class NLG(retico_core.AbstractModule, ABC):
     def output_iu():
         return TextIU
 
-    def __init__(self, **kwargs):
+    def __init__(
+        self,
+        stream=False,
+        min_clause_chars=40,
+        interruption=None,
+        speculative=False,
+        tracer=None,
+        memory_tokens=None,
+        memory_recent=6,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         self.dialogue_history = []
+        # Token budget of the prompt, the oldest turns are folded into a summary in
+        # the background (see dialogue_memory.py), the history is unbounded if None
+        self.memory_tokens = memory_tokens
+        self.memory_recent = memory_recent
+        self.memory = None  # DialogueMemory, created by the subclass in setup
+        # Streaming mode : forward the reply to TTS sentence by sentence as ADD IUs
+        self.stream = stream
+        self.min_clause_chars = min_clause_chars
+
+        # Barge-in : the reply is cancelled and trimmed to what the user heard
+        self.interruption = interruption
+        self.epoch = 0  # Interruption epoch of the current reply
+        self._cancel = threading.Event()
+        self.history_lock = threading.Lock()
+        self.generating = False
+        self.spoken_text = None  # Spoken part of the reply if it was interrupted
+        self.reply_index = None  # Position of the last reply in the dialogue history
+        # Position of an interrupted reply whose spoken part is not reported yet
+        self.pending_index = None
+        if interruption is not None:
+            interruption.subscribe(self.interrupt)
+            interruption.subscribe_spoken(self.trim_reply)
+
+        # Speculative mode : start the reply from the speculative transcription sent
+        # by the ASR during the end of turn silence
+        self.speculative = speculative
+        self.speculation = None
+        self.speculation_stats = {
+            "attempts": 0,
+            "hits": 0,
+            "misses": 0,
+            "wasted_tokens": 0,
+            "saved_time": 0.0,
+        }
+
+        # Latency tracing : the trace of the turn is forwarded to the TTS, see metrics.py
+        self.tracer = tracer
+        self.trace_id = None
 
     def setup(self):
         pass
 
     def process_update(self, update_message):
-        iu, ut = next(update_message)
-        if ut == retico_core.UpdateType.COMMIT:
-            start_time = time.time()
+        for iu, ut in update_message:
+            if ut == retico_core.UpdateType.COMMIT:
+                self.respond(iu)
+            elif self.speculative and iu.meta_data.get("speculative", False):
+                if ut == retico_core.UpdateType.ADD:
+                    self.start_speculation(iu)
+                elif ut == retico_core.UpdateType.REVOKE:
+                    self.cancel_speculation()
 
-            # Update dialogue history with the user input
+    def respond(self, iu):
+        start_time = time.time()
+
+        # Update dialogue history with the user input
+        with self.history_lock:
             self.dialogue_history.append({"role": "user", "content": iu.text})
+            messages = self.context(self.dialogue_history)
+            self.generating = True
+            self.spoken_text = None
+            self.pending_index = None
+        self._cancel.clear()
+        if self.interruption is not None:
+            self.epoch = self.interruption.epoch
+        self.trace_id = iu.meta_data.get("trace_id")
+        speculation = self.promote_speculation(messages, start_time)
 
+        if self.stream:
+            output_text = self.stream_response(start_time, speculation, messages)
+        else:
             # Generate the output using the dialogue history
-            output_text = self.generate_response()
+            if speculation is not None:
+                deltas = []
+                generator = speculation.stream()
+                try:
+                    for delta in generator:
+                        if self._cancel.is_set():
+                            break
+                        deltas.append(delta)
+                finally:
+                    generator.close()  # Stops the generation if the reply was interrupted
+                output_text = "".join(deltas)
+            else:
+                output_text = self.generate_response(messages)
+            # The whole reply is received at once without streaming
+            self.mark("first_token")
             # Send to the next modules
-            output_iu = self.create_iu()
-            output_iu.set_text(output_text)
-            out_message = retico_core.UpdateMessage.from_iu(
-                output_iu, retico_core.UpdateType.COMMIT
-            )
-            self.append(out_message)
-            self.dialogue_history.append({"role": "assistant", "content": output_text})
-            end_time = time.time()
-            logging.info(
-                f"{ConsoleColors.BLUE}NLG:{ConsoleColors.RESET} NLG Inference time : {end_time-start_time}, NLG Output : {output_text}"
+            if not self._cancel.is_set():
+                self.send_segment(output_text, is_final=True)
+        self.add_reply(output_text)
+        end_time = time.time()
+        logging.info(
+            f"{ConsoleColors.BLUE}NLG:{ConsoleColors.RESET} NLG Inference time : {end_time-start_time}, NLG Output : {output_text}"
+        )
+
+    def start_speculation(self, iu):
+        """Generate a reply to the speculative transcription in the background"""
+        self.cancel_speculation()
+        with self.history_lock:
+            messages = self.context(
+                self.dialogue_history + [{"role": "user", "content": iu.text}]
             )
+        self.speculation = SpeculativeReply(
+            iu.text, messages, self.generate_response_stream
+        )
+        self.speculation_stats["attempts"] += 1
+        logging.debug(
+            f"{ConsoleColors.MAGENTA}NLG:{ConsoleColors.RESET} Speculative reply started : {iu.text}"
+        )
+
+    def cancel_speculation(self):
+        """The speculative transcription was revoked, its reply is wasted"""
+        speculation, self.speculation = self.speculation, None
+        if speculation is None:
+            return
+        speculation.cancel()
+        self.speculation_stats["misses"] += 1
+        self.speculation_stats["wasted_tokens"] += speculation.nb_deltas
+        logging.debug(
+            f"{ConsoleColors.MAGENTA}NLG:{ConsoleColors.RESET} Speculative reply cancelled after {speculation.nb_deltas} tokens"
+        )
+
+    def promote_speculation(self, messages, commit_time):
+        """Returns the speculative reply if it was generated from the same dialogue
+        history as the final one, else cancels it"""
+        speculation = self.speculation
+        if speculation is None:
+            return None
+        if speculation.messages != messages:
+            self.cancel_speculation()
+            self.log_speculation_stats("miss")
+            return None
+        self.speculation = None
+        end_time = speculation.end_time or commit_time
+        saved_time = min(commit_time, end_time) - speculation.start_time
+        self.speculation_stats["hits"] += 1
+        self.speculation_stats["saved_time"] += saved_time
+        self.log_speculation_stats("hit", saved_time)
+        return speculation
+
+    def log_speculation_stats(self, result, saved_time=0.0):
+        """`saved_time` is the latency saved on this turn, the stats are totals"""
+        stats = self.speculation_stats
+        logging.info(
+            f"{ConsoleColors.BLUE}NLG:{ConsoleColors.RESET} Speculation {result}, Saved time : {saved_time}(s), Attempts : {stats['attempts']}, Hits : {stats['hits']}, Misses : {stats['misses']}, Wasted tokens : {stats['wasted_tokens']}, Total saved time : {stats['saved_time']}(s)"
+        )
+
+    def stream_response(self, start_time, speculation=None, messages=None):
+        """Read the response token by token and send each sentence to the next
+        modules as soon as it is complete, returns the full response text"""
+        segmenter = SentenceSegmenter(min_clause_chars=self.min_clause_chars)
+        output_text = ""
+        first_token_time = None
+        first_segment_time = None
+        if speculation is not None:
+            generator = speculation.stream()
+        else:
+            generator = self.generate_response_stream(messages)
+        try:
+            for delta in generator:
+                if self._cancel.is_set():
+                    break
+                if first_token_time is None:
+                    first_token_time = time.time()
+                    self.mark("first_token")
+                output_text += delta
+                for segment in segmenter.push(delta):
+                    if self.send_segment(segment, is_final=False):
+                        if first_segment_time is None:
+                            first_segment_time = time.time()
+        finally:
+            generator.close()  # Aborts the request if the reply was interrupted
+        # The remaining text is sent as COMMIT to mark the end of the response
+        if not self._cancel.is_set():
+            self.send_segment(segmenter.flush(), is_final=True)
+        end_time = time.time()
+        if first_token_time is None:
+            first_token_time = end_time
+        if first_segment_time is None:
+            first_segment_time = end_time
+        logging.info(
+            f"{ConsoleColors.BLUE}NLG:{ConsoleColors.RESET} Time to first token : {first_token_time-start_time}, Time to first segment : {first_segment_time-start_time}"
+        )
+        return output_text
+
+    def send_segment(self, text, is_final):
+        """Send a segment of the response, ADD for intermediate segments and COMMIT
+        for the last one (which may be empty). Returns True if a message was sent"""
+        text = text.strip()
+        if not text and not is_final:
+            return False
+        output_iu = self.create_iu()
+        output_iu.set_text(text)
+        output_iu.meta_data["epoch"] = self.epoch
+        output_iu.meta_data["trace_id"] = self.trace_id
+        update_type = (
+            retico_core.UpdateType.COMMIT if is_final else retico_core.UpdateType.ADD
+        )
+        self.append(retico_core.UpdateMessage.from_iu(output_iu, update_type))
+        logging.debug(
+            f"{ConsoleColors.MAGENTA}NLG:{ConsoleColors.RESET} Sent segment ({update_type}) : {text}"
+        )
+        return True
+
+    def mark(self, stage):
+        if self.tracer is not None:
+            self.tracer.mark(self.trace_id, stage)
+
+    def add_reply(self, output_text):
+        """Add the reply to the dialogue history, only the spoken part if it was interrupted"""
+        with self.history_lock:
+            self.generating = False
+            self.reply_index = None
+            if self._cancel.is_set():
+                if self.spoken_text is None:
+                    # Interrupted but the TTS did not report the spoken part yet,
+                    # trim_reply inserts it here
+                    self.pending_index = len(self.dialogue_history)
+                output_text = self.spoken_text or ""
+            if output_text:
+                self.dialogue_history.append({"role": "assistant", "content": output_text})
+                self.reply_index = len(self.dialogue_history) - 1
+            if self.memory is not None:
+                # Between the turns, the summary is generated before the next one
+                self.memory.maybe_fold(self.dialogue_history, self.fold_history)
+
+    def context(self, messages):
+        """Messages of the prompt, within the token budget of the memory"""
+        if self.memory is None:
+            return list(messages)
+        return self.memory.window(messages)
+
+    def fold_history(self, folded, messages):
+        """Replace the `folded` messages at the start of the dialogue history by
+        their summary `messages`, unless they changed while it was generated"""
+        with self.history_lock:
+            if self.dialogue_history[: len(folded)] != folded:
+                return False
+            self.dialogue_history[: len(folded)] = messages
+            if self.reply_index is not None:
+                self.reply_index -= len(folded) - len(messages)
+            if self.pending_index is not None:
+                self.pending_index -= len(folded) - len(messages)
+            return True
+
+    def interrupt(self, epoch):
+        """The user started speaking, stop generating the current reply"""
+        with self.history_lock:
+            if self.generating:
+                self._cancel.set()
+
+    def trim_reply(self, text):
+        """Keep only the spoken part of the interrupted reply in the dialogue history"""
+        with self.history_lock:
+            if self.generating:
+                self._cancel.set()
+                self.spoken_text = text
+            elif self.pending_index is not None:
+                if text:
+                    self.dialogue_history.insert(
+                        self.pending_index, {"role": "assistant", "content": text}
+                    )
+                    self.reply_index = self.pending_index
+                self.pending_index = None
+            elif self.reply_index is not None:
+                if text:
+                    self.dialogue_history[self.reply_index]["content"] = text
+                else:
+                    del self.dialogue_history[self.reply_index]
+                self.reply_index = None
 
     @abstractmethod
-    def generate_response(self, user_input):
+    def generate_response(self, messages=None):
+        """Generate the reply to `messages`, the dialogue history by default"""
         pass
 
+    def generate_response_stream(self, messages=None):
+        """Yield the response as text deltas, by default the full response at once"""
+        yield self.generate_response(messages)
+
+
+class OpenAIResources:
+    """OpenAI client and tokenizer of the served model. Created once, they can be
+    shared by the NLG modules of several sessions, `tokenizer_lock` serializes the
+    use of the tokenizer"""
+
+    def __init__(self, api_key, api_base, model_id, tokenizer_id=None):
+        # Imported here, they take seconds to import, see startup.py
+        from openai import OpenAI
+        from transformers import AutoTokenizer
+
+        self.model_id = model_id
+        self.client = OpenAI(
+            api_key=api_key,
+            base_url=api_base,
+        )
+        models = [model.id for model in self.client.models.list()]
+        logging.debug(
+            f"{ConsoleColors.MAGENTA}OpenAINLG:{ConsoleColors.RESET} Available models : {models}"
+        )
+        if model_id not in models:
+            logging.error(
+                f"{ConsoleColors.RED}OpenAINLG:{ConsoleColors.RESET} : {model_id} not running !! "
+            )
+            raise RuntimeError("OpenAINLG Error")
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_id or model_id)
+        self.tokenizer_lock = threading.Lock()
+
 
 class OpenAINLG(NLG):
     """NLG Module using OpenAI API for response generation.
@@ -72,12 +558,41 @@ class OpenAINLG(NLG):
 
     """
 
-    def __init__(self, api_key, api_base, model_id, inference_args, **kwargs):
+    MESSAGE_TOKENS = 5  # Chat template tokens around a message (Llama 3 header and end of turn)
+    SUMMARY_INSTRUCTIONS = (
+        "Summarize the conversation between the user and the assistant in a few short "
+        "sentences. Keep the facts about the user, the topics discussed and anything the "
+        "assistant promised. Answer with the summary only."
+    )
+
+    def __init__(
+        self,
+        api_key,
+        api_base,
+        model_id,
+        inference_args,
+        token_prompt=True,
+        tokenizer_id=None,
+        resources=None,
+        summary_tokens=200,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         self.api_key = api_key
         self.api_base = api_base
         self.model_id = model_id
+        # Chat template and tokenizer, the served model's by default
+        self.tokenizer_id = tokenizer_id or model_id
+        self.resources = resources  # Shared OpenAIResources, created in setup if None
         self.inference_args = inference_args
+        # Send the prompt as cached token ids instead of a string rendered every turn
+        self.token_prompt = token_prompt
+        self.prompt_cache = None
+        # Tokenizer use and prompt_stats, speculative replies and other sessions render
+        # in other threads
+        self.prompt_lock = threading.Lock()
+        self.prompt_stats = {}
+        self.summary_tokens = summary_tokens  # Max length of the rolling summary
 
     def setup(self):
         self.dialogue_history.append(
@@ -86,34 +601,99 @@ class OpenAINLG(NLG):
                 "content": "Pretend to be a human discussing with his friend. Always answer using short sentences abd be proactive during the convarsation.",
             }
         )
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=self.api_base,
-        )
-        models = [model.id for model in self.client.models.list()]
-        logging.debug(
-            f"{ConsoleColors.MAGENTA}OpenAINLG:{ConsoleColors.RESET} Available models : {models}"
-        )
-        if self.model_id not in models:
-            logging.error(
-                f"{ConsoleColors.RED}OpenAINLG:{ConsoleColors.RESET} : {self.model_id} not running !! "
+        if self.resources is None:
+            self.resources = OpenAIResources(
+                self.api_key, self.api_base, self.model_id, self.tokenizer_id
+            )
+        self.client = self.resources.client
+        self.tokenizer = self.resources.tokenizer
+        self.prompt_lock = self.resources.tokenizer_lock
+        if self.token_prompt:
+            self.prompt_cache = PromptCache(self.tokenizer)
+        if self.memory_tokens is not None:
+            self.memory = DialogueMemory(
+                self.count_tokens,
+                self.summarize,
+                max_tokens=self.memory_tokens,
+                keep_recent=self.memory_recent,
             )
-            raise RuntimeError("OpenAINLG Error")
-
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
         logging.info(
             f"{ConsoleColors.BLUE}OpenAINLG:{ConsoleColors.RESET} Module setup done"
         )
 
-    def generate_response(self):
-        prompt = self.tokenizer.apply_chat_template(
-            self.dialogue_history,
-            tokenize=False,  # To get Raw String
-            add_generation_prompt=True,  # Adds an empty assistant turn at the end
+    def count_tokens(self, message):
+        with self.prompt_lock:
+            nb_tokens = len(self.tokenizer.encode(message["content"], add_special_tokens=False))
+        return nb_tokens + self.MESSAGE_TOKENS
+
+    def summarize(self, summary, messages):
+        """Rolling summary of the conversation, `summary` extended with `messages`.
+        Runs on the background thread of the memory, with its own prompt"""
+        transcript = "\n".join(f"{m['role']} : {m['content']}" for m in messages)
+        if summary:
+            transcript = f"Summary so far : {summary}\n\n{transcript}"
+        with self.prompt_lock:
+            prompt = self.tokenizer.apply_chat_template(
+                [
+                    {"role": "system", "content": self.SUMMARY_INSTRUCTIONS},
+                    {"role": "user", "content": transcript},
+                ],
+                tokenize=False,
+                add_generation_prompt=True,
+            )
+        completion = self.client.completions.create(
+            model=self.model_id,
+            prompt=prompt,
+            echo=False,
+            stream=False,
+            max_tokens=self.summary_tokens,
+            temperature=0,
+            stop=self.inference_args.get("stop"),
         )
+        return completion.choices[0].text.strip()
+
+    def build_prompt(self, messages=None):
+        start_time = time.time()
+        if messages is None:
+            with self.history_lock:
+                messages = self.context(self.dialogue_history)
+        if self.prompt_cache is not None:
+            with self.prompt_lock:
+                prompt, shared_tokens = self.prompt_cache.render(messages)
+                self.prompt_stats = {
+                    "prompt_tokens": len(prompt),
+                    "shared_tokens": shared_tokens,
+                    "render_time": time.time() - start_time,
+                }
+        else:
+            with self.prompt_lock:
+                prompt = self.tokenizer.apply_chat_template(
+                    messages,
+                    tokenize=False,  # To get Raw String
+                    add_generation_prompt=True,  # Adds an empty assistant turn at the end
+                )
+                self.prompt_stats = {"render_time": time.time() - start_time}
         logging.debug(
             f"{ConsoleColors.MAGENTA}OpenAINLG:{ConsoleColors.RESET} : Calling API with prompt : {prompt!r}"
         )
+        return prompt
+
+    def log_prompt_stats(self, usage):
+        """Per turn report of the prompt size, the cached tokens and the prefill time"""
+        with self.prompt_lock:
+            if usage is not None:
+                self.prompt_stats["prompt_tokens"] = usage.prompt_tokens
+                details = getattr(usage, "prompt_tokens_details", None)
+                if details is not None and details.cached_tokens is not None:
+                    self.prompt_stats["cached_tokens"] = details.cached_tokens
+            stats = dict(self.prompt_stats)
+        logging.info(
+            f"{ConsoleColors.BLUE}OpenAINLG:{ConsoleColors.RESET} Prompt tokens : {stats.get('prompt_tokens')}, Shared with previous prompt : {stats.get('shared_tokens')}, Cached by server : {stats.get('cached_tokens')}, Render time : {stats.get('render_time')}, Prefill time : {stats.get('prefill_time')}"
+        )
+
+    def generate_response(self, messages=None):
+        prompt = self.build_prompt(messages)
+        start_time = time.time()
         completion = self.client.completions.create(
             model=self.model_id,
             prompt=prompt,
@@ -121,4 +701,35 @@ class OpenAINLG(NLG):
             stream=False,
             **self.inference_args,
         )
+        # Prefill and decoding can not be separated without streaming
+        with self.prompt_lock:
+            self.prompt_stats["request_time"] = time.time() - start_time
+        self.log_prompt_stats(completion.usage)
         return completion.choices[0].text
+
+    def generate_response_stream(self, messages=None):
+        prompt = self.build_prompt(messages)
+        start_time = time.time()
+        stream = self.client.completions.create(
+            model=self.model_id,
+            prompt=prompt,
+            echo=False,
+            stream=True,
+            stream_options={"include_usage": True},
+            **self.inference_args,
+        )
+        usage = None
+        first_token = True
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].text:
+                    if first_token:  # Time to first token
+                        first_token = False
+                        with self.prompt_lock:
+                            self.prompt_stats["prefill_time"] = time.time() - start_time
+                    yield chunk.choices[0].text
+        finally:
+            stream.close()
+            self.log_prompt_stats(usage)
@@ -0,0 +1,116 @@
+import logging
+import resource
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+
+from audio_ring import RingAudioIU
+from console_colors import ConsoleColors
+
+
+def rss_bytes():
+    """Resident memory of the process"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:  # Not Linux, the peak is the best estimate
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    """Highest resident memory of the process since it started"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def release_iu(iu):
+    """Cut the links of a consumed IU and drop its payload, returns the bytes released"""
+    released = 0
+    iu.previous_iu = None
+    iu.grounded_in = None
+    if isinstance(iu, RingAudioIU) and iu.ring is not None:
+        iu.ring = None  # The samples stay in the ring, only the range is dropped
+    elif hasattr(iu, "raw_audio") and iu.raw_audio is not None:
+        audio = iu.raw_audio
+        released = audio.nbytes if hasattr(audio, "nbytes") else len(audio)
+    if hasattr(iu, "raw_audio"):
+        iu.raw_audio = None
+    iu.payload = None
+    return released
+
+
+class IURetention:
+    """Release policy of the IUs of a pipeline running for a long time.
+
+    retico links every IU to the previous IU of its module (previous_iu) and to the
+    IU it is grounded in, the chains are only cut at IncrementalUnit.MAX_DEPTH (50)
+    and every IU of a chain keeps its payload : the last second of microphone frames,
+    of VAD frames and of TTS frames, plus the walk of the 50 links at every new IU.
+
+    With a retention, the last consumer of an audio IU releases it once its audio is
+    used : the VAD releases the microphone frames once classified (and written to the
+    ring), the ASR the frames of the turn once they are in its feature buffer, the
+    speaker, A2F or the WebSocket sink the TTS frames once played or sent. The links
+    of a released IU are cut, so the chains stop at the IUs not consumed yet. The
+    meta data is kept, the committed and revoked flags too.
+
+    The resident memory is exposed as a watermark (current and peak RSS), with the
+    number of IUs and bytes released, see register(). A new high watermark is logged.
+    """
+
+    def __init__(self, check_interval=60.0):
+        self.lock = threading.Lock()
+        self.check_interval = check_interval  # Time between two watermark checks (s)
+        self.last_check = 0.0
+        self.high_watermark = 0
+        self.stats = {"released_ius": 0, "released_bytes": 0}
+        self.released_counter = None
+        self.released_bytes_counter = None
+
+    def release(self, iu):
+        released = release_iu(iu)
+        with self.lock:
+            self.stats["released_ius"] += 1
+            self.stats["released_bytes"] += released
+        if self.released_counter is not None:
+            self.released_counter.inc()
+            self.released_bytes_counter.inc(released)
+        now = time.monotonic()
+        if now - self.last_check >= self.check_interval:
+            self.last_check = now
+            self.check_watermark()
+
+    def check_watermark(self):
+        """Log the resident memory when it reaches a new high"""
+        rss = rss_bytes()
+        if rss > self.high_watermark:
+            if self.high_watermark:
+                logging.info(
+                    f"{ConsoleColors.BLUE}IURetention:{ConsoleColors.RESET} New memory high watermark : {rss / 2**20:.1f}(MB), Released IUs : {self.stats['released_ius']}, Released audio : {self.stats['released_bytes'] / 2**20:.1f}(MB)"
+                )
+            self.high_watermark = rss
+        return rss
+
+    def register(self, registry):
+        """Add the memory metrics to a Prometheus registry (the LatencyTracer one)"""
+        Gauge(
+            "s2s_memory_rss_bytes", "Resident memory of the process", registry=registry
+        ).set_function(rss_bytes)
+        Gauge(
+            "s2s_memory_rss_peak_bytes",
+            "Highest resident memory of the process",
+            registry=registry,
+        ).set_function(peak_rss_bytes)
+        self.released_counter = Counter(
+            "s2s_iu_released", "IUs released once consumed", registry=registry
+        )
+        self.released_bytes_counter = Counter(
+            "s2s_iu_released_bytes",
+            "Audio bytes of the IUs released once consumed",
+            registry=registry,
+        )
+
+    def log_stats(self):
+        logging.info(
+            f"{ConsoleColors.BLUE}IURetention:{ConsoleColors.RESET} Released IUs : {self.stats['released_ius']}, Released audio : {self.stats['released_bytes'] / 2**20:.1f}(MB), RSS : {rss_bytes() / 2**20:.1f}(MB), Peak RSS : {peak_rss_bytes() / 2**20:.1f}(MB)"
+        )
@@ -0,0 +1,373 @@
+"""Conversation server : one pipeline per WebSocket session, the models are shared.
+
+    python server.py --port 8765 --max_sessions 8
+
+Protocol, on ws://<host>:<port> :
+    - the server sends {"type": "ready", "input_rate": 16000, "output_rate": 24000}
+      once the session pipeline is running
+    - the client streams its microphone as binary messages of 16 bits mono PCM at
+      16kHz, continuously (the silence is needed to detect the end of the turns)
+    - the server streams the agent speech as binary messages of 16 bits mono PCM at
+      24kHz, {"type": "reply_end"} marks the end of a reply and, with --barge_in,
+      {"type": "interrupt"} tells the client to stop playing the current reply
+
+Each session has its own VAD state, dialogue history and TTS queue, all of them share
+the Whisper model, the Kokoro pipeline, the TTS cache and the OpenAI client.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import queue
+
+import retico_core
+from retico_core.audio import AudioIU
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from asr import ASR, WhisperResources
+from asr_engine import BatchedWhisperEngine
+from audio_ring import AudioRing, RingAudioIU
+from console_colors import ConsoleColors
+from interruption import Interruption
+from metrics import LatencyTracer
+from retention import IURetention
+from trace_recorder import TraceRecorder
+from startup import Startup, signal_ready
+from nlg import OpenAINLG, OpenAIResources
+from tts import TTS, KokoroResources
+from tts_cache import AudioCache
+from vad import VAD
+
+INPUT_RATE = 16000
+OUTPUT_RATE = 24000
+FRAME_LENGTH = 0.02
+
+
+class WebSocketSource(retico_core.AbstractProducingModule):
+    """Microphone of a session : the received PCM is cut into frames. With a ring
+    (audio_ring.py) it is written into it once and the frames are sample ranges"""
+
+    @staticmethod
+    def name():
+        return "WebSocket Source Module"
+
+    @staticmethod
+    def description():
+        return "A module that produces the audio frames received from a WebSocket client"
+
+    @staticmethod
+    def output_iu():
+        return RingAudioIU
+
+    def __init__(self, frame_length=FRAME_LENGTH, sample_rate=INPUT_RATE, ring=None, **kwargs):
+        super().__init__(**kwargs)
+        self.sample_rate = sample_rate
+        self.frame_size = int(frame_length * sample_rate)
+        self.frames = queue.Queue()
+        self.pending = b""
+        self.ring = ring
+        self.next_frame = 0  # Start of the next frame in the ring
+
+    def push(self, data):
+        """Add received PCM bytes, called from the event loop"""
+        if self.ring is not None:
+            return self.push_ring(data)
+        self.pending += data
+        frame_bytes = 2 * self.frame_size
+        nb_frames = len(self.pending) // frame_bytes
+        for i in range(nb_frames):
+            self.frames.put(self.pending[i * frame_bytes : (i + 1) * frame_bytes])
+        self.pending = self.pending[nb_frames * frame_bytes :]
+
+    def push_ring(self, data):
+        if self.pending:  # Odd byte of the previous message
+            data = self.pending + data
+        self.pending = data[len(data) - len(data) % 2 :]
+        _, end = self.ring.write(memoryview(data)[: len(data) - len(self.pending)])
+        while self.next_frame + self.frame_size <= end:
+            self.frames.put((self.next_frame, self.next_frame + self.frame_size))
+            self.next_frame += self.frame_size
+
+    def process_update(self, _):
+        try:
+            frame = self.frames.get(timeout=0.1)
+        except queue.Empty:
+            return None
+        output_iu = self.create_iu()
+        if self.ring is not None:
+            output_iu.set_range(self.ring, *frame)
+        else:
+            output_iu.set_audio(frame, self.frame_size, self.sample_rate, 2)
+        return retico_core.UpdateMessage.from_iu(output_iu, retico_core.UpdateType.ADD)
+
+
+class WebSocketSink(retico_core.AbstractConsumingModule):
+    """Speaker of a session : the agent speech is sent back to the client"""
+
+    @staticmethod
+    def name():
+        return "WebSocket Sink Module"
+
+    @staticmethod
+    def description():
+        return "A module that sends the agent speech to a WebSocket client"
+
+    @staticmethod
+    def input_ius():
+        return [AudioIU]
+
+    @staticmethod
+    def output_iu():
+        return None
+
+    def __init__(self, send, tracer=None, retention=None, **kwargs):
+        super().__init__(**kwargs)
+        self.send = send  # Thread safe, queues a message for the client
+        self.tracer = tracer
+        self.retention = retention  # IU retention, see retention.py
+
+    def process_update(self, update_message):
+        for iu, ut in update_message:
+            if iu.nframes > 0:
+                if self.tracer is not None:
+                    self.tracer.mark(iu.meta_data.get("trace_id"), "first_output")
+                self.send(bytes(iu.raw_audio))
+            if self.retention is not None:
+                self.retention.release(iu)
+            if ut == retico_core.UpdateType.COMMIT:
+                self.send(json.dumps({"type": "reply_end"}))
+        return None
+
+
+class SharedResources:
+    """Models and clients loaded once for all the sessions, concurrently, then warmed
+    up before the server accepts connections"""
+
+    def __init__(self, args, device=None):
+        self.kokoro_args = {"device": device, "lang_code": "a", "repo_id": "hexgrad/Kokoro-82M"}
+        startup = Startup()
+        startup.add(
+            "whisper",
+            lambda: WhisperResources(
+                args.asr_model_id,
+                device,
+                quantize=args.asr_quantize,
+                compile=args.asr_compile,
+                num_threads=args.asr_threads,
+                assistant_model_id=args.asr_assistant_model_id,
+            ),
+        )
+        startup.add("kokoro", lambda: KokoroResources(self.kokoro_args))
+        startup.add(
+            "openai",
+            lambda: OpenAIResources(
+                args.nlg_api_key, args.nlg_api_base, args.nlg_model_id, args.tokenizer_id
+            ),
+        )
+        if not args.no_warmup:
+            startup.add(
+                "asr_warmup",
+                lambda whisper: whisper.warmup(word_timestamps=args.asr_streaming),
+                after=["whisper"],
+            )
+            startup.add("tts_warmup", lambda kokoro: kokoro.warmup(), after=["kokoro"])
+        loaded = startup.run()
+        self.whisper = loaded["whisper"]
+        self.kokoro = loaded["kokoro"]
+        self.openai = loaded["openai"]
+        self.asr_engine = None
+        if args.asr_batch_size > 1 and not args.asr_streaming:
+            self.asr_engine = BatchedWhisperEngine(
+                self.whisper, max_batch_size=args.asr_batch_size, max_wait=args.asr_batch_wait
+            )
+        self.tts_cache = AudioCache() if args.tts_cache else None
+        self.tracer = LatencyTracer()
+        # Audio IUs released by their last consumer, with the memory watermark
+        self.retention = None
+        if not args.no_iu_retention:
+            self.retention = IURetention()
+            self.retention.register(self.tracer.registry)
+        # Hot-path trace of all the sessions, dumped with `kill -USR1 <pid>`
+        self.recorder = None
+        if args.trace_file:
+            self.recorder = TraceRecorder(capacity=args.trace_capacity)
+            self.recorder.dump_on_signal(args.trace_file)
+
+
+class Session:
+    """Pipeline of one client, from its audio frames to the agent speech"""
+
+    def __init__(self, session_id, resources, args, send):
+        self.session_id = session_id
+        self.interruption = None
+        if args.barge_in:
+            self.interruption = Interruption()
+            self.interruption.subscribe(
+                lambda epoch: send(json.dumps({"type": "interrupt"}))
+            )
+        tracer = resources.tracer
+        retention = resources.retention
+        # Written once by the source, read in place by the VAD and the ASR
+        ring = None if args.no_audio_ring else AudioRing(sample_rate=INPUT_RATE)
+        self.source = WebSocketSource(ring=ring)
+        self.vad = VAD(
+            mode=3,
+            sample_rate=INPUT_RATE,
+            max_silence_length=0.700,
+            frame_length=FRAME_LENGTH,
+            min_turn_length=0.150,
+            interruption=self.interruption,
+            tracer=tracer,
+            ring=ring,
+            retention=retention,
+        )
+        self.asr = ASR(
+            model_id=args.asr_model_id,
+            sample_rate=INPUT_RATE,
+            streaming=args.asr_streaming,
+            tracer=tracer,
+            resources=resources.whisper,
+            engine=resources.asr_engine,
+            retention=retention,
+        )
+        self.nlg = OpenAINLG(
+            api_key=args.nlg_api_key,
+            api_base=args.nlg_api_base,
+            model_id=args.nlg_model_id,
+            inference_args={"max_tokens": 250, "stop": ["<|eot_id|>"]},
+            stream=True,
+            memory_tokens=args.nlg_memory_tokens,
+            memory_recent=args.nlg_memory_recent,
+            interruption=self.interruption,
+            tracer=tracer,
+            resources=resources.openai,
+        )
+        self.tts = TTS(
+            sample_rate=OUTPUT_RATE,
+            model_args=resources.kokoro_args,
+            delivery="immediate",
+            interruption=self.interruption,
+            tracer=tracer,
+            cache=resources.tts_cache,
+            resources=resources.kokoro,
+            recorder=resources.recorder,
+        )
+        self.sink = WebSocketSink(send, tracer=tracer, retention=retention)
+        if resources.recorder is not None:
+            for name, module in [("VAD", self.vad), ("ASR", self.asr), ("NLG", self.nlg), ("TTS", self.tts)]:
+                resources.recorder.instrument_module(module, f"{name}:{session_id}")
+        self.source.subscribe(self.vad)
+        self.vad.subscribe(self.asr)
+        self.asr.subscribe(self.nlg)
+        self.nlg.subscribe(self.tts)
+        self.tts.subscribe(self.sink)
+
+    def start(self):
+        retico_core.network.run(self.source)
+
+    def stop(self):
+        retico_core.network.stop(self.source)
+
+
+async def forward(websocket, outgoing):
+    """Send the queued messages of the session to the client"""
+    while True:
+        message = await outgoing.get()
+        await websocket.send(message)
+
+
+async def handle(websocket, resources, args, sessions, session_ids):
+    if len(sessions) >= args.max_sessions:
+        await websocket.close(1013, "Too many sessions")
+        return
+    loop = asyncio.get_running_loop()
+    outgoing = asyncio.Queue()
+
+    def send(message):
+        loop.call_soon_threadsafe(outgoing.put_nowait, message)
+
+    session_id = next(session_ids)
+    session = Session(session_id, resources, args, send)
+    sessions[session_id] = session
+    sender = None
+    try:
+        await loop.run_in_executor(None, session.start)
+        logging.info(
+            f"{ConsoleColors.BLUE}Server:{ConsoleColors.RESET} Session {session_id} started, {len(sessions)} active"
+        )
+        await websocket.send(
+            json.dumps({"type": "ready", "input_rate": INPUT_RATE, "output_rate": OUTPUT_RATE})
+        )
+        sender = asyncio.create_task(forward(websocket, outgoing))
+        async for message in websocket:
+            if isinstance(message, bytes):
+                session.source.push(message)
+    except ConnectionClosed:
+        pass
+    finally:
+        if sender is not None:
+            sender.cancel()
+        await loop.run_in_executor(None, session.stop)
+        del sessions[session_id]
+        logging.info(
+            f"{ConsoleColors.BLUE}Server:{ConsoleColors.RESET} Session {session_id} closed, {len(sessions)} active"
+        )
+
+
+async def main(args):
+    resources = SharedResources(args)
+    if args.metrics_port is not None:
+        resources.tracer.serve(args.metrics_port)
+    sessions = {}
+    session_ids = itertools.count()
+    async with serve(
+        lambda websocket: handle(websocket, resources, args, sessions, session_ids),
+        args.host,
+        args.port,
+        max_size=2**20,
+    ) as server:
+        logging.info(
+            f"{ConsoleColors.BLUE}Server:{ConsoleColors.RESET} Listening on ws://{args.host}:{args.port}"
+        )
+        if args.ready_file:
+            signal_ready(args.ready_file)
+        try:
+            await server.serve_forever()
+        finally:
+            if resources.recorder is not None:
+                resources.recorder.dump(args.trace_file)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max_sessions", type=int, default=8)
+    parser.add_argument("--asr_model_id", type=str, default="openai/whisper-large-v3-turbo")
+    parser.add_argument("--asr_streaming", action="store_true")
+    parser.add_argument("--asr_quantize", action="store_true", help="int8 dynamic quantization of Whisper (CPU)")
+    parser.add_argument("--asr_compile", action="store_true", help="torch.compile the Whisper encoder")
+    parser.add_argument("--asr_threads", type=int, default=None)
+    parser.add_argument("--asr_assistant_model_id", type=str, default=None, help="Draft model of the assisted generation")
+    parser.add_argument("--asr_batch_size", type=int, default=8, help="Turns decoded in one batch, 1 to disable")
+    parser.add_argument("--asr_batch_wait", type=float, default=0.02, help="Max wait for a batch to fill (s)")
+    parser.add_argument("--nlg_api_key", type=str, default="token-abc123")
+    parser.add_argument("--nlg_api_base", type=str, default="http://localhost:8000/v1")
+    parser.add_argument("--nlg_model_id", type=str, default="meta-llama/Llama-3.2-1B-Instruct")
+    parser.add_argument("--tokenizer_id", type=str, default=None)
+    parser.add_argument("--nlg_memory_tokens", type=int, default=None, help="Token budget of the prompt of a session")
+    parser.add_argument("--nlg_memory_recent", type=int, default=6)
+    parser.add_argument("--tts_cache", action="store_true", help="Share a TTS audio cache between the sessions")
+    parser.add_argument("--barge_in", action="store_true")
+    parser.add_argument("--no_audio_ring", action="store_true", help="Forward the input audio as bytes instead of ranges of a shared ring")
+    parser.add_argument("--no_iu_retention", action="store_true", help="Keep the consumed audio IUs linked with their audio, as retico does")
+    parser.add_argument("--metrics_port", type=int, default=None)
+    parser.add_argument("--trace_file", type=str, default=None, help="Record a hot-path trace, written as Chrome trace JSON on SIGUSR1 and at exit")
+    parser.add_argument("--trace_capacity", type=int, default=2**16)
+    parser.add_argument("--no_warmup", action="store_true", help="Skip the ASR and TTS warm-up pass")
+    parser.add_argument("--ready_file", type=str, default=None, help="File created once the server listens")
+    asyncio.run(main(parser.parse_args()))
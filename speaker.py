@@ -0,0 +1,59 @@
+import threading
+import logging
+
+import retico_core
+from retico_core.audio import SpeakerModule
+
+from console_colors import ConsoleColors
+
+
+class InterruptibleSpeakerModule(SpeakerModule):
+    """Speaker that writes the audio in small blocks so the playback of a chunk can be
+    stopped when the user interrupts the agent"""
+
+    def __init__(
+        self, interruption=None, block_length=0.05, tracer=None, retention=None, **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.block_length = block_length  # Playback can be stopped every block (s)
+        self.epoch = 0
+        self._flush = threading.Event()
+        if interruption is not None:
+            interruption.subscribe(self.interrupt)
+        self.tracer = tracer  # Latency tracing, see metrics.py
+        self.retention = retention  # IU retention, see retention.py
+
+    @staticmethod
+    def name():
+        return "Interruptible Speaker Module"
+
+    def interrupt(self, epoch):
+        self.epoch = epoch
+        self._flush.set()
+
+    def process_update(self, update_message):
+        for iu, ut in update_message:
+            if ut != retico_core.UpdateType.ADD:
+                self.release(iu)
+                continue
+            if iu.meta_data.get("epoch", self.epoch) < self.epoch:
+                self.release(iu)
+                continue  # Audio of an interrupted reply
+            self._flush.clear()
+            audio = bytes(iu.raw_audio)
+            self.release(iu)
+            if self.tracer is not None and audio:
+                self.tracer.mark(iu.meta_data.get("trace_id"), "first_output")
+            block_size = int(self.block_length * self.rate) * self.sample_width
+            for start in range(0, len(audio), block_size):
+                if self._flush.is_set():
+                    logging.debug(
+                        f"{ConsoleColors.MAGENTA}Speaker:{ConsoleColors.RESET} Playback interrupted"
+                    )
+                    break
+                self.stream.write(audio[start : start + block_size])
+        return None
+
+    def release(self, iu):
+        if self.retention is not None:
+            self.retention.release(iu)
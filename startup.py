@@ -0,0 +1,109 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from console_colors import ConsoleColors
+
+
+class Startup:
+    """Runs the startup tasks (model loading, warm-up) concurrently.
+
+    A task is a function of the results of the tasks it depends on, it starts as soon
+    as they are done. The loaders spend most of their time reading weights and in
+    torch / tokenizer code that releases the GIL, so they overlap well on threads.
+    The heavy imports (torch, transformers, kokoro, openai) are done inside the
+    loaders, they overlap too : the device of the models is chosen by the loaders
+    (see torch_device).
+
+        startup = Startup()
+        startup.add("whisper", lambda: WhisperResources(model_id))
+        startup.add("asr_warmup", lambda whisper: whisper.warmup(), after=["whisper"])
+        results = startup.run()  # results["whisper"]
+
+    `run` logs the timeline of the tasks and sets `ready`.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers  # One thread per task by default
+        self.tasks = {}  # name : (function, dependencies)
+        self.timeline = {}  # name : (start, end) relative to the start of run()
+        self.ready = threading.Event()
+
+    def add(self, name, function, after=()):
+        self.tasks[name] = (function, list(after))
+
+    def run(self):
+        """Run every task, returns {name : result}. Raises the first error once the
+        other tasks are done"""
+        start_time = time.perf_counter()
+        futures = {}
+
+        def run_task(name):
+            function, dependencies = self.tasks[name]
+            inputs = [futures[dependency].result() for dependency in dependencies]
+            task_start = time.perf_counter() - start_time
+            try:
+                return function(*inputs)
+            finally:
+                self.timeline[name] = (task_start, time.perf_counter() - start_time)
+
+        # The dependencies are submitted first, so a task waiting for them never holds
+        # the worker one of them is queued for
+        with ThreadPoolExecutor(max_workers=self.max_workers or max(len(self.tasks), 1)) as executor:
+            for name in self.order():
+                futures[name] = executor.submit(run_task, name)
+        self.total_time = time.perf_counter() - start_time
+        self.log_timeline()
+        results = {name: future.result() for name, future in futures.items()}
+        self.ready.set()
+        logging.info(
+            f"{ConsoleColors.GREEN}Startup:{ConsoleColors.RESET} Ready in {self.total_time:.2f} (s)"
+        )
+        return results
+
+    def order(self):
+        """Task names, dependencies first"""
+        ordered, visiting = [], set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name in visiting:
+                raise ValueError(f"Startup : circular dependency on {name}")
+            visiting.add(name)
+            for dependency in self.tasks[name][1]:
+                visit(dependency)
+            ordered.append(name)
+
+        for name in self.tasks:
+            visit(name)
+        return ordered
+
+    def log_timeline(self):
+        width = max(len(name) for name in self.tasks) if self.tasks else 0
+        lines = []
+        for name, (start, end) in sorted(self.timeline.items(), key=lambda item: item[1]):
+            bar_start = int(40 * start / max(self.total_time, 1e-6))
+            bar_end = max(int(40 * end / max(self.total_time, 1e-6)), bar_start + 1)
+            bar = " " * bar_start + "#" * (bar_end - bar_start)
+            lines.append(f"  {name:<{width}} {start:7.2f} -> {end:7.2f} (s) |{bar:<40}|")
+        sequential = sum(end - start for start, end in self.timeline.values())
+        logging.info(
+            f"{ConsoleColors.BLUE}Startup:{ConsoleColors.RESET} Timeline, {self.total_time:.2f} (s) instead of {sequential:.2f} (s) one after another\n"
+            + "\n".join(lines)
+        )
+
+
+def torch_device():
+    """cuda if available, else cpu. Imports torch, call it from a loader"""
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def signal_ready(path):
+    """Create the readiness file `path` (e.g. for a container readiness probe)"""
+    with open(path, "w") as f:
+        f.write(f"{os.getpid()}\n")
@@ -0,0 +1,135 @@
+import functools
+import itertools
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+from console_colors import ConsoleColors
+
+
+def queue_depth(module):
+    return sum(q.qsize() for q in module.left_buffers())
+
+
+class TraceRecorder:
+    """Spans and events of the hot path, exported as a Chrome trace.
+
+    Every record is a (start, duration, thread, key, value) tuple in a preallocated
+    list of `capacity` slots : start and duration in ns (time.perf_counter_ns), an
+    optional integer value (queue depth, samples...). The slots form a ring, the
+    oldest records are overwritten once it is full. Recording takes no lock : the slot
+    is reserved with an itertools.count, a record costs about a microsecond. The keys
+    are the (module, event) pairs, registered once with key().
+
+    The modules take the recorder as an optional argument like the LatencyTracer,
+    without a recorder the cost is an `is not None` check. instrument() wraps a method
+    of an object (process_update of a module) instead.
+
+    dump() writes the records in the Chrome trace format, open it in
+    chrome://tracing or https://ui.perfetto.dev : one track per thread, spans as
+    complete events, the values as counters. dump_on_signal() dumps on SIGUSR1.
+    """
+
+    def __init__(self, capacity=2**16):
+        self.capacity = capacity
+        # Duration -1 for an instant event, value -1 without value, None if empty
+        self.records = [None] * capacity
+        self.counter = itertools.count()
+        self.names = []  # key -> (module, event)
+        self.key_ids = {}
+        self.thread_names = {}
+        self.lock = threading.Lock()  # Key registration and dumps only
+        self.origin = time.perf_counter_ns()
+
+    def key(self, module, event):
+        """Id of the (module, event) pair, to register once before recording"""
+        with self.lock:
+            if (module, event) not in self.key_ids:
+                self.key_ids[(module, event)] = len(self.names)
+                self.names.append((module, event))
+            return self.key_ids[(module, event)]
+
+    def record(self, key, start, end=None, value=-1):
+        """Span from `start` to `end` (now by default), in perf_counter_ns"""
+        if end is None:
+            end = time.perf_counter_ns()
+        self.write(key, start, end - start, value)
+
+    def event(self, key, value=-1):
+        """Instant event"""
+        self.write(key, time.perf_counter_ns(), -1, value)
+
+    def write(self, key, start, duration, value):
+        thread = threading.get_native_id()
+        if thread not in self.thread_names:
+            self.thread_names[thread] = threading.current_thread().name
+        self.records[next(self.counter) % self.capacity] = (start, duration, thread, key, value)
+
+    def instrument(self, obj, method, module, value=None):
+        """Record every call of obj.method as a span, `value(obj)` is recorded with
+        it (the queue depth of a module for example)"""
+        function = getattr(obj, method)
+        key = self.key(module, method)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.record(key, start, value=value(obj) if value is not None else -1)
+
+        setattr(obj, method, wrapper)
+
+    def instrument_module(self, module, name):
+        """Record the process_update calls of a retico module, with the number of
+        messages still waiting in its input queues"""
+        self.instrument(module, "process_update", name, value=queue_depth)
+
+    def chrome_trace(self):
+        """The records, oldest first, as a Chrome trace dict"""
+        with self.lock:
+            total = next(self.counter)  # Reserves a slot, left empty
+            self.records[total % self.capacity] = None
+            names = list(self.names)
+        index = total % self.capacity
+        records = self.records[index + 1 :] + self.records[:index]  # Oldest first
+        pid = os.getpid()
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in list(self.thread_names.items())
+        ]
+        for slot in records:
+            if slot is None:
+                continue
+            start, duration, tid, key, value = slot
+            module, event = names[key]
+            ts = (start - self.origin) / 1000  # us
+            record = {"name": event, "cat": module, "pid": pid, "tid": tid, "ts": ts}
+            if duration < 0:
+                record.update(ph="i", s="t")
+            else:
+                record.update(ph="X", dur=duration / 1000)
+            if value >= 0:
+                record["args"] = {"value": value}
+                events.append(
+                    {"name": f"{module}.{event}", "ph": "C", "pid": pid, "ts": ts, "args": {"value": value}}
+                )
+            events.append(record)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump(self, path):
+        """Write the Chrome trace JSON to `path`"""
+        trace = self.chrome_trace()
+        with open(path, "w") as f:
+            json.dump(trace, f)
+        logging.info(
+            f"{ConsoleColors.BLUE}TraceRecorder:{ConsoleColors.RESET} {len(trace['traceEvents'])} trace events written to {path}"
+        )
+
+    def dump_on_signal(self, path, signum=signal.SIGUSR1):
+        """Dump to `path` when the process receives `signum` (from the main thread)"""
+        signal.signal(signum, lambda *_: self.dump(path))
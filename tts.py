@@ -4,14 +4,44 @@ import numpy as np
 import retico_core
 from retico_core.audio import AudioIU
 from retico_core.text import TextIU
-from kokoro import KPipeline
 import soundfile as sf
-import torchaudio
-import torch
 import logging
+from audio_output import JitterBuffer, PCMConverter, StreamingResampler
 from console_colors import ConsoleColors
+from tts_cache import CachedG2P
+from startup import torch_device
 
 import queue
+from collections import namedtuple
+
+
+# A piece of the system utterance to synthesize, the last one of an utterance is final.
+# epoch is the interruption epoch of the reply, see interruption.py, trace_id the
+# latency trace of the turn, see metrics.py
+Segment = namedtuple(
+    "Segment", ["text", "is_final", "epoch", "trace_id"], defaults=[0, None]
+)
+
+
+class KokoroResources:
+    """Kokoro pipeline, loaded once, it can be shared by the TTS of several sessions.
+    `lock` is held while a chunk is generated, the sessions synthesize in turns"""
+
+    def __init__(self, model_args):
+        # Imported here, kokoro loads its G2P dependencies at import, see startup.py
+        from kokoro import KPipeline
+
+        if model_args.get("device") is None:
+            model_args = {**model_args, "device": torch_device()}
+        self.pipeline = KPipeline(**model_args)
+        self.lock = threading.Lock()
+
+    def warmup(self, voice="am_fenrir"):
+        """Synthesize a short sentence : loads the voice and initializes the G2P and
+        the model kernels before the first reply"""
+        with self.lock:
+            for _ in self.pipeline("Hello, how are you?", voice=voice):
+                pass
 
 
 class TTS(retico_core.AbstractModule):
@@ -38,56 +68,160 @@ class TTS(retico_core.AbstractModule):
         return AudioIU
 
     def __init__(
-        self, sample_rate, model_args, output_audio_bytes=True, sample_width=2, **kwargs
+        self,
+        sample_rate,
+        model_args,
+        output_audio_bytes=True,
+        sample_width=2,
+        delivery="lookahead",
+        pipelined=False,
+        interruption=None,
+        tracer=None,
+        cache=None,
+        prewarm_phrases=None,
+        resources=None,
+        frame_length=0.02,
+        jitter_prefill=0.1,
+        jitter_capacity=2.0,
+        recorder=None,
+        **kwargs,
     ):
         super().__init__(**kwargs)
         self.buffer_in = queue.Queue()
         self.sample_rate = sample_rate
         self.model_args = model_args
         self.producer = None
+        self.delivery = delivery
+        self.pipelined = pipelined
+        self.interruption = interruption
+        if interruption is not None:
+            interruption.subscribe(self.interrupt)
+        self.tracer = tracer  # Latency tracing, see metrics.py
+        self.cache = cache  # AudioCache of the synthesized segments, see tts_cache.py
+        self.prewarm_phrases = prewarm_phrases or []
+        self.resources = resources  # Shared KokoroResources, loaded in setup if None
+        self.recorder = recorder  # Hot-path trace of the producer, see trace_recorder.py
+
+        # Output stage : the audio leaves in frames of frame_length seconds, paced by a
+        # jitter buffer, see audio_output.py
+        self.frame_length = frame_length
+        self.jitter_prefill = jitter_prefill
+        self.jitter_capacity = jitter_capacity
+        self.output = None
+        self.converter = None
 
         # Params  for Audio output : bytes or tensor
         self.output_audio_bytes = output_audio_bytes
         self.sample_width = sample_width
 
     def setup(self):
+        self.output = JitterBuffer(
+            self.send_message,
+            self.sample_rate,
+            frame_length=self.frame_length,
+            prefill=self.jitter_prefill,
+            capacity=self.jitter_capacity,
+        )
+        self.converter = PCMConverter(self.output.frame_size)
         self.producer = KoKoRoTTS(
             buffer_in=self.buffer_in,
             sample_rate=self.sample_rate,
-            callback=self.send_message,
+            callback=self.write_audio,
             model_args=self.model_args,
+            delivery=self.delivery,
+            pipelined=self.pipelined,
+            cache=self.cache,
+            resources=self.resources,
+            recorder=self.recorder,
         )
+        if self.cache is not None and self.prewarm_phrases:
+            self.producer.prewarm(self.prewarm_phrases)
 
     def prepare_run(self):
+        if self.output is not None:
+            self.output.start()
         if self.producer is not None:
             self.producer.start()
         super().prepare_run()
 
     def process_update(self, update_message):
-        iu, ut = next(update_message)  # TTS returns the transcript of one speech
-        # TODO : Use streaming with .ADD and .COMMIT which uses either a queue or streaming tts model
-        if ut == retico_core.UpdateType.COMMIT:
-            logging.debug(
-                f"{ConsoleColors.MAGENTA}TTS:{ConsoleColors.RESET}: Received a COMMIT Message"
-            )
-            self.buffer_in.put(iu.text)
+        # ADD IUs carry one segment of the utterance, the COMMIT IU carries the last
+        # segment (possibly empty) and marks the end of the utterance
+        for iu, ut in update_message:
+            if ut == retico_core.UpdateType.ADD:
+                logging.debug(
+                    f"{ConsoleColors.MAGENTA}TTS:{ConsoleColors.RESET}: Received an ADD Message"
+                )
+                self.buffer_in.put(
+                    Segment(
+                        iu.text,
+                        False,
+                        iu.meta_data.get("epoch", 0),
+                        iu.meta_data.get("trace_id"),
+                    )
+                )
+            elif ut == retico_core.UpdateType.COMMIT:
+                logging.debug(
+                    f"{ConsoleColors.MAGENTA}TTS:{ConsoleColors.RESET}: Received a COMMIT Message"
+                )
+                self.buffer_in.put(
+                    Segment(
+                        iu.text,
+                        True,
+                        iu.meta_data.get("epoch", 0),
+                        iu.meta_data.get("trace_id"),
+                    )
+                )
+
+    def interrupt(self, epoch):
+        """The user started speaking : drop the pending segments, stop the synthesis
+        and the audio waiting to be played, then report what was already spoken"""
+        while True:
+            try:
+                self.buffer_in.get_nowait()
+            except queue.Empty:
+                break
+        if self.producer is None:
+            return
+        # First, a synthesis waiting for room in the jitter buffer gives up
+        self.output.cancel(epoch)
+        spoken_text = self.producer.cancel(epoch, self.flush_output)
+        if spoken_text is not None:
+            self.interruption.report_spoken(spoken_text)
 
-    def send_message(self, raw_audio, is_final: bool = False):
-        """Method to create an output message"""
+    def flush_output(self):
+        """Drop the audio not consumed yet by the next modules (speaker, A2F)"""
+        for buffer in self.right_buffers():
+            while True:
+                try:
+                    buffer.get_nowait()
+                except queue.Empty:
+                    break
+
+    def write_audio(
+        self, raw_audio, is_final: bool = False, epoch: int = 0, trace_id=None
+    ):
+        """Queue a synthesized chunk (float32, None for an empty end of utterance) in
+        the jitter buffer, it is sent as fixed size frames by send_message"""
+        if raw_audio is not None and self.tracer is not None:
+            self.tracer.mark(trace_id, "first_tts_chunk")
+        self.output.write(raw_audio, is_final, epoch, trace_id)
+
+    def send_message(
+        self, raw_audio, is_final: bool = False, epoch: int = 0, trace_id=None
+    ):
+        """Method to create an output message from a frame of the jitter buffer"""
         output_iu = self.create_iu()
+        output_iu.meta_data["epoch"] = epoch
+        output_iu.meta_data["trace_id"] = trace_id
 
         nframes = len(raw_audio)
 
         # Convert the audio to bytes if next modules takes bytes as input
         if self.output_audio_bytes:
-            raw_audio = torch.clamp(raw_audio, -1.0, 1.0)
-            audio_int16 = (raw_audio * 32767.0).to(torch.int16)
-
-            # Convert to bytes
-            audio = audio_int16.numpy().tobytes()
-            nframes = audio_int16.shape[0]
+            audio = self.converter.convert(raw_audio)
         else:
-            audio = raw_audio.numpy()
+            audio = raw_audio.copy()  # The frame buffer is reused
 
         output_iu.set_audio(
             raw_audio=audio,
@@ -104,72 +238,344 @@ class TTS(retico_core.AbstractModule):
                 output_iu, retico_core.UpdateType.ADD
             )
         self.append(out_message)
-        logging.debug(
-            f"{ConsoleColors.MAGENTA}TTS:{ConsoleColors.RESET} Sending a message, is_final = {is_final}"
-        )
+        # Called for every frame, the message is only formatted when it is printed
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(
+                f"{ConsoleColors.MAGENTA}TTS:{ConsoleColors.RESET} Sending a message, is_final = {is_final}"
+            )
 
     def shutdown(self):
         # Add the model producer setting to end
         if self.producer is not None:
             self.producer.stop()
+        if self.output is not None:
+            self.output.stop()
         super().shutdown()
 
 
+class ChunkPrefetcher:
+    """Runs a chunk generator on a worker thread, keeping up to `depth` chunks ready
+    while the previous ones are being delivered"""
+
+    _END = object()
+
+    def __init__(self, generator, depth=1):
+        self.generator = generator
+        self.chunks = queue.Queue(maxsize=depth)
+        self._stop_event = threading.Event()
+        self.worker = threading.Thread(target=self._produce, daemon=True)
+        self.worker.start()
+
+    def _produce(self):
+        try:
+            for item in self.generator:
+                if not self._put(item):
+                    return
+            self._put(self._END)
+        except Exception as e:  # Raised again on the consumer side
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        while True:
+            item = self.chunks.get()
+            if item is self._END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        """Stop the worker, the chunks not delivered yet are dropped"""
+        self._stop_event.set()
+
+
 class KoKoRoTTS(threading.Thread):
-    """Class for TTS: retrieve text from queue and generate the corresponding speech"""
+    """Class for TTS: retrieve text from queue and generate the corresponding speech
+
+    Delivery modes :
+        - lookahead : the last chunk of an utterance is held back until the generator
+          is exhausted so it can be sent as the final (COMMIT) chunk
+        - immediate : every chunk is sent as ADD as soon as it is generated and the
+          end of the utterance is signaled with an empty COMMIT chunk
+    With pipelined=True the next chunk is synthesized on a worker thread while the
+    current one is being delivered.
+    """
 
     def __init__(
-        self, buffer_in, sample_rate, callback, model_args, voice: str = "am_fenrir"
+        self,
+        buffer_in,
+        sample_rate,
+        callback,
+        model_args,
+        voice: str = "am_fenrir",
+        delivery: str = "lookahead",
+        pipelined: bool = False,
+        cache=None,
+        resources=None,
+        recorder=None,
     ):
         super().__init__()
+        if delivery not in ("lookahead", "immediate"):
+            raise ValueError(f"Unknown delivery mode : {delivery}")
+        self.delivery = delivery
+        self.pipelined = pipelined
         self.buffer_in = buffer_in
         self.callback = callback  # Method to call at the end of the generative process
         self._stop_event = threading.Event()
         self.sample_rate = sample_rate
-        self.pipeline = KPipeline(**model_args)
+        if resources is None:
+            resources = KokoroResources(model_args)
+        self.pipeline = resources.pipeline
+        self.pipeline_lock = resources.lock
         self.resampler = None
         if self.sample_rate != 24000:  # Base freq for KoKoRo TTS
-            self.resampler = torchaudio.transforms.Resample(
-                orig_freq=24000, new_freq=self.sample_rate
-            )
+            # Keeps its filter state from one chunk to the next within an utterance
+            self.resampler = StreamingResampler(24000, self.sample_rate)
         self.voice = voice
+        self.model_name = model_args.get("repo_id", "hexgrad/Kokoro-82M")
+
+        # Cache of the audio of short segments and of the G2P results
+        self.cache = cache
+        # The pipeline of a TTS worker (workers.py) has its G2P in the worker process
+        g2p = getattr(self.pipeline, "g2p", None)
+        if cache is not None and g2p is not None and not isinstance(g2p, CachedG2P):
+            self.pipeline.g2p = CachedG2P(self.pipeline.g2p, cache)
+
+        # Barge-in : segments of an epoch older than this one are dropped
+        self.epoch = 0
+        self.lock = threading.Lock()
+
+        # Hot-path trace : wait for a segment, synthesis of a segment, wait for the
+        # pipeline lock, model call of a chunk, delivery of a chunk
+        self.recorder = recorder
+        if recorder is not None:
+            self.trace_keys = {
+                name: recorder.key("KoKoRoTTS", name)
+                for name in ["wait_segment", "synthesize", "pipeline_lock", "model_chunk", "deliver"]
+            }
+
+        # Metrics of the utterance being synthesized
+        self.utterance_start = None
+        self.utterance_epoch = 0
+        self.reset_stats()
 
     def run(self):
         while not self._stop_event.is_set():
+            if self.recorder is not None:
+                wait_start = time.perf_counter_ns()
             try:
-                text = self.buffer_in.get(timeout=1)
+                segment = self.buffer_in.get(timeout=1)
+            except queue.Empty:  # To check for stop_event flag
+                continue
+            if self.recorder is not None:
+                self.recorder.record(
+                    self.trace_keys["wait_segment"], wait_start, value=self.buffer_in.qsize()
+                )
+                synthesis_start = time.perf_counter_ns()
+            try:
+                self.synthesize(segment)
+            except Exception:  # The thread keeps serving the next segments
+                logging.exception(
+                    f"{ConsoleColors.RED}KoKoRoTTS:{ConsoleColors.RESET} Synthesis failed, segment dropped : {segment.text!r}"
+                )
+            if self.recorder is not None:
+                self.recorder.record(self.trace_keys["synthesize"], synthesis_start)
 
-                # Generate speech
-                start_time = time.time()
-                generator = self.pipeline(text, voice=self.voice)
+    def synthesize(self, segment):
+        """Generate the speech of one segment and send its audio chunks"""
+        if segment.epoch < self.epoch:
+            return  # Segment of an interrupted reply
+        if self.utterance_start is None or segment.epoch != self.utterance_epoch:
+            self.utterance_start = time.time()
+            self.utterance_epoch = segment.epoch
+            self.reset_stats()
+            if self.resampler is not None:
+                self.resampler.reset()
 
-                # Send sapeech
-                last_item = None
-                nb_chuncks = 0
-                try:
-                    while True:
-                        item = next(generator)
+        start_time = time.time()
+        self.segment_first_chunk = None
+        nb_chuncks = 0
+        if segment.text.strip():
+            generator = self.generate(segment.text)
+            if self.pipelined:
+                generator = ChunkPrefetcher(generator)
+            try:
+                if segment.is_final and self.delivery == "lookahead":
+                    # Keep one chunk of lookahead to flag the last chunk of the utterance
+                    last_item = None
+                    for item in generator:
                         if last_item is not None:
-                            gs, ps, audio = last_item
-                            if self.resampler is not None:
-                                audio = self.resampler(audio)
-                            self.callback(audio, False)  # Not final audio chunck
+                            # Not final audio chunck
+                            if not self.deliver(last_item, False, segment):
+                                break
                             nb_chuncks += 1
                         last_item = item
-                except StopIteration:  # Last Audio Chunck
-                    if last_item is not None:
-                        gs, ps, audio = last_item
-                        if self.resampler is not None:
-                            audio = self.resampler(audio)
-                        self.callback(audio, True)  # Not final audio chunck
+                    if last_item is not None:  # Last Audio Chunck
+                        if self.deliver(last_item, True, segment):
+                            nb_chuncks += 1
+                else:
+                    # Send every chunk as soon as it is ready
+                    for item in generator:
+                        if not self.deliver(item, False, segment):
+                            break
                         nb_chuncks += 1
+            finally:
+                # Stops the generator (or its worker) if the reply was interrupted
+                generator.close()
+        if segment.is_final and (nb_chuncks == 0 or self.delivery == "immediate"):
+            # Close the utterance with an empty chunk
+            with self.lock:
+                if segment.epoch >= self.epoch:
+                    self.callback(None, True, segment.epoch, segment.trace_id)
 
-                end_time = time.time()
-                logging.info(
-                    f"{ConsoleColors.BLUE}KoKoRoTTS:{ConsoleColors.RESET} End of Inference , delay = {end_time - start_time} (s), Nb audio chuncks : {nb_chuncks}"
-                )
-            except queue.Empty:  # To check for stop_event flag
-                continue
+        end_time = time.time()
+        logging.info(
+            f"{ConsoleColors.BLUE}KoKoRoTTS:{ConsoleColors.RESET} End of Inference , delay = {end_time - start_time} (s), Nb audio chuncks : {nb_chuncks}"
+        )
+        if segment.is_final:
+            self.log_stats()
+            self.utterance_start = None
+
+    def generate(self, text):
+        """Yield the (graphemes, phonemes, audio) chunks of the speech of `text`, from
+        the cache if the text was already synthesized"""
+        if self.cache is None or not self.cache.cacheable(text):
+            yield from self.synthesize_chunks(text)
+            return
+        key = self.cache.key(text, self.voice, self.sample_rate, self.model_name)
+        chunks = self.cache.get(key)
+        if chunks is not None:
+            yield from chunks
+            return
+        chunks = []
+        for gs, ps, audio in self.synthesize_chunks(text):
+            chunks.append((gs, ps, audio))
+            yield gs, ps, audio
+        # Not reached if the generator was closed, interrupted segments are not cached
+        self.cache.put(key, chunks)
+
+    def synthesize_chunks(self, text):
+        """Run the pipeline, the lock is only held while a chunk is generated"""
+        generator = self.pipeline(text, voice=self.voice)
+        try:
+            while True:
+                if self.recorder is None:
+                    with self.pipeline_lock:
+                        item = next(generator, None)
+                else:
+                    lock_start = time.perf_counter_ns()
+                    with self.pipeline_lock:
+                        model_start = time.perf_counter_ns()
+                        item = next(generator, None)
+                    self.recorder.record(self.trace_keys["pipeline_lock"], lock_start, model_start)
+                    self.recorder.record(
+                        self.trace_keys["model_chunk"],
+                        model_start,
+                        value=len(item[2]) if item is not None else -1,
+                    )
+                if item is None:
+                    return
+                yield item
+        finally:
+            generator.close()
+
+    def prewarm(self, phrases):
+        """Synthesize the phrases that are not cached yet"""
+        start_time = time.time()
+        for phrase in phrases:
+            for _ in self.generate(phrase):
+                pass
+        logging.info(
+            f"{ConsoleColors.BLUE}KoKoRoTTS:{ConsoleColors.RESET} Cache prewarmed with {len(phrases)} phrases in {time.time() - start_time} (s)"
+        )
+
+    def deliver(self, item, is_final, segment):
+        """Resample and send one generated chunk, updates the segment gap metrics.
+        Returns False if the reply was interrupted"""
+        if self.recorder is not None:
+            deliver_start = time.perf_counter_ns()
+        gs, ps, audio = item
+        if not isinstance(audio, np.ndarray):  # Already numpy from a TTS worker
+            audio = audio.numpy()
+        if self.resampler is not None:
+            audio = self.resampler.process(audio)
+        with self.lock:
+            if segment.epoch < self.epoch:
+                return False
+            self.send(gs, audio, is_final, segment)
+        if self.recorder is not None:
+            self.recorder.record(self.trace_keys["deliver"], deliver_start, value=len(audio))
+        return True
+
+    def send(self, gs, audio, is_final, segment):
+        now = time.time()
+        if self.first_chunk_time is None:
+            self.first_chunk_time = now
+        if self.segment_first_chunk is None:
+            self.segment_first_chunk = now
+            if self.last_chunk_time is not None:
+                # Time between the end of the previous segment and this one
+                self.segment_gaps.append(now - self.last_chunk_time)
+        # Audio already sent finished playing before this chunk => playback underrun
+        if self.playback_end is not None and now > self.playback_end:
+            self.underrun += now - self.playback_end
+        start = max(now, self.playback_end or now)
+        self.playback_end = start + len(audio) / self.sample_rate
+        self.playback.append((start, self.playback_end, gs))
+        self.last_chunk_time = now
+        self.callback(audio, is_final, segment.epoch, segment.trace_id)
+
+    def cancel(self, epoch, flush):
+        """Stop the current reply, `flush` drops the audio already sent. Returns the
+        text played so far, None if no reply was being synthesized or played"""
+        with self.lock:
+            self.epoch = epoch
+            flush()
+            now = time.time()
+            if not self.playback or (
+                self.utterance_start is None and self.playback_end <= now
+            ):
+                return None
+            # Estimate what was played assuming the output plays the chunks back to back
+            words = []
+            for start, end, gs in self.playback:
+                if start >= now:
+                    break
+                chunk_words = gs.split()
+                if end > now:  # Chunk being played, keep the words already spoken
+                    ratio = (now - start) / max(end - start, 1e-6)
+                    chunk_words = chunk_words[: int(len(chunk_words) * ratio)]
+                words.extend(chunk_words)
+            self.playback = []
+            return " ".join(words)
+
+    def reset_stats(self):
+        self.first_chunk_time = None
+        self.segment_first_chunk = None
+        self.last_chunk_time = None
+        self.playback_end = None
+        self.playback = []  # Estimated (start, end, text) of the chunks played
+        self.segment_gaps = []
+        self.underrun = 0.0
+
+    def log_stats(self):
+        max_gap = max(self.segment_gaps, default=0.0)
+        mean_gap = sum(self.segment_gaps) / max(len(self.segment_gaps), 1)
+        first_audio = (self.first_chunk_time or time.time()) - self.utterance_start
+        logging.info(
+            f"{ConsoleColors.BLUE}KoKoRoTTS:{ConsoleColors.RESET} End of Utterance, Time to first audio : {first_audio} (s), Nb segments : {len(self.segment_gaps) + 1}, Mean segment gap : {mean_gap} (s), Max segment gap : {max_gap} (s), Playback underrun : {self.underrun} (s)"
+        )
+        if self.cache is not None:
+            self.cache.log_stats()
 
     def stop(self):
         """Set the stop flag"""
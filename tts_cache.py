@@ -0,0 +1,181 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from console_colors import ConsoleColors
+
+
+def normalize_text(text):
+    """Cache key of a text : unicode normalized, single spaced. The case and the
+    punctuation are kept, they change the pronunciation and the prosody"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def to_numpy(audio):
+    """float32 numpy array of a chunk of audio, torch tensor or numpy array"""
+    if not isinstance(audio, np.ndarray):
+        audio = audio.detach().cpu().numpy()
+    return audio.astype(np.float32, copy=False)
+
+
+class AudioCache:
+    """Content addressed cache of the synthesized audio of short segments.
+
+    The entries are the chunks (graphemes, phonemes, audio) generated by the TTS
+    for a segment, the audio stored as float32 numpy arrays whether it came from
+    Kokoro (torch tensors) or from a TTS worker (numpy), keyed by the normalized text, the voice, the sample rate and the
+    model. They are kept in memory up to `max_bytes` of audio and evicted in least
+    recently used order. With `cache_dir` every entry is also written to disk as a
+    .npz file and loaded back on a memory miss, so the cache survives restarts.
+    The G2P results are memoized as well (see CachedG2P).
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, cache_dir=None, max_text_chars=120, max_g2p_entries=4096):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_text_chars = max_text_chars  # Longer segments are rarely repeated
+        self.max_g2p_entries = max_g2p_entries
+        self.entries = OrderedDict()  # key -> list of (graphemes, phonemes, audio)
+        self.g2p_entries = OrderedDict()  # normalized text -> G2P result
+        self.nb_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "g2p_hits": 0,
+            "g2p_misses": 0,
+            "evictions": 0,
+        }
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(text, voice, sample_rate, model):
+        data = json.dumps([normalize_text(text), voice, sample_rate, model])
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    def cacheable(self, text):
+        return 0 < len(normalize_text(text)) <= self.max_text_chars
+
+    def get(self, key):
+        """Chunks of the entry, None on a miss"""
+        with self.lock:
+            chunks = self.entries.get(key)
+            if chunks is not None:
+                self.entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return chunks
+        chunks = self.load(key)
+        with self.lock:
+            if chunks is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self.insert(key, chunks)
+        return chunks
+
+    def put(self, key, chunks):
+        chunks = [(gs, ps, to_numpy(audio)) for gs, ps, audio in chunks]
+        with self.lock:
+            if key in self.entries:
+                return
+            self.insert(key, chunks)
+        self.save(key, chunks)
+
+    def insert(self, key, chunks):
+        size = sum(audio.nbytes for _, _, audio in chunks)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = chunks
+        self.nb_bytes += size
+        while self.nb_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nb_bytes -= sum(audio.nbytes for _, _, audio in evicted)
+            self.stats["evictions"] += 1
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def save(self, key, chunks):
+        if self.cache_dir is None:
+            return
+        arrays = {f"audio_{i}": audio for i, (_, _, audio) in enumerate(chunks)}
+        text = json.dumps([[gs, ps] for gs, ps, _ in chunks])
+        tmp_path = self.path(key) + ".tmp.npz"
+        try:
+            np.savez(tmp_path, text=np.array(text), **arrays)
+            os.replace(tmp_path, self.path(key))  # Never leave a partial entry
+        except OSError as e:
+            logging.warning(
+                f"{ConsoleColors.YELLOW}AudioCache:{ConsoleColors.RESET} Could not write {key} : {e}"
+            )
+
+    def load(self, key):
+        if self.cache_dir is None or not os.path.exists(self.path(key)):
+            return None
+        try:
+            with np.load(self.path(key)) as data:
+                texts = json.loads(str(data["text"]))
+                return [
+                    (gs, ps, data[f"audio_{i}"])
+                    for i, (gs, ps) in enumerate(texts)
+                ]
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(
+                f"{ConsoleColors.YELLOW}AudioCache:{ConsoleColors.RESET} Could not read {key} : {e}"
+            )
+            return None
+
+    def get_g2p(self, text):
+        with self.lock:
+            result = self.g2p_entries.get(text)
+            if result is None:
+                self.stats["g2p_misses"] += 1
+                return None
+            self.g2p_entries.move_to_end(text)
+            self.stats["g2p_hits"] += 1
+        # Kokoro writes the timestamps in the tokens, each caller needs its own copy
+        return copy.deepcopy(result)
+
+    def put_g2p(self, text, result):
+        with self.lock:
+            self.g2p_entries[text] = copy.deepcopy(result)
+            while len(self.g2p_entries) > self.max_g2p_entries:
+                self.g2p_entries.popitem(last=False)
+
+    def log_stats(self):
+        stats = self.stats
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        hit_rate = (stats["hits"] + stats["disk_hits"]) / max(lookups, 1)
+        logging.info(
+            f"{ConsoleColors.BLUE}AudioCache:{ConsoleColors.RESET} Hit rate : {hit_rate:.2f}, Hits : {stats['hits']}, Disk hits : {stats['disk_hits']}, Misses : {stats['misses']}, G2P hits : {stats['g2p_hits']}, G2P misses : {stats['g2p_misses']}, Entries : {len(self.entries)}, Size : {self.nb_bytes / 2**20:.1f} MB, Evictions : {stats['evictions']}"
+        )
+
+
+class CachedG2P:
+    """Memoizes the G2P of a KPipeline. Kokoro phonemizes the text line by line, the
+    phonemes of a word depend on its context, so a whole line is the unit cached"""
+
+    def __init__(self, g2p, cache):
+        self.g2p = g2p
+        self.cache = cache
+
+    def __call__(self, text):
+        key = normalize_text(text)
+        result = self.cache.get_g2p(key)
+        if result is None:
+            result = self.g2p(text)
+            self.cache.put_g2p(key, result)
+        return result
+
+    def __getattr__(self, name):  # lexicon, fallback... of the wrapped G2P
+        return getattr(self.g2p, name)
@@ -6,12 +6,16 @@
 # * V02 : Streaming model with a buffer of 100ms
 # *  In V02, start streaming audio to the next module with Commit when it reaches end of speech
 
+import time
 from enum import Enum
 
 import retico_core
 from retico_core.audio import AudioIU, SpeechIU
 import logging
-import webrtcvad
+import numpy as np
+
+from audio_ring import RingAudioIU
+from vad_backends import create_backend
 
 from console_colors import ConsoleColors
 
@@ -39,7 +43,7 @@ class VAD(retico_core.AbstractModule):
 
     @staticmethod
     def output_iu():
-        return AudioIU
+        return RingAudioIU
 
     def __init__(
         self,
@@ -48,6 +52,14 @@ class VAD(retico_core.AbstractModule):
         frame_length=0.02,
         min_turn_length=0.1,
         max_silence_length=0.200,
+        interruption=None,
+        barge_in_length=0.200,
+        tracer=None,
+        endpointing=None,
+        backend="webrtc",
+        prefilter=False,
+        ring=None,
+        retention=None,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -56,95 +68,175 @@ class VAD(retico_core.AbstractModule):
         self.frame_length = frame_length
         self.min_turn_length = min_turn_length
         self.max_silence_length = max_silence_length
+        # Barge-in : speech length after which the agent reply is interrupted
+        self.interruption = interruption
+        self.barge_in_length = barge_in_length
+        # Counted in frames : a sum of float frame lengths drifts past the threshold
+        self.barge_in_frames = max(1, round(barge_in_length / frame_length))
+        # Latency tracing : a trace is started for every committed turn, see metrics.py
+        self.tracer = tracer
+        self.speech_end_time = None  # Monotonic time of the last speech frame
+        # Adaptive endpointing : the EndOfTurnPredictor (endpointing.py) sets the
+        # silence length of each turn instead of max_silence_length
+        self.endpointing = endpointing
+
+        # Frame classifier (vad_backends.py) : webrtc or energy, the prefilter skips
+        # the classifier on clearly silent frames
+        self.backend_name = backend
+        self.prefilter = prefilter
+        self.backend = None
+
+        # Shared audio ring (audio_ring.py) : the frames are written once and the
+        # forwarded IUs hold their sample range instead of a copy of the bytes
+        self.ring = ring
+        # IU retention (retention.py) : the input frames are released once classified
+        self.retention = retention
 
         self.speech_length = 0.0  # Total Length of speech detected
+        self.nb_speech_frames = 0
         self.silence_length = 0.0  # Total Length of silence detected
         self.state = VADState.SILENCE  # State of the module
 
+    def required_silence(self):
+        """Silence length after which the turn ends"""
+        if self.endpointing is not None:
+            return self.endpointing.required_silence()
+        return self.max_silence_length
+
     def setup(self):
-        self.vad = webrtcvad.Vad()
-        self.vad.set_mode(self.mode)
+        self.backend = create_backend(
+            self.backend_name, self.sample_rate, self.mode, self.prefilter
+        )
         logging.info(
             f"{ConsoleColors.BLUE} VAD:{self.state}:{ConsoleColors.RESET} Module setup done"
         )
 
     def process_update(self, update_message):
-        iu, ut = next(update_message)
-        # Receive one IU per message from the microphone module
-        is_speech = self.vad.is_speech(iu.raw_audio, self.sample_rate)
+        # The microphone sends one IU per message, when a message holds several frames
+        # they are classified in one call of the backend
+        ius = [iu for iu, _ in update_message]
+        if not ius:
+            return None
+        if self.ring is not None:
+            ranges = [self.ring_range(iu) for iu in ius]
+            frames = self.ring_frames(ranges)
+        else:
+            ranges = [None] * len(ius)
+            frames = np.stack([np.frombuffer(iu.raw_audio, dtype=np.int16) for iu in ius])
+        decisions = self.backend.is_speech_batch(frames)
+        # The debug messages are only formatted when they are printed
+        debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        output_message = retico_core.UpdateMessage()
+        for iu, is_speech, audio_range in zip(ius, decisions, ranges):
+            output = self.process_frame(iu, is_speech, debug, audio_range)
+            if output is not None:
+                output_message.add_iu(*output)
+        if self.retention is not None:
+            for iu in ius:
+                self.retention.release(iu)
+        return output_message if len(output_message) > 0 else None
+
+    def ring_range(self, iu):
+        """Sample range of the frame in the ring, written unless the source did"""
+        if isinstance(iu, RingAudioIU) and iu.ring is self.ring:
+            return iu.start, iu.end
+        return self.ring.write(iu.raw_audio)
+
+    def ring_frames(self, ranges):
+        """(n, frame_size) view of the frames, copied only if they are not consecutive"""
+        start, end = ranges[0][0], ranges[-1][1]
+        if all(r[1] == n[0] for r, n in zip(ranges, ranges[1:])) and (end - start) % len(ranges) == 0:
+            return self.ring.read(start, end).reshape(len(ranges), -1)
+        return np.stack([self.ring.read(*r) for r in ranges])
+
+    def output_audio(self, iu, audio_range):
+        """New IU with the audio of the frame `iu`"""
+        output_iu = self.create_iu()
+        if audio_range is not None:
+            output_iu.set_range(self.ring, *audio_range)
+        else:
+            output_iu.set_audio(iu.raw_audio, iu.nframes, iu.rate, iu.sample_width)
+        return output_iu
 
+    def process_frame(self, iu, is_speech, debug, audio_range=None):
+        """Update the turn state with one frame, returns the (IU, update type) to
+        forward or None. `audio_range` is the range of the frame in the ring"""
         # Speech Detected, Forward the audio to the next module
         if is_speech:
-            logging.debug(
-                f"{ConsoleColors.MAGENTA}VAD:{self.state}:{ConsoleColors.RESET} Speech Detected, speech_length = {self.speech_length}, silence_length = {self.silence_length}"
-            )
+            if debug:
+                logging.debug(
+                    f"{ConsoleColors.MAGENTA}VAD:{self.state}:{ConsoleColors.RESET} Speech Detected, speech_length = {self.speech_length}, silence_length = {self.silence_length}"
+                )
             self.state = VADState.SPEECH
             self.silence_length = 0.0
             self.speech_length += self.frame_length
+            self.nb_speech_frames += 1
+            self.speech_end_time = time.monotonic()
+            if self.endpointing is not None:
+                self.endpointing.update_audio(iu.raw_audio)
+            if (
+                self.interruption is not None
+                and self.nb_speech_frames == self.barge_in_frames
+            ):
+                self.interruption.trigger()
             # Forward to next modules
-            output_iu = self.create_iu()
-            output_iu.set_audio(iu.raw_audio, iu.nframes, iu.rate, iu.sample_width)
-            return retico_core.UpdateMessage.from_iu(
-                output_iu, retico_core.UpdateType.ADD
-            )
+            output_iu = self.output_audio(iu, audio_range)
+            output_iu.meta_data["is_speech"] = True
+            return output_iu, retico_core.UpdateType.ADD
         else:  # Silence
             self.silence_length += self.frame_length
             # case 01: Silence inside A TURN
             if self.state == VADState.SILENCE_TURN:
                 # case 01.1: Reached max silence allowed inside a single turn => End of Turn detected
-                if self.silence_length > self.max_silence_length:
+                if self.silence_length > self.required_silence():
+                    if self.endpointing is not None:
+                        self.endpointing.log_prediction(self.silence_length)
+                        self.endpointing.reset()
                     if self.speech_length >= self.min_turn_length:
                         logging.info(
                             f"{ConsoleColors.BLUE}VAD:{self.state}:{ConsoleColors.RESET}, Reached Max Silence Length, End of Turn Detected , Turn length = {self.speech_length}"
                         )
                         self.silence_length = 0.0
                         self.speech_length = 0.0
+                        self.nb_speech_frames = 0
                         self.state = VADState.SILENCE
-                        output_iu = self.create_iu()
-                        output_iu.set_audio(
-                            iu.raw_audio, iu.nframes, iu.rate, iu.sample_width
-                        )
-                        return retico_core.UpdateMessage.from_iu(
-                            output_iu, retico_core.UpdateType.COMMIT
-                        )
+                        output_iu = self.output_audio(iu, audio_range)
+                        if self.tracer is not None:
+                            output_iu.meta_data["trace_id"] = self.tracer.start_trace(
+                                self.speech_end_time
+                            )
+                        return output_iu, retico_core.UpdateType.COMMIT
                     else:
-                        logging.debug(
-                            f"{ConsoleColors.MAGENTA}VAD:{self.state}:{ConsoleColors.RESET}, Silence Detected, Reached Max Silence Length, End of Turn Detected but turn too short"
-                        )
+                        if debug:
+                            logging.debug(
+                                f"{ConsoleColors.MAGENTA}VAD:{self.state}:{ConsoleColors.RESET}, Silence Detected, Reached Max Silence Length, End of Turn Detected but turn too short"
+                            )
                         # Not enough speech to commit => Revoke the turn (noise...)
                         self.silence_length = 0.0
                         self.speech_length = 0.0
+                        self.nb_speech_frames = 0
                         self.state = VADState.SILENCE
-                        output_iu = self.create_iu()
-                        output_iu.set_audio(
-                            iu.raw_audio, iu.nframes, iu.rate, iu.sample_width
-                        )
-                        return retico_core.UpdateMessage.from_iu(
-                            output_iu, retico_core.UpdateType.REVOKE
-                        )
+                        output_iu = self.output_audio(iu, audio_range)
+                        return output_iu, retico_core.UpdateType.REVOKE
                 else:
-                    logging.debug(
-                        f"{ConsoleColors.MAGENTA}VAD:{self.state}:{ConsoleColors.RESET}, Silence Detected, Keep Buffering Silence silence_length = {self.silence_length}, speech_length = {self.speech_length}"
-                    )
+                    if debug:
+                        logging.debug(
+                            f"{ConsoleColors.MAGENTA}VAD:{self.state}:{ConsoleColors.RESET}, Silence Detected, Keep Buffering Silence silence_length = {self.silence_length}, speech_length = {self.speech_length}"
+                        )
                     self.state = VADState.SILENCE_TURN
-                    output_iu = self.create_iu()
-                    output_iu.set_audio(
-                        iu.raw_audio, iu.nframes, iu.rate, iu.sample_width
-                    )
-                    return retico_core.UpdateMessage.from_iu(
-                        output_iu, retico_core.UpdateType.ADD
-                    )
+                    output_iu = self.output_audio(iu, audio_range)
+                    output_iu.meta_data["is_speech"] = False
+                    return output_iu, retico_core.UpdateType.ADD
             # case 02: started detecting silence inside a turn
             elif self.state == VADState.SPEECH:
-                logging.debug(
-                    f"{ConsoleColors.MAGENTA}VAD:{self.state}:{ConsoleColors.RESET}, Silence Detected, Started Silence State"
-                )
+                if debug:
+                    logging.debug(
+                        f"{ConsoleColors.MAGENTA}VAD:{self.state}:{ConsoleColors.RESET}, Silence Detected, Started Silence State"
+                    )
                 self.silence_length += self.frame_length
                 self.state = VADState.SILENCE_TURN
-                output_iu = self.create_iu()
-                output_iu.set_audio(iu.raw_audio, iu.nframes, iu.rate, iu.sample_width)
-                return retico_core.UpdateMessage.from_iu(
-                    output_iu, retico_core.UpdateType.ADD
-                )
+                output_iu = self.output_audio(iu, audio_range)
+                output_iu.meta_data["is_speech"] = False
+                return output_iu, retico_core.UpdateType.ADD
             elif self.state == VADState.SILENCE:
                 return None  # Not Inside a turn, ignore the audio
@@ -0,0 +1,127 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+import webrtcvad
+
+
+def frame_power(frames):
+    """Mean power of each row of a (n, frame_size) int16 array, in int16 units squared"""
+    x = frames.astype(np.float32)
+    return np.einsum("ij,ij->i", x, x) / frames.shape[1]
+
+
+def frame_features(frames):
+    """Energy (dBFS) and zero crossing rate of each row of a (n, frame_size) int16 array"""
+    x = frames.astype(np.float32) * (1.0 / 32768.0)
+    energy = 10 * np.log10(np.mean(x * x, axis=1) + 1e-10)
+    signs = np.signbit(x)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (x.shape[1] - 1)
+    return energy, zcr
+
+
+class VADBackend(ABC):
+    """Speech / non-speech classifier of 16 bits PCM frames.
+
+    `is_speech_batch` classifies several frames in one call, the frames may come from
+    several audio streams : `streams` gives the stream of each frame for the backends
+    that keep a state per stream (frames of a stream must be in order).
+    """
+
+    def __init__(self, sample_rate=16000):
+        self.sample_rate = sample_rate
+
+    @abstractmethod
+    def is_speech_batch(self, frames, streams=None):
+        """`frames` : (n, frame_size) int16 array, returns a (n,) bool array"""
+        pass
+
+    def is_speech(self, raw_audio, stream=0):
+        frames = np.frombuffer(raw_audio, dtype=np.int16)[None, :]
+        return bool(self.is_speech_batch(frames, [stream])[0])
+
+
+class WebRTCBackend(VADBackend):
+    """webrtcvad, one classifier per stream (it smooths its decisions over time)"""
+
+    def __init__(self, sample_rate=16000, mode=3):
+        super().__init__(sample_rate)
+        self.mode = mode
+        self.vads = {}
+
+    def get_vad(self, stream):
+        vad = self.vads.get(stream)
+        if vad is None:
+            vad = self.vads[stream] = webrtcvad.Vad(self.mode)
+        return vad
+
+    def is_speech_batch(self, frames, streams=None):
+        result = np.zeros(len(frames), dtype=bool)
+        for i, frame in enumerate(frames):
+            vad = self.get_vad(0 if streams is None else streams[i])
+            result[i] = vad.is_speech(frame.tobytes(), self.sample_rate)
+        return result
+
+
+class EnergyBackend(VADBackend):
+    """Energy and zero crossing rate thresholds : voiced speech is loud with a low
+    zero crossing rate, fricatives and noise have a high one"""
+
+    def __init__(self, sample_rate=16000, speech_db=-40.0, max_zcr=0.35):
+        super().__init__(sample_rate)
+        self.speech_db = speech_db
+        self.max_zcr = max_zcr
+
+    def is_speech_batch(self, frames, streams=None):
+        energy, zcr = frame_features(frames)
+        return (energy > self.speech_db) & (zcr < self.max_zcr)
+
+
+class PrefilterBackend(VADBackend):
+    """Runs `backend` only on the frames that are not clearly silent.
+
+    The power of the whole batch is computed in one NumPy call, the frames below
+    `silence_db` are classified as silence without calling the wrapped backend.
+    A stateful backend does not see the skipped frames, they are far below the level
+    of speech so they would not have changed its decisions.
+    """
+
+    def __init__(self, backend, silence_db=-50.0):
+        super().__init__(backend.sample_rate)
+        self.backend = backend
+        self.silence_db = silence_db
+        self.silence_power = 32768.0**2 * 10 ** (silence_db / 10)
+        self.nb_frames = 0
+        self.nb_skipped = 0
+
+    def is_speech_batch(self, frames, streams=None):
+        if len(frames) == 1:  # One frame per call from the microphone, no bookkeeping
+            self.nb_frames += 1
+            if frame_power(frames)[0] < self.silence_power:
+                self.nb_skipped += 1
+                return np.zeros(1, dtype=bool)
+            return self.backend.is_speech_batch(frames, streams)
+        candidates = frame_power(frames) >= self.silence_power
+        result = np.zeros(len(frames), dtype=bool)
+        self.nb_frames += len(frames)
+        self.nb_skipped += len(frames) - int(candidates.sum())
+        if candidates.any():
+            candidate_streams = None
+            if streams is not None:
+                candidate_streams = np.asarray(streams)[candidates]
+            result[candidates] = self.backend.is_speech_batch(
+                frames[candidates], candidate_streams
+            )
+        return result
+
+
+def create_backend(name="webrtc", sample_rate=16000, mode=3, prefilter=False, silence_db=-50.0):
+    """VAD backend by name : webrtc or energy, optionally behind the energy prefilter"""
+    if name == "webrtc":
+        backend = WebRTCBackend(sample_rate, mode)
+    elif name == "energy":
+        backend = EnergyBackend(sample_rate)
+    else:
+        raise ValueError(f"Unknown VAD backend : {name}")
+    if prefilter:
+        backend = PrefilterBackend(backend, silence_db)
+    return backend
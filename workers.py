@@ -0,0 +1,350 @@
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from console_colors import ConsoleColors
+
+# An array placed at the start of the shared memory of a worker
+SharedArray = namedtuple("SharedArray", ["shape", "dtype"])
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process died while handling a request, it is being restarted"""
+
+
+def to_shared(shm, value):
+    """Copy an array into the shared memory and return its descriptor, other values
+    (and the arrays that do not fit) are sent through the queue as they are"""
+    if not isinstance(value, np.ndarray) or value.nbytes > shm.size:
+        return value
+    view = np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)
+    view[...] = value
+    return SharedArray(value.shape, value.dtype.str)
+
+
+def from_shared(shm, value, copy=False):
+    """The array of a descriptor (a view of the shared memory unless `copy`)"""
+    if not isinstance(value, SharedArray):
+        return value
+    view = np.ndarray(value.shape, dtype=np.dtype(value.dtype), buffer=shm.buf)
+    return view.copy() if copy else view
+
+
+class WorkerProcess:
+    """A model served by a dedicated process.
+
+    Inference runs outside the interpreter of the pipeline, so the 20ms microphone,
+    VAD and speaker threads never wait for the GIL held by a long torch call. The
+    requests are small control messages on a queue, the audio and the features go
+    through a shared memory block : one request at a time, its array (input or
+    output) is written at the start of the block and read in place or copied by the
+    other side before the next request.
+
+    The process is watched : if it dies, the request in progress fails with
+    WorkerCrashed and the process is restarted (the model is loaded again), up to
+    `max_restarts` times.
+    """
+
+    def __init__(self, kind, config, shm_size, max_restarts=5):
+        self.kind = kind  # Handler of the worker, see HANDLERS
+        self.config = config  # Arguments of the handler, loads the model in the worker
+        self.max_restarts = max_restarts
+        self.context = multiprocessing.get_context("spawn")
+        self.shm = shared_memory.SharedMemory(create=True, size=shm_size)
+        self.lock = threading.Lock()  # One request at a time
+        self.ids = itertools.count()
+        self.restarts = 0
+        self.ready = False
+        self.stopping = False
+        self.process = None
+        self.start_process()
+        self.monitor = threading.Thread(target=self.watch, daemon=True)
+        self.monitor.start()
+
+    def start_process(self):
+        # New queues, a process killed while writing may leave the old ones corrupted
+        self.requests = self.context.Queue()
+        self.responses = self.context.Queue()
+        self.ready = False
+        self.process = self.context.Process(
+            target=worker_main,
+            args=(
+                self.kind,
+                self.config,
+                self.shm.name,
+                self.requests,
+                self.responses,
+                logging.getLogger().level,
+            ),
+            name=f"{self.kind}-worker",
+            daemon=True,
+        )
+        self.process.start()
+
+    def wait_ready(self):
+        """Wait until the model is loaded in the worker"""
+        with self.lock:
+            while not self.ready:
+                message = self.receive()
+                if message is None:
+                    raise RuntimeError(
+                        f"{self.kind} worker exited while loading (exit code {self.process.exitcode})"
+                    )
+                if message[0] == "ready":
+                    self.ready = True
+
+    def call(self, name, *args):
+        """Run the method `name` of the handler in the worker and return its result"""
+        with self.lock:
+            if not self.process.is_alive():
+                self.recover()
+            request_id = next(self.ids)
+            self.requests.put(
+                (name, request_id) + tuple(to_shared(self.shm, arg) for arg in args)
+            )
+            while True:
+                message = self.receive()
+                if message is None:
+                    self.recover()
+                    raise WorkerCrashed(f"{self.kind} worker died during {name}")
+                if message[0] == "ready":
+                    self.ready = True
+                elif message[1] != request_id:
+                    continue  # Answer to a request of a previous process
+                elif message[0] == "error":
+                    raise RuntimeError(f"{self.kind} worker : {message[2]}")
+                else:
+                    result = message[2]
+                    if isinstance(result, tuple) and not isinstance(result, SharedArray):
+                        return tuple(from_shared(self.shm, value, copy=True) for value in result)
+                    return from_shared(self.shm, result, copy=True)
+
+    def receive(self):
+        """Next message of the worker, None if the process died"""
+        while True:
+            try:
+                return self.responses.get(timeout=0.5)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    return None
+
+    def recover(self):
+        """Restart the dead process, called with the lock held"""
+        logging.error(
+            f"{ConsoleColors.RED}WorkerProcess:{ConsoleColors.RESET} {self.kind} worker died (exit code {self.process.exitcode}), Restarts : {self.restarts}"
+        )
+        if self.stopping or self.restarts >= self.max_restarts:
+            raise RuntimeError(f"{self.kind} worker is not running")
+        self.restarts += 1
+        for q in (self.requests, self.responses):
+            q.cancel_join_thread()
+            q.close()
+        self.start_process()
+
+    def watch(self):
+        """Restart the process as soon as it dies, not at the next request"""
+        while not self.stopping:
+            self.process.join(1.0)
+            if self.stopping or self.process.is_alive() or not self.ready:
+                continue  # A crash while loading is reported by wait_ready or call
+            with self.lock:
+                if not self.stopping and not self.process.is_alive():
+                    try:
+                        self.recover()
+                    except RuntimeError:
+                        return
+
+    def stop(self):
+        self.stopping = True
+        self.requests.put(("stop", None))
+        self.process.join(5.0)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.shm.close()
+        self.shm.unlink()
+
+
+def worker_main(kind, config, shm_name, requests, responses, log_level):
+    """Entry point of the worker process"""
+    logging.basicConfig(level=log_level)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    handler = HANDLERS[kind](**config)
+    responses.put(("ready", None))
+    while True:
+        message = requests.get()
+        name, request_id = message[0], message[1]
+        if name == "stop":
+            break
+        try:
+            args = [from_shared(shm, value) for value in message[2:]]
+            result = getattr(handler, name)(*args)
+            del args  # Views of the shared memory
+            if isinstance(result, tuple):
+                result = tuple(to_shared(shm, value) for value in result)
+            else:
+                result = to_shared(shm, result)
+            responses.put(("result", request_id, result))
+        except Exception as e:
+            logging.exception(f"{kind} worker : {name} failed")
+            responses.put(("error", request_id, repr(e)))
+    try:
+        shm.close()
+    except BufferError:  # A view of the shared memory is still referenced
+        pass
+
+
+class ASRHandler:
+    """Whisper in the ASR worker"""
+
+    def __init__(self, model_id, device, **options):
+        from asr import WhisperResources
+
+        self.resources = WhisperResources(model_id, device, **options)
+
+    def transcribe(self, features):
+        import torch
+
+        resources = self.resources
+        input_features = torch.from_numpy(features)[None].to(
+            resources.device, dtype=resources.torch_dtype
+        )
+        with torch.inference_mode():
+            predicted_ids = resources.model.generate(
+                input_features, **resources.generate_kwargs, **resources.assisted_kwargs
+            )
+        return resources.processor.batch_decode(predicted_ids, skip_special_tokens=True)[0]
+
+    def pipe(self, audio, kwargs):
+        if "return_timestamps" not in kwargs:
+            kwargs["generate_kwargs"] = self.resources.assisted_kwargs
+        return self.resources.pipe(audio.copy(), **kwargs)
+
+    def warmup(self, word_timestamps):
+        self.resources.warmup(word_timestamps=word_timestamps)
+
+
+class TTSHandler:
+    """Kokoro in the TTS worker, one generator per utterance segment"""
+
+    def __init__(self, model_args):
+        from tts import KokoroResources
+
+        self.resources = KokoroResources(model_args)
+        self.generators = {}
+
+    def start(self, generator_id, text, voice):
+        self.generators[generator_id] = self.resources.pipeline(text, voice=voice)
+
+    def next(self, generator_id):
+        """Next (graphemes, phonemes, audio) chunk, None at the end"""
+        generator = self.generators.get(generator_id)
+        if generator is None:  # Started in a previous process, ended by the crash
+            return None
+        item = next(generator, None)
+        if item is None:
+            del self.generators[generator_id]
+            return None
+        gs, ps, audio = item
+        return gs, ps, audio.numpy().astype(np.float32, copy=False)
+
+    def close(self, generator_id):
+        generator = self.generators.pop(generator_id, None)
+        if generator is not None:
+            generator.close()
+
+    def warmup(self, voice):
+        self.resources.warmup(voice)
+
+
+HANDLERS = {"asr": ASRHandler, "tts": TTSHandler}
+
+
+class ASRWorker:
+    """Whisper in a worker process, used by the ASR module as its resources and its
+    engine : the log-mel features are still computed in the pipeline while the user
+    speaks, only the decoding runs in the worker. The feature extractor and the
+    tokenizer are loaded here too, the model only in the worker."""
+
+    def __init__(self, model_id, device=None, shm_size=4 * 2**20, **options):
+        from transformers import AutoProcessor
+
+        self.worker = WorkerProcess(
+            "asr", {"model_id": model_id, "device": device, **options}, shm_size
+        )
+        self.processor = AutoProcessor.from_pretrained(model_id)
+        # Of the features, the model is on `device` in the worker (chosen there if None)
+        self.device = "cpu"
+        self.torch_dtype = None
+        self.model = None
+        self.generate_kwargs = {}
+        self.assisted_kwargs = {}  # Applied in the worker
+        self.lock = threading.Lock()
+        self.worker.wait_ready()
+
+    def transcribe(self, features, nb_frames=None):
+        try:
+            return self.worker.call("transcribe", features)
+        except RuntimeError as e:  # Crashed or failed, the ASR keeps running
+            logging.error(f"{ConsoleColors.RED}ASRWorker:{ConsoleColors.RESET} {e}, turn lost")
+            return ""
+
+    def pipe(self, audio, **kwargs):
+        """Transformers pipeline call (long turns and streaming mode)"""
+        kwargs.pop("generate_kwargs", None)  # The worker uses its own
+        try:
+            return self.worker.call("pipe", audio, kwargs)
+        except RuntimeError as e:
+            logging.error(f"{ConsoleColors.RED}ASRWorker:{ConsoleColors.RESET} {e}, audio lost")
+            return {"text": "", "chunks": []}
+
+    def warmup(self, word_timestamps=False):
+        self.worker.call("warmup", word_timestamps)
+
+    def stop(self):
+        self.worker.stop()
+
+
+class TTSWorker:
+    """Kokoro in a worker process, used by the TTS module as its resources. The
+    pipeline yields the chunks as they are synthesized in the worker, the audio is
+    read from the shared memory. The G2P memo of the TTS cache lives with the
+    pipeline and is not used, the audio cache is."""
+
+    def __init__(self, model_args, shm_size=4 * 2**20):
+        self.worker = WorkerProcess("tts", {"model_args": model_args}, shm_size)
+        self.lock = threading.Lock()  # Held by the TTS while a chunk is generated
+        self.ids = itertools.count()
+        self.worker.wait_ready()
+
+    def pipeline(self, text, voice):
+        generator_id = next(self.ids)
+        done = False
+        try:
+            self.worker.call("start", generator_id, text, voice)
+            while True:
+                item = self.worker.call("next", generator_id)
+                if item is None:
+                    done = True
+                    return
+                yield item
+        except RuntimeError as e:  # Crashed or failed, the TTS keeps running
+            done = True
+            logging.error(f"{ConsoleColors.RED}TTSWorker:{ConsoleColors.RESET} {e}, segment truncated")
+        finally:
+            if not done:  # Interrupted, free the generator of the worker
+                try:
+                    self.worker.call("close", generator_id)
+                except RuntimeError:
+                    pass
+
+    def warmup(self, voice="am_fenrir"):
+        self.worker.call("warmup", voice)
+
+    def stop(self):
+        self.worker.stop()